@@ -0,0 +1,146 @@
+# Amortization schedules for liabilities, computed in closed form over NumPy arrays
+# (no per-period Python loop) and cached until the liability row changes.
+
+import datetime, math, threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+PERIODS_PER_YEAR = {
+    "weekly": 52,
+    "biweekly": 26,
+    "monthly": 12,
+    "quarterly": 4,
+    "yearly": 1,
+    "annually": 1,
+}
+MAX_PERIODS = 1200  # hard stop for schedules that amortize too slowly to list in full
+SCHEDULE_CACHE_SIZE = 1024
+
+# Fields that determine a schedule or appear in it; any change to them produces a new cache key
+SCHEDULE_FIELDS = ("id", "liability_type", "remaining_amount_cents", "installment_amount_cents", "interest_rate",
+                   "frequency", "next_due_date", "installments_paid", "is_completed")
+
+_cache = OrderedDict()
+_stats = {"hits": 0, "misses": 0}
+_cache_lock = threading.Lock()
+
+def periods_remaining(balance_cents: float, installment_cents: float, annual_rate: float, frequency: Optional[str]):
+    """Number of installments needed to clear the balance, or None if it never amortizes"""
+    if balance_cents <= 0:
+        return 0
+    freq = (frequency or "monthly").lower()
+    if freq == "one-time" or installment_cents <= 0:
+        return 1 if freq == "one-time" else None
+    r = (annual_rate or 0.0) / 100.0 / PERIODS_PER_YEAR.get(freq, 12)
+    if r == 0:
+        return math.ceil(balance_cents / installment_cents)
+    if installment_cents <= balance_cents * r:
+        return None
+    n = -math.log(1 - r * balance_cents / installment_cents) / math.log(1 + r)
+    return math.ceil(n - 1e-9)
+
+def due_dates(first_due: str, frequency: Optional[str], count: int) -> np.ndarray:
+    """Vectorized due dates: month-based frequencies keep the day of month, clamped to month end"""
+    start = np.datetime64(datetime.date.fromisoformat(first_due[:10]), "D")
+    freq = (frequency or "monthly").lower()
+    k = np.arange(count)
+    if freq in ("weekly", "biweekly"):
+        return start + k * np.timedelta64(7 if freq == "weekly" else 14, "D")
+    step = {"monthly": 1, "quarterly": 3}.get(freq, 12 if freq in ("yearly", "annually") else 1)
+    month_starts = start.astype("datetime64[M]") + k * step
+    days_in_month = ((month_starts + 1).astype("datetime64[D]") - month_starts.astype("datetime64[D]")).astype(int)
+    day = int((start - start.astype("datetime64[M]").astype("datetime64[D]")).astype(int)) + 1
+    return month_starts.astype("datetime64[D]") + np.minimum(day, days_in_month) - 1
+
+def build_schedule(liability: dict) -> dict:
+    """Full amortization table for one liability from its current remaining balance"""
+    balance0 = float(liability["remaining_amount_cents"] or 0)
+    payment = float(liability["installment_amount_cents"] or 0)
+    frequency = (liability.get("frequency") or "monthly").lower()
+    annual_rate = float(liability.get("interest_rate") or 0.0)
+    first_due = liability.get("next_due_date") or datetime.date.today().isoformat()
+
+    warning = None
+    if liability.get("is_completed") or balance0 <= 0:
+        n, amortizing = 0, True
+    elif frequency == "one-time":
+        n, amortizing, payment = 1, True, balance0
+    else:
+        n = periods_remaining(balance0, payment, annual_rate, frequency)
+        amortizing = n is not None
+        if not amortizing:
+            # The balance only grows; one year of periods shows that without a 1200-row table
+            n = PERIODS_PER_YEAR.get(frequency, 12)
+            warning = ("installment does not cover the interest; the balance is never paid off" if payment > 0
+                       else "no installment amount; the balance is never paid off")
+        elif n > MAX_PERIODS:
+            n, warning = MAX_PERIODS, f"schedule truncated after {MAX_PERIODS} periods"
+
+    r = 0.0 if frequency == "one-time" else annual_rate / 100.0 / PERIODS_PER_YEAR.get(frequency, 12)
+    k = np.arange(n + 1, dtype=float)
+    growth = (1.0 + r) ** k
+    # Closed-form balance after k payments: B0(1+r)^k - P((1+r)^k - 1)/r
+    annuity = k if r == 0 else (growth - 1.0) / r
+    balances = np.maximum(balance0 * growth - payment * annuity, 0.0)
+    opening = balances[:-1]
+    interest = opening * r
+    payments = np.minimum(np.full(n, payment), opening + interest)
+    principal = payments - interest
+    closing = opening + interest - payments
+    if amortizing and n and warning is None:
+        closing[-1] = 0.0
+    dates = due_dates(first_due, frequency, n).astype(str) if n else np.array([], dtype=str)
+
+    paid_before = int(liability.get("installments_paid") or 0)
+    rows = [{
+        "period": paid_before + i + 1,
+        "due_date": d,
+        "payment": p,
+        "interest": it,
+        "principal": pr,
+        "balance": b,
+    } for i, (d, p, it, pr, b) in enumerate(zip(
+        dates.tolist(),
+        (np.round(payments) / 100).tolist(),
+        (np.round(interest) / 100).tolist(),
+        (np.round(principal) / 100).tolist(),
+        (np.round(closing) / 100).tolist(),
+    ))]
+
+    return {
+        "liability_id": liability["id"],
+        "liability_type": liability.get("liability_type"),
+        "frequency": frequency,
+        "interest_rate": annual_rate,
+        "remaining_amount": balance0 / 100,
+        "installment_amount": payment / 100,
+        "periods": n,
+        "amortizing": amortizing,
+        "total_interest": round(float(interest.sum()) / 100, 2),
+        "total_payments": round(float(payments.sum()) / 100, 2),
+        "payoff_date": rows[-1]["due_date"] if rows and amortizing and warning is None else None,
+        "warning": warning,
+        "schedule": rows,
+    }
+
+def cached_schedule(liability: dict) -> dict:
+    """build_schedule with an LRU cache keyed on the fields the schedule depends on"""
+    key = tuple(liability.get(f) for f in SCHEDULE_FIELDS)
+    with _cache_lock:
+        if key in _cache:
+            _stats["hits"] += 1
+            _cache.move_to_end(key)
+            return _cache[key]
+        _stats["misses"] += 1
+    schedule = build_schedule(liability)
+    with _cache_lock:
+        _cache[key] = schedule
+        while len(_cache) > SCHEDULE_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return schedule
+
+def cache_stats() -> dict:
+    with _cache_lock:
+        return {"entries": len(_cache), **_stats}
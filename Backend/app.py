@@ -1,12 +1,26 @@
 
-import os, json, sqlite3, datetime, uuid, jwt
+import os, io, re, json, base64, hashlib, hmac, itertools, math, secrets, sqlite3, datetime, threading, time, uuid, zlib, jwt
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from pydantic import BaseModel
 from typing import Optional, List, Literal
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import amortization
+import asset_resolver
+import auth_cache
+import categorizer
+import forecast
+import merchants
+import metrics
+import passwords
+import payoff_planner
+import rate_limit
+import scheduler
+import statement_import
+import tracing
 
 # ------------------- Load env -------------------
 load_dotenv()
@@ -14,23 +28,246 @@ DB_PATH      = os.getenv("DB_PATH", "finance.db")
 ORIGINS      = os.getenv("CORS_ALLOW_ORIGINS", "*")
 JWT_SECRET   = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
 JWT_ALGORITHM = "HS256"
+LEDGER_SNAPSHOT_INTERVAL = int(os.getenv("LEDGER_SNAPSHOT_INTERVAL", "100"))  # entries between balance snapshots
+ANOMALY_Z_SCORE = float(os.getenv("ANOMALY_Z_SCORE", "3"))  # standard deviations above the category mean
+ANOMALY_MIN_SAMPLES = int(os.getenv("ANOMALY_MIN_SAMPLES", "5"))  # expenses in a category before amounts are judged
+ANOMALY_MIN_RATIO = 1.5  # and never flag less than 1.5x the mean, however tight the history
+DUPLICATE_WINDOW_DAYS = int(os.getenv("DUPLICATE_WINDOW_DAYS", "2"))
 
-# lazy import to avoid import-time errors if package missing
-from cerebras.cloud.sdk import Cerebras
+# The Cerebras SDK is the slowest import by far; cerebras_client() imports it on first LLM use
 # No global client - each user uses their own API key
 LLM_MODEL = "llama-4-scout-17b-16e-instruct"
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": ORIGINS}})
 
-# ------------------- DB helpers -------------------
+# ------------------- Metrics -------------------
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # when set, /metrics requires it as a Bearer token
+# Without a token /metrics is open only if this allows it; gunicorn.conf.py turns it off
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "1") == "1"
+
+HTTP_REQUESTS = metrics.Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = metrics.Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+HTTP_DB_TIME = metrics.Histogram("http_request_db_seconds", "SQLite time spent per HTTP request", ("route",))
+HTTP_IN_FLIGHT = metrics.Gauge("http_requests_in_flight", "HTTP requests being served")
+HTTP_EXCEPTIONS = metrics.Counter("http_request_exceptions_total", "Unhandled exceptions by route", ("route", "exception"))
+LLM_LATENCY = metrics.Histogram("llm_request_duration_seconds", "LLM call latency by model and outcome",
+                                ("model", "outcome"), metrics.LLM_BUCKETS)
+SQLITE_LATENCY = metrics.Histogram("sqlite_query_duration_seconds", "SQLite execute and fetch time by statement",
+                                   ("statement",), metrics.QUERY_BUCKETS)
+SQLITE_CONNECTIONS = metrics.Counter("sqlite_connections_opened_total", "SQLite connections opened")
+SQLITE_OPEN = metrics.Gauge("sqlite_connections_open", "SQLite connections currently open")
+CACHE_ENTRIES = metrics.Gauge("cache_entries", "Entries held by in-process caches", ("cache",))
+CACHE_HITS = metrics.Counter("cache_hits_total", "In-process cache hits", ("cache",))
+CACHE_MISSES = metrics.Counter("cache_misses_total", "In-process cache misses", ("cache",))
+
+CACHES = {
+    "auth_tokens": auth_cache,
+    "merchants": merchants,
+    "category_models": categorizer,
+    "amortization": amortization,
+    "asset_resolver": asset_resolver,
+    "forecast": forecast,
+}
+
+# SQLite time of the request being served on this thread
+_request_db_time = threading.local()
+
+@metrics.collector
+def collect_cache_stats():
+    for name, module in CACHES.items():
+        stats = module.cache_stats()
+        CACHE_ENTRIES.set(stats["entries"], cache=name)
+        CACHE_HITS.set(stats["hits"], cache=name)
+        CACHE_MISSES.set(stats["misses"], cache=name)
+
+def metrics_route() -> str:
+    # The URL rule, not the path, so ids do not explode the label set
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+@app.before_request
+def start_request_metrics():
+    request.metrics_started = time.perf_counter()
+    _request_db_time.seconds = 0.0
+    HTTP_IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    started = getattr(request, "metrics_started", None)
+    if started is not None:
+        route = metrics_route()
+        HTTP_LATENCY.observe(time.perf_counter() - started, method=request.method, route=route)
+        HTTP_DB_TIME.observe(_request_db_time.seconds, route=route)
+        HTTP_REQUESTS.inc(method=request.method, route=route, status=response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if getattr(request, "metrics_started", None) is not None:
+        HTTP_IN_FLIGHT.dec()
+    if exc is not None:
+        HTTP_EXCEPTIONS.inc(route=metrics_route(), exception=type(exc).__name__)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of every metric above"""
+    if not METRICS_TOKEN and not METRICS_PUBLIC:
+        return jsonify({"error": "Metrics are disabled; set METRICS_TOKEN (or METRICS_PUBLIC=1 on a private bind)"}), 403
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        return jsonify({"error": "Unauthorized"}), 401
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# ------------------- Tracing -------------------
+@app.before_request
+def start_request_trace():
+    route = metrics_route()
+    request.trace_span = tracing.begin(f"{request.method} {route}", request.headers.get(tracing.REQUEST_ID_HEADER),
+                                       request.headers.get("traceparent"),
+                                       **{"http.method": request.method, "http.route": route})
+
+@app.after_request
+def tag_request_trace(response):
+    root = getattr(request, "trace_span", None)
+    if root is not None:
+        response.headers[tracing.REQUEST_ID_HEADER] = root.trace.request_id
+        root.set(**{"http.status_code": response.status_code})
+        if response.status_code >= 500 and root.error is None:
+            root.error = f"HTTP {response.status_code}"
+    return response
+
+@app.teardown_request
+def end_request_trace(exc):
+    root = getattr(request, "trace_span", None)
+    if root is not None:
+        tracing.end(root, exc, **{"db.seconds": round(getattr(_request_db_time, "seconds", 0.0), 6)})
+
+TRACES = metrics.Counter("traces_total", "Kept traces by export outcome", ("outcome",))
+
+@metrics.collector
+def collect_trace_stats():
+    stats = tracing.stats()
+    for outcome in ("exported", "dropped", "failed"):
+        TRACES.set(stats[outcome], outcome=outcome)
 
 # ------------------- DB helpers -------------------
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+_schema_ready = [False]
+_schema_lock = threading.Lock()
+
+SQL_STATEMENT_KINDS = {"select", "insert", "update", "delete"}
+SQLITE_TIMERS = {kind: SQLITE_LATENCY.labels(statement=kind) for kind in SQL_STATEMENT_KINDS | {"other", "fetch", "commit"}}
+
+def record_query(kind: str, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    SQLITE_TIMERS[kind].observe(elapsed)
+    _request_db_time.seconds = getattr(_request_db_time, "seconds", 0.0) + elapsed
+
+_SQL_TOKEN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|[()]|[A-Za-z_]+")
+
+def statement_kind(sql: str) -> str:
+    word = sql.lstrip()[:6].lower()
+    if word in SQL_STATEMENT_KINDS:
+        return word
+    if not word.startswith("with"):
+        return "other"
+    # WITH ... AS (...) [, ...] then the statement itself: its first keyword outside parentheses
+    depth = 0
+    for match in _SQL_TOKEN.finditer(sql):
+        token = match.group()
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            token = token.lower()
+            if token in SQL_STATEMENT_KINDS:
+                return token
+            if token == "replace":
+                return "insert"
+    return "other"
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Times statements and bulk fetches into sqlite_query_duration_seconds. execute() already
+    steps to the first row, so fetchone() and iteration are left untimed.
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(statement_kind(sql), started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(statement_kind(sql), started)
+
+    def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args, **kwargs)
+        finally:
+            record_query("fetch", started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            record_query("fetch", started)
+
+class InstrumentedConnection(sqlite3.Connection):
+    closed = False
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            with tracing.span("sqlite.commit"):
+                super().commit()
+        finally:
+            record_query("commit", started)
+        for fn in self.__dict__.pop("_after_commit", ()):
+            fn()
+
+    def rollback(self):
+        self.__dict__.pop("_after_commit", None)
+        super().rollback()
+
+    def after_commit(self, fn) -> None:
+        """Run fn() once the current transaction commits; a rollback discards it"""
+        self.__dict__.setdefault("_after_commit", []).append(fn)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            SQLITE_OPEN.dec()
+        super().close()
+
+def connect():
+    conn = sqlite3.connect(DB_PATH, factory=InstrumentedConnection)
     conn.row_factory = sqlite3.Row
+    SQLITE_CONNECTIONS.inc()
+    SQLITE_OPEN.inc()
     return conn
 
+def get_conn():
+    # The schema is checked on first use rather than at import (see ensure_schema)
+    if not _schema_ready[0]:
+        ensure_schema()
+    return connect()
+
 def now_iso():
     return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
@@ -51,24 +288,137 @@ def generate_secret_key() -> str:
     return ''.join(secrets.choice(alphabet) for _ in range(12))
 
 # ------------------- JWT helpers -------------------
+# Access tokens are short-lived JWTs checked by signature alone; sessions last through
+# opaque refresh tokens that are exchanged (rotated) for a new pair without a password check.
+ACCESS_TOKEN_TTL = datetime.timedelta(minutes=int(os.getenv("ACCESS_TOKEN_TTL_MINUTES", "15")))
+REFRESH_TOKEN_TTL = datetime.timedelta(days=int(os.getenv("REFRESH_TOKEN_TTL_DAYS", "30")))
+# A refresh token exchanged this recently may be exchanged again (two tabs refreshing at once)
+REFRESH_REUSE_GRACE_SECONDS = int(os.getenv("REFRESH_REUSE_GRACE_SECONDS", "10"))
+# Longest lifetime any access token may still have: those issued before access tokens
+# became short-lived were valid for 7 days
+MAX_ACCESS_TOKEN_LIFETIME = max(ACCESS_TOKEN_TTL, datetime.timedelta(days=7))
+
 def generate_token(user_id: str) -> str:
-    """Generate JWT token for user"""
+    """Generate JWT access token for user"""
     payload = {
         'user_id': user_id,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(days=7),  # Token expires in 7 days
-        'iat': datetime.datetime.utcnow()
+        'exp': datetime.datetime.utcnow() + ACCESS_TOKEN_TTL,
+        'iat': time.time(),  # sub-second, so a reset only revokes tokens issued before it
+        'jti': uuid.uuid4().hex  # lets a single token be revoked
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+def fetch_token_revocations(last_id: int):
+    conn = get_conn()
+    try:
+        return conn.execute("""
+            SELECT id, jti, user_id, revoked_before, expires_at FROM token_revocations
+            WHERE id > ? AND expires_at > ? ORDER BY id
+        """, (last_id, int(time.time()))).fetchall()
+    finally:
+        conn.close()
+
+def verify_token_claims(token: str) -> Optional[dict]:
+    """Claims of a valid, unrevoked token; the signature is only checked on first sight"""
+    key = auth_cache.token_key(token)
+    claims = auth_cache.cached_claims(key)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        except jwt.InvalidTokenError:
+            # Includes ExpiredSignatureError
+            return None
+        if not claims.get("jti"):
+            # Tokens issued before jti existed are revoked by their hash instead
+            claims["jti"] = "sha256:" + key.hex()
+        auth_cache.remember_claims(key, claims)
+    if auth_cache.sync_due():
+        auth_cache.sync(fetch_token_revocations)
+    if auth_cache.is_revoked(claims):
+        return None
+    return claims
+
 def verify_token(token: str) -> Optional[str]:
     """Verify JWT token and return user_id if valid"""
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload.get('user_id')
-    except jwt.ExpiredSignatureError:
+    claims = verify_token_claims(token)
+    return claims.get('user_id') if claims else None
+
+def revoke_token(cursor, claims: dict) -> None:
+    """Revoke one token (logout); takes effect in this process at once, in others within a sync interval"""
+    cursor.execute("INSERT INTO token_revocations (jti, user_id, expires_at, created_at) VALUES (?, ?, ?, ?)",
+                   (claims.get("jti"), claims.get("user_id"), int(claims["exp"]), now_iso()))
+    auth_cache.apply_revocation(claims.get("jti"), claims.get("user_id"), None, int(claims["exp"]))
+
+def revoke_user_tokens(cursor, user_id: str) -> None:
+    """Revoke every token issued to the user so far (password reset)"""
+    now = time.time()
+    # Kept until every token it revokes has expired, old 7-day tokens included
+    expires_at = int(now + MAX_ACCESS_TOKEN_LIFETIME.total_seconds())
+    cursor.execute("""
+        INSERT INTO token_revocations (user_id, revoked_before, expires_at, created_at) VALUES (?, ?, ?, ?)
+    """, (user_id, now, expires_at, now_iso()))
+    auth_cache.apply_revocation(None, user_id, now, expires_at)
+    cursor.execute("UPDATE refresh_tokens SET revoked_at = ? WHERE user_id = ? AND revoked_at IS NULL",
+                   (now_iso(), user_id))
+
+def refresh_token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def issue_tokens(cursor, user_id: str, family_id: Optional[str] = None, parent_id: Optional[int] = None) -> dict:
+    """A new access/refresh pair; a rotated refresh token stays in its parent's family"""
+    refresh_token = secrets.token_urlsafe(32)
+    cursor.execute("""
+        INSERT INTO refresh_tokens (user_id, token_hash, family_id, parent_id, expires_at, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (user_id, refresh_token_hash(refresh_token), family_id or uuid.uuid4().hex, parent_id,
+          int(time.time() + REFRESH_TOKEN_TTL.total_seconds()), now_iso()))
+    return {
+        "access_token": generate_token(user_id),
+        "refresh_token": refresh_token,
+        "token_type": "Bearer",
+        "expires_in": int(ACCESS_TOKEN_TTL.total_seconds())
+    }
+
+def revoke_refresh_family(cursor, family_id: str) -> None:
+    cursor.execute("UPDATE refresh_tokens SET revoked_at = ? WHERE family_id = ? AND revoked_at IS NULL",
+                   (now_iso(), family_id))
+
+def rotate_refresh_token(cursor, refresh_token: str) -> Optional[dict]:
+    """
+    Exchange a refresh token for a new pair, or None if it is unknown, expired or revoked.
+    A token exchanged within the last REFRESH_REUSE_GRACE_SECONDS is a concurrent refresh and gets
+    another pair. Presenting one exchanged earlier means it leaked, so the whole family is revoked
+    and that session has to log in again.
+    """
+    select = "SELECT id, user_id, family_id, expires_at, used_at, revoked_at FROM refresh_tokens WHERE token_hash = ?"
+    row = cursor.execute(select, (refresh_token_hash(refresh_token),)).fetchone()
+    if not row or row["revoked_at"] or row["expires_at"] <= time.time():
         return None
-    except jwt.InvalidTokenError:
+    claimed = cursor.execute("""
+        UPDATE refresh_tokens SET used_at = ? WHERE id = ? AND used_at IS NULL AND revoked_at IS NULL
+    """, (now_iso(), row["id"])).rowcount
+    if not claimed:
+        row = cursor.execute(select, (refresh_token_hash(refresh_token),)).fetchone()  # as the winner left it
+        if row["revoked_at"]:
+            return None
+        used_at = datetime.datetime.fromisoformat(row["used_at"].replace("Z", "+00:00")).timestamp()
+        if time.time() - used_at <= REFRESH_REUSE_GRACE_SECONDS:
+            return issue_tokens(cursor, row["user_id"], row["family_id"], row["id"])
+        revoke_refresh_family(cursor, row["family_id"])
         return None
+    return issue_tokens(cursor, row["user_id"], row["family_id"], row["id"])
+
+TOKEN_REVOCATION_JOB_INTERVAL_SECONDS = int(os.getenv("TOKEN_REVOCATION_JOB_INTERVAL_SECONDS", "3600"))
+
+def token_revocation_job(cursor) -> dict:
+    """Drop revocations and refresh tokens for tokens that have expired anyway"""
+    now = int(time.time())
+    cursor.execute("DELETE FROM token_revocations WHERE expires_at <= ?", (now,))
+    deleted = cursor.rowcount
+    cursor.execute("DELETE FROM refresh_tokens WHERE expires_at <= ?", (now,))
+    return {"deleted": deleted, "refresh_tokens_deleted": cursor.rowcount}
+
+scheduler.register("token_revocations", TOKEN_REVOCATION_JOB_INTERVAL_SECONDS, token_revocation_job)
 
 def token_required(f):
     """Decorator to require valid JWT token"""
@@ -86,18 +436,141 @@ def token_required(f):
         if not token:
             return jsonify({'error': 'Token is missing'}), 401
         
-        user_id = verify_token(token)
-        if not user_id:
+        claims = verify_token_claims(token)
+        if not claims or not claims.get('user_id'):
             return jsonify({'error': 'Token is invalid or expired'}), 401
         
         # Add user_id to request context
-        request.current_user_id = user_id
+        request.current_user_id = claims['user_id']
+        request.token_claims = claims
         return f(*args, **kwargs)
     
     return decorated
 
+# ------------------- Idempotency -------------------
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")) * 3600
+# Claims older than this are treated as abandoned. The lease outlasts the gunicorn worker timeout
+# so a request that is still running is never taken over by a retry.
+IDEMPOTENCY_LOCK_SECONDS = max(int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "0")),
+                               int(os.getenv("GUNICORN_TIMEOUT", "120")) + 30)
+IDEMPOTENCY_RETRYABLE_STATUSES = (409, 429)  # like 5xx, released instead of replayed
+IDEMPOTENCY_WAIT_SECONDS = 10  # how long a concurrent duplicate waits for the original to finish
+IDEMPOTENCY_PURGE_INTERVAL = 600
+
+_idempotency_events = {}  # (user_id, key) -> threading.Event for in-process coalescing
+_idempotency_lock = threading.Lock()
+_idempotency_last_purge = [0.0]
+
+def _epoch() -> int:
+    return int(time.time())
+
+def purge_expired_idempotency_keys(cursor):
+    """Drop expired keys, at most once per purge interval per process"""
+    now = time.time()
+    if now - _idempotency_last_purge[0] < IDEMPOTENCY_PURGE_INTERVAL:
+        return
+    _idempotency_last_purge[0] = now
+    cursor.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (int(now),))
+
+def _replay_response(row):
+    response = app.response_class(row["response_body"], status=row["response_status"], mimetype="application/json")
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+def idempotent(f):
+    """
+    Decorator (applied after token_required) that honors an Idempotency-Key header.
+    The first request claims the key; retries get the stored response without re-running
+    the handler, and concurrent duplicates wait for the first one to finish.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"error": "Idempotency-Key must be at most 255 characters"}), 400
+        
+        user_id = request.current_user_id
+        fingerprint = hashlib.sha256(
+            f"{request.method} {request.path}\n".encode() + request.get_data()).hexdigest()
+        event_key = (user_id, key)
+        
+        conn = get_conn()
+        cur = conn.cursor()
+        try:
+            purge_expired_idempotency_keys(cur)
+            deadline = time.time() + IDEMPOTENCY_WAIT_SECONDS
+            while True:
+                now = _epoch()
+                # Reclaim keys that expired or whose original request died mid-flight
+                cur.execute("""
+                    DELETE FROM idempotency_keys
+                    WHERE user_id = ? AND idempotency_key = ?
+                      AND (expires_at < ? OR (status = 'in_progress' AND locked_at < ?))
+                """, (user_id, key, now, now - IDEMPOTENCY_LOCK_SECONDS))
+                cur.execute("""
+                    INSERT OR IGNORE INTO idempotency_keys
+                      (user_id, idempotency_key, request_fingerprint, status, locked_at, created_at, expires_at)
+                    VALUES (?, ?, ?, 'in_progress', ?, ?, ?)
+                """, (user_id, key, fingerprint, now, now_iso(), now + IDEMPOTENCY_TTL_SECONDS))
+                claimed = cur.rowcount == 1
+                conn.commit()
+                if claimed:
+                    break
+                
+                cur.execute("""
+                    SELECT request_fingerprint, status, response_status, response_body
+                    FROM idempotency_keys WHERE user_id = ? AND idempotency_key = ?
+                """, (user_id, key))
+                row = cur.fetchone()
+                if row is None:
+                    continue  # released between our insert and select; try to claim again
+                if row["request_fingerprint"] != fingerprint:
+                    return jsonify({"error": "Idempotency-Key was already used for a different request"}), 422
+                if row["status"] == "completed":
+                    return _replay_response(row)
+                
+                # Same request still running elsewhere: wait for it instead of running twice
+                if time.time() >= deadline:
+                    return jsonify({"error": "A request with this Idempotency-Key is still being processed"}), 409
+                with _idempotency_lock:
+                    event = _idempotency_events.get(event_key)
+                if event is not None:
+                    event.wait(max(0.0, deadline - time.time()))
+                else:
+                    time.sleep(0.05)  # original is in another worker process
+            
+            with _idempotency_lock:
+                event = _idempotency_events[event_key] = threading.Event()
+            try:
+                response = app.make_response(f(*args, **kwargs))
+                if response.status_code < 500 and response.status_code not in IDEMPOTENCY_RETRYABLE_STATUSES:
+                    cur.execute("""
+                        UPDATE idempotency_keys
+                        SET status = 'completed', response_status = ?, response_body = ?
+                        WHERE user_id = ? AND idempotency_key = ?
+                    """, (response.status_code, response.get_data(as_text=True), user_id, key))
+                else:
+                    # Server errors, conflicts and rate limits are not cached so the client can retry
+                    cur.execute("DELETE FROM idempotency_keys WHERE user_id = ? AND idempotency_key = ?", (user_id, key))
+                conn.commit()
+                return response
+            except Exception:
+                cur.execute("DELETE FROM idempotency_keys WHERE user_id = ? AND idempotency_key = ?", (user_id, key))
+                conn.commit()
+                raise
+            finally:
+                with _idempotency_lock:
+                    _idempotency_events.pop(event_key, None)
+                event.set()
+        finally:
+            conn.close()
+    
+    return decorated
+
 def init_db():
-    conn = get_conn()
+    conn = connect()
     cur = conn.cursor()
     
     # Users table for profile and income data
@@ -254,14 +727,780 @@ def init_db():
     )
     """)
     
+    # Content hashes let bulk statement imports skip rows that were already imported
+    for table in ("expenses", "income"):
+        try:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN content_hash TEXT")
+        except sqlite3.OperationalError:
+            # Column already exists
+            pass
+        cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{table}_user_hash ON {table} (user_id, content_hash)")
+    
+    # Where an expense's category came from: 'llm', 'import', 'model', or NULL for older rows.
+    # Model-assigned categories are never used as training labels and may be reassigned.
+    try:
+        cur.execute("ALTER TABLE expenses ADD COLUMN category_source TEXT")
+    except sqlite3.OperationalError:
+        # Column already exists
+        pass
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS category_models (
+      scope TEXT PRIMARY KEY, -- 'global'
+      trained_through INTEGER NOT NULL, -- highest expenses.id the counts include
+      model BLOB NOT NULL,
+      updated_at TEXT NOT NULL
+    )
+    """)
+    
+    # Canonical merchants; every normalized spelling seen maps to one merchant through an alias
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS merchants (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      name TEXT NOT NULL,
+      created_at TEXT NOT NULL
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS merchant_aliases (
+      alias TEXT PRIMARY KEY, -- merchants.normalize() key
+      merchant_id INTEGER NOT NULL,
+      created_at TEXT NOT NULL,
+      FOREIGN KEY (merchant_id) REFERENCES merchants (id)
+    ) WITHOUT ROWID
+    """)
+    try:
+        cur.execute("ALTER TABLE expenses ADD COLUMN merchant_id INTEGER REFERENCES merchants (id)")
+    except sqlite3.OperationalError:
+        # Column already exists
+        pass
+    # Covering index for per-merchant GROUP BYs, and a small one for rows still to resolve
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_expenses_user_merchant ON expenses (user_id, merchant_id, occurred_at, amount_cents)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_expenses_merchant_pending ON expenses (id) WHERE merchant_id IS NULL AND merchant IS NOT NULL")
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_expenses_merchant_changed AFTER UPDATE OF merchant ON expenses
+        WHEN new.merchant IS NOT old.merchant
+        BEGIN
+          UPDATE expenses SET merchant_id = NULL WHERE id = new.id;
+        END
+    """)
+    
+    # Running per-user, per-category amount statistics (Welford) and the alerts raised from
+    # them. Both are maintained by triggers, so every write path updates them in O(1) per row.
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'expense_stats'")
+    expense_stats_missing = cur.fetchone() is None
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS expense_stats (
+      user_id TEXT NOT NULL,
+      category TEXT NOT NULL, -- lower(trim(category)), '' for uncategorized
+      n INTEGER NOT NULL,
+      mean REAL NOT NULL, -- cents
+      m2 REAL NOT NULL, -- sum of squared deviations from the mean
+      PRIMARY KEY (user_id, category)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS expense_alerts (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      user_id TEXT NOT NULL,
+      expense_id INTEGER NOT NULL,
+      alert_type TEXT NOT NULL, -- 'unusual_amount' | 'possible_duplicate'
+      category TEXT,
+      amount_cents INTEGER NOT NULL,
+      baseline_mean_cents REAL,
+      baseline_variance REAL,
+      related_expense_id INTEGER,
+      created_at TEXT NOT NULL,
+      acknowledged_at TEXT,
+      FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_expense_alerts_user ON expense_alerts (user_id, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_expense_alerts_expense ON expense_alerts (expense_id)")
+    # Same amount at the same merchant (or with the same text); the index is the recent-hash set
+    try:
+        cur.execute("""
+            ALTER TABLE expenses ADD COLUMN fingerprint TEXT GENERATED ALWAYS AS
+            (amount_cents || ':' || coalesce('m' || merchant_id, 't' || lower(trim(source_text)))) VIRTUAL
+        """)
+    except sqlite3.OperationalError:
+        # Column already exists
+        pass
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_expenses_user_fingerprint ON expenses (user_id, fingerprint, occurred_at)")
+    
+    stats_key = "lower(trim(coalesce({row}.category, '')))"
+    add_sample = lambda row: f"""
+        INSERT INTO expense_stats (user_id, category, n, mean, m2)
+        VALUES ({row}.user_id, {stats_key.format(row=row)}, 1, {row}.amount_cents * 1.0, 0.0)
+        ON CONFLICT (user_id, category) DO UPDATE SET
+          n = n + 1,
+          mean = mean + (excluded.mean - mean) / (n + 1),
+          m2 = m2 + (excluded.mean - mean) * (excluded.mean - (mean + (excluded.mean - mean) / (n + 1)));
+    """
+    remove_sample = lambda row: f"""
+        UPDATE expense_stats SET
+          n = n - 1,
+          mean = CASE WHEN n > 1 THEN (n * mean - {row}.amount_cents) / (n - 1) ELSE 0.0 END,
+          m2 = CASE WHEN n > 1 THEN max(0.0, m2 - ({row}.amount_cents - mean) * ({row}.amount_cents - (n * mean - {row}.amount_cents) / (n - 1)))
+                    ELSE 0.0 END
+        WHERE user_id = {row}.user_id AND category = {stats_key.format(row=row)};
+    """
+    # Alerts compare the new amount with the statistics as they were before it
+    raise_alerts = f"""
+        INSERT INTO expense_alerts (user_id, expense_id, alert_type, category, amount_cents,
+                                    baseline_mean_cents, baseline_variance, created_at)
+        SELECT new.user_id, new.id, 'unusual_amount', new.category, new.amount_cents, s.mean, s.m2 / (s.n - 1),
+               strftime('%Y-%m-%dT%H:%M:%SZ', 'now')
+        FROM expense_stats s
+        WHERE s.user_id = new.user_id AND s.category = {stats_key.format(row="new")}
+          AND s.n >= {ANOMALY_MIN_SAMPLES}
+          AND new.amount_cents > s.mean * {ANOMALY_MIN_RATIO}
+          AND (new.amount_cents - s.mean) * (new.amount_cents - s.mean) > {ANOMALY_Z_SCORE ** 2} * s.m2 / (s.n - 1);
+        INSERT INTO expense_alerts (user_id, expense_id, alert_type, category, amount_cents, related_expense_id, created_at)
+        SELECT new.user_id, new.id, 'possible_duplicate', new.category, new.amount_cents, d.id,
+               strftime('%Y-%m-%dT%H:%M:%SZ', 'now')
+        FROM expenses d
+        WHERE d.user_id = new.user_id AND d.fingerprint = new.fingerprint AND d.id < new.id
+          AND d.occurred_at >= date(new.occurred_at, '-{DUPLICATE_WINDOW_DAYS} days')
+          AND d.occurred_at < date(new.occurred_at, '+{DUPLICATE_WINDOW_DAYS + 1} days')
+        ORDER BY d.id DESC LIMIT 1;
+    """
+    for name, event, body in (
+        ("insert", "INSERT", raise_alerts + add_sample("new")),
+        ("delete", "DELETE", remove_sample("old") + "DELETE FROM expense_alerts WHERE expense_id = old.id;"),
+        ("update", "UPDATE OF user_id, category, amount_cents", remove_sample("old") + add_sample("new")),
+    ):
+        # Recreated whenever init_db runs, which ensure_schema does when the thresholds change
+        cur.execute(f"DROP TRIGGER IF EXISTS trg_expenses_anomaly_{name}")
+        cur.execute(f"CREATE TRIGGER trg_expenses_anomaly_{name} AFTER {event} ON expenses BEGIN {body} END")
+    if expense_stats_missing:
+        rebuild_expense_stats(cur)
+    
+    # Revoked access tokens: a single token (jti, logout) or every token a user was issued
+    # before revoked_before (password reset). Rows can go once the tokens would have expired.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS token_revocations (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      jti TEXT,
+      user_id TEXT NOT NULL,
+      revoked_before REAL, -- epoch seconds
+      expires_at INTEGER NOT NULL, -- epoch seconds
+      created_at TEXT NOT NULL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_token_revocations_expires ON token_revocations (expires_at)")
+    
+    # Refresh tokens are stored as SHA-256 hashes. Each rotation adds a row to the same family
+    # and marks its parent used; a used token presented again revokes the family.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS refresh_tokens (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      user_id TEXT NOT NULL,
+      token_hash TEXT NOT NULL UNIQUE,
+      family_id TEXT NOT NULL,
+      parent_id INTEGER,
+      expires_at INTEGER NOT NULL, -- epoch seconds
+      used_at TEXT,
+      revoked_at TEXT,
+      created_at TEXT NOT NULL,
+      FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_refresh_tokens_family ON refresh_tokens (family_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_refresh_tokens_user ON refresh_tokens (user_id) WHERE revoked_at IS NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_refresh_tokens_expires ON refresh_tokens (expires_at)")
+    
+    # Range/keyset reads over a user's history
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_expenses_user_occurred ON expenses (user_id, occurred_at, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_trades_user_occurred ON trades (user_id, occurred_at, id)")
+    
+    # Monthly rollups for spending analytics, kept in step with the base tables by triggers
+    # so every write path (chat, bulk import, edits) updates them in the same transaction
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'expense_rollups_monthly'")
+    rollups_missing = cur.fetchone() is None
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS expense_rollups_monthly (
+      user_id TEXT NOT NULL,
+      year_month TEXT NOT NULL, -- 'YYYY-MM'
+      category TEXT NOT NULL DEFAULT '', -- '' = uncategorized
+      total_cents INTEGER NOT NULL DEFAULT 0,
+      txn_count INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (user_id, year_month, category)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS income_rollups_monthly (
+      user_id TEXT NOT NULL,
+      year_month TEXT NOT NULL,
+      income_type TEXT NOT NULL DEFAULT '',
+      total_cents INTEGER NOT NULL DEFAULT 0,
+      txn_count INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (user_id, year_month, income_type)
+    ) WITHOUT ROWID
+    """)
+    for table, rollup, key in (("expenses", "expense_rollups_monthly", "category"),
+                               ("income", "income_rollups_monthly", "income_type")):
+        add_row = f"""
+            INSERT INTO {rollup} (user_id, year_month, {key}, total_cents, txn_count)
+            VALUES (NEW.user_id, substr(NEW.occurred_at, 1, 7), COALESCE(NEW.{key}, ''), NEW.amount_cents, 1)
+            ON CONFLICT (user_id, year_month, {key}) DO UPDATE
+            SET total_cents = total_cents + excluded.total_cents, txn_count = txn_count + 1;
+        """
+        remove_row = f"""
+            UPDATE {rollup}
+            SET total_cents = total_cents - OLD.amount_cents, txn_count = txn_count - 1
+            WHERE user_id = OLD.user_id AND year_month = substr(OLD.occurred_at, 1, 7)
+              AND {key} = COALESCE(OLD.{key}, '');
+        """
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_rollup_insert AFTER INSERT ON {table} BEGIN {add_row} END")
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_rollup_delete AFTER DELETE ON {table} BEGIN {remove_row} END")
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_rollup_update
+            AFTER UPDATE OF user_id, occurred_at, amount_cents, {key} ON {table}
+            BEGIN {remove_row} {add_row} END
+        """)
+    if rollups_missing:
+        rebuild_rollups(cur)
+    
+    # Row versions for optimistic concurrency on balance-changing writes
+    for table in ("assets", "liabilities"):
+        try:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            # Column already exists
+            pass
+    
+    # Per-user data version, bumped on any change to the user's financial rows;
+    # derived results (forecasts) are cached against it
+    try:
+        cur.execute("ALTER TABLE users ADD COLUMN data_version INTEGER DEFAULT 0")
+    except sqlite3.OperationalError:
+        # Column already exists
+        pass
+    for table in ("expenses", "income", "assets", "liabilities"):
+        for event, ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_data_version_{event.lower()} AFTER {event} ON {table}
+                BEGIN UPDATE users SET data_version = data_version + 1 WHERE id = {ref}.user_id; END
+            """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_data_version_income AFTER UPDATE OF monthly_income_cents ON users
+        BEGIN UPDATE users SET data_version = data_version + 1 WHERE id = NEW.id; END
+    """)
+    
+    # Append-only double-entry ledger of asset balance changes. Every change to
+    # assets.asset_value_cents posts two legs that sum to zero: the asset account
+    # ('asset:<id>') and a counter account ('expense:<category>', 'liability:<id>',
+    # 'income', 'equity:adjustment', ...). Triggers post the entries so no write path
+    # can skip them; callers name the counter account via ledger_pending first and clear it
+    # after the write, since a write that leaves the balance unchanged fires no trigger.
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'ledger_entries'")
+    ledger_missing = cur.fetchone() is None
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ledger_entries (
+      id INTEGER PRIMARY KEY,
+      txn_id INTEGER NOT NULL, -- id of the asset leg; shared by both legs
+      user_id TEXT NOT NULL,
+      account TEXT NOT NULL,
+      asset_id INTEGER, -- set on the asset leg only
+      amount_cents INTEGER NOT NULL, -- positive = debit (increases an asset)
+      reference_type TEXT,
+      reference_id TEXT,
+      description TEXT,
+      created_at TEXT NOT NULL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_entries_asset ON ledger_entries (asset_id, id) WHERE asset_id IS NOT NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ledger_entries_user_created ON ledger_entries (user_id, created_at)")
+    for event in ("UPDATE", "DELETE"):
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_ledger_entries_no_{event.lower()} BEFORE {event} ON ledger_entries
+            BEGIN SELECT RAISE(ABORT, 'ledger_entries is append-only'); END
+        """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS ledger_pending (
+      user_id TEXT PRIMARY KEY,
+      counter_account TEXT NOT NULL,
+      reference_type TEXT,
+      reference_id TEXT,
+      description TEXT
+    ) WITHOUT ROWID
+    """)
+    # Balance of an asset right after entry_id; balance at time T = latest snapshot
+    # taken at or before T plus the (at most LEDGER_SNAPSHOT_INTERVAL) entries after it
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS asset_balance_snapshots (
+      asset_id INTEGER NOT NULL,
+      entry_id INTEGER NOT NULL,
+      user_id TEXT NOT NULL,
+      balance_cents INTEGER NOT NULL,
+      taken_at TEXT NOT NULL,
+      PRIMARY KEY (asset_id, entry_id)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_asset_balance_snapshots_user ON asset_balance_snapshots (user_id, asset_id, taken_at)")
+    
+    for event, row, delta, default_counter, balance in (
+        ("INSERT", "NEW", "NEW.asset_value_cents", "equity:opening", "NEW.asset_value_cents"),
+        ("UPDATE OF asset_value_cents", "NEW", "NEW.asset_value_cents - OLD.asset_value_cents", "equity:adjustment", "NEW.asset_value_cents"),
+        ("DELETE", "OLD", "-OLD.asset_value_cents", "equity:closing", "0"),
+    ):
+        name = event.split()[0].lower()
+        pending = f"(SELECT {{}} FROM ledger_pending WHERE user_id = {row}.user_id)"
+        when = "WHEN NEW.asset_value_cents IS NOT OLD.asset_value_cents" if name == "update" else ""
+        # Recreated like the anomaly triggers so a new LEDGER_SNAPSHOT_INTERVAL takes effect
+        cur.execute(f"DROP TRIGGER IF EXISTS trg_assets_ledger_{name}")
+        cur.execute(f"""
+            CREATE TRIGGER trg_assets_ledger_{name} AFTER {event} ON assets {when}
+            BEGIN
+              INSERT INTO ledger_entries (id, txn_id, user_id, account, asset_id, amount_cents,
+                                          reference_type, reference_id, description, created_at)
+              VALUES ((SELECT COALESCE(MAX(id), 0) + 1 FROM ledger_entries),
+                      (SELECT COALESCE(MAX(id), 0) + 1 FROM ledger_entries),
+                      {row}.user_id, 'asset:' || {row}.id, {row}.id, {delta},
+                      {pending.format('reference_type')}, {pending.format('reference_id')},
+                      {pending.format('description')}, strftime('%Y-%m-%dT%H:%M:%SZ', 'now'));
+              INSERT INTO ledger_entries (txn_id, user_id, account, asset_id, amount_cents,
+                                          reference_type, reference_id, description, created_at)
+              SELECT id, user_id, COALESCE({pending.format('counter_account')}, '{default_counter}'), NULL,
+                     -amount_cents, reference_type, reference_id, description, created_at
+              FROM ledger_entries WHERE id = (SELECT MAX(id) FROM ledger_entries WHERE asset_id = {row}.id);
+              -- First entry of an asset, or LEDGER_SNAPSHOT_INTERVAL entries since the last snapshot
+              INSERT INTO asset_balance_snapshots (asset_id, entry_id, user_id, balance_cents, taken_at)
+              SELECT e.asset_id, e.id, e.user_id, {balance}, e.created_at
+              FROM ledger_entries e
+              WHERE e.id = (SELECT MAX(id) FROM ledger_entries WHERE asset_id = {row}.id)
+                AND (SELECT COUNT(*) FROM ledger_entries t
+                     WHERE t.asset_id = {row}.id
+                       AND t.id > COALESCE((SELECT MAX(entry_id) FROM asset_balance_snapshots WHERE asset_id = {row}.id), 0)
+                    ) >= CASE WHEN EXISTS (SELECT 1 FROM asset_balance_snapshots WHERE asset_id = {row}.id)
+                              THEN {LEDGER_SNAPSHOT_INTERVAL} ELSE 1 END;
+              DELETE FROM ledger_pending WHERE user_id = {row}.user_id;
+            END
+        """)
+    if ledger_missing:
+        backfill_ledger(cur)
+    
+    # Daily net-worth series, one row per user per day; upserted by triggers on every
+    # balance change and carried forward for quiet days by the daily snapshot job
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'networth_daily'")
+    networth_missing = cur.fetchone() is None
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS networth_daily (
+      user_id TEXT NOT NULL,
+      day TEXT NOT NULL, -- 'YYYY-MM-DD' (UTC)
+      assets_cents INTEGER NOT NULL,
+      liabilities_cents INTEGER NOT NULL,
+      liquid_assets_cents INTEGER NOT NULL,
+      net_worth_cents INTEGER NOT NULL,
+      PRIMARY KEY (user_id, day)
+    ) WITHOUT ROWID
+    """)
+    # Triggers apply the row's delta to today's totals; only the first change of a day
+    # (when there is no row to adjust yet) sums the user's balances
+    def asset_terms(row):
+        return (f"{row}.asset_value_cents", f"CASE WHEN {row}.is_liquid THEN {row}.asset_value_cents ELSE 0 END", "0")
+    def liability_terms(row):
+        return ("0", "0", f"CASE WHEN {row}.is_completed = 0 THEN {row}.remaining_amount_cents ELSE 0 END")
+    for table, columns, terms in (("assets", "asset_value_cents, is_liquid", asset_terms),
+                                  ("liabilities", "remaining_amount_cents, is_completed", liability_terms)):
+        for event, ref, new, old in (("INSERT", "NEW", terms("NEW"), ("0", "0", "0")),
+                                     (f"UPDATE OF {columns}", "NEW", terms("NEW"), terms("OLD")),
+                                     ("DELETE", "OLD", ("0", "0", "0"), terms("OLD"))):
+            a, q, l = (f"(({n}) - ({o}))" for n, o in zip(new, old))
+            name = event.split()[0].lower()
+            cur.execute(f"DROP TRIGGER IF EXISTS trg_{table}_networth_{name}")
+            cur.execute(f"""
+                CREATE TRIGGER trg_{table}_networth_{name} AFTER {event} ON {table}
+                BEGIN
+                  UPDATE networth_daily
+                  SET assets_cents = assets_cents + {a}, liabilities_cents = liabilities_cents + {l},
+                      liquid_assets_cents = liquid_assets_cents + {q}, net_worth_cents = net_worth_cents + {a} - {l}
+                  WHERE user_id = {ref}.user_id AND day = date('now');
+                  {networth_upsert_sql(f"{ref}.user_id", "date('now')", replace=False)};
+                END
+            """)
+    if networth_missing:
+        record_networth_snapshots(cur)
+    
+    # Due-date tracking: paid installments not yet reflected in next_due_date are
+    # rolled forward by the scheduler (and immediately after each payment)
+    try:
+        cur.execute("ALTER TABLE liabilities ADD COLUMN due_installments_applied INTEGER NOT NULL DEFAULT 0")
+    except sqlite3.OperationalError:
+        # Column already exists
+        pass
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_liabilities_active_due ON liabilities (next_due_date) WHERE is_completed = 0")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS liability_events (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      user_id TEXT NOT NULL,
+      liability_id INTEGER NOT NULL,
+      event_type TEXT NOT NULL, -- 'due_soon' | 'overdue' | 'autopay_paid' | 'autopay_failed'
+      due_date TEXT NOT NULL,
+      amount_cents INTEGER NOT NULL,
+      created_at TEXT NOT NULL,
+      acknowledged_at TEXT,
+      UNIQUE (liability_id, event_type, due_date),
+      FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_liability_events_user ON liability_events (user_id, id)")
+    
+    # Background jobs; next_run_at/locked_until are epoch seconds
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS scheduled_jobs (
+      name TEXT PRIMARY KEY,
+      interval_seconds INTEGER NOT NULL,
+      next_run_at INTEGER NOT NULL,
+      locked_until INTEGER,
+      last_run_at INTEGER,
+      last_status TEXT,
+      last_error TEXT,
+      last_duration_ms INTEGER
+    )
+    """)
+    
+    # Autopay rules: pay a liability from a chosen asset when it comes due
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS autopay_rules (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      user_id TEXT NOT NULL,
+      liability_id INTEGER NOT NULL UNIQUE,
+      asset_id INTEGER NOT NULL,
+      amount_policy TEXT NOT NULL, -- 'installment' | 'full' | 'fixed'
+      fixed_amount_cents INTEGER,
+      lead_days INTEGER NOT NULL DEFAULT 0, -- pay this many days before the due date
+      is_active BOOLEAN NOT NULL DEFAULT 1,
+      last_paid_due_date TEXT, -- due date covered by the last successful run
+      last_status TEXT, -- 'paid' | 'failed'
+      last_error TEXT,
+      last_attempt_at TEXT,
+      created_at TEXT NOT NULL,
+      updated_at TEXT NOT NULL,
+      FOREIGN KEY (user_id) REFERENCES users (id),
+      FOREIGN KEY (liability_id) REFERENCES liabilities (id),
+      FOREIGN KEY (asset_id) REFERENCES assets (id)
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_autopay_rules_user ON autopay_rules (user_id)")
+    
+    # Asset resolution index: user aliases plus the normalized name/token/trigram keys
+    # derived from them, rebuilt whenever users.asset_index_version moves
+    try:
+        cur.execute("ALTER TABLE users ADD COLUMN asset_index_version INTEGER DEFAULT 0")
+    except sqlite3.OperationalError:
+        # Column already exists
+        pass
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS asset_aliases (
+      user_id TEXT NOT NULL,
+      alias TEXT NOT NULL, -- normalized
+      asset_id INTEGER NOT NULL,
+      created_at TEXT NOT NULL,
+      PRIMARY KEY (user_id, alias),
+      FOREIGN KEY (asset_id) REFERENCES assets (id)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS asset_resolution_keys (
+      user_id TEXT NOT NULL,
+      key_type TEXT NOT NULL, -- 'name' | 'alias' | 'token' | 'trigram'
+      key TEXT NOT NULL,
+      asset_id INTEGER NOT NULL,
+      weight REAL NOT NULL,
+      PRIMARY KEY (user_id, key_type, key, asset_id)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS asset_resolution_state (
+      user_id TEXT PRIMARY KEY,
+      version INTEGER NOT NULL -- asset_index_version the stored keys were built from
+    ) WITHOUT ROWID
+    """)
+    bump_index = "UPDATE users SET asset_index_version = asset_index_version + 1 WHERE id = {}.user_id;"
+    for table, events in (("assets", (("INSERT", "NEW"), ("UPDATE OF user_id, asset_type, account", "NEW"), ("DELETE", "OLD"))),
+                          ("asset_aliases", (("INSERT", "NEW"), ("DELETE", "OLD")))):
+        for event, ref in events:
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_asset_index_{event.split()[0].lower()} AFTER {event} ON {table}
+                BEGIN {bump_index.format(ref)} END
+            """)
+    
+    # Normalized names for resolving LLM-extracted liability/asset names to row ids;
+    # normalized_name() in Python must produce the same value as these expressions
+    for table, column in (("liabilities", "liability_type"), ("assets", "asset_type")):
+        try:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN name_norm TEXT GENERATED ALWAYS AS (lower(trim({column}))) VIRTUAL")
+        except sqlite3.OperationalError:
+            # Column already exists
+            pass
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user_name ON {table} (user_id, name_norm)")
+    
+    # Full-text search over chat messages, expenses and liabilities. One FTS5 table holds
+    # all three; rowid = source id * 4 + type code (see SEARCH_TYPES) so triggers address a
+    # document without a lookup, and the owner column scopes each MATCH to one user.
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_fts'")
+    search_index_missing = cur.fetchone() is None
+    cur.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+      owner, title, body, created_at UNINDEXED,
+      tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """)
+    search_triggers = {
+        "messages": (1, "content", """
+            INSERT INTO search_fts (rowid, owner, title, body, created_at)
+            SELECT new.id * 4 + 1, replace(s.user_id, '-', ''), s.title, new.content, new.created_at
+            FROM sessions s WHERE s.id = new.session_id;
+        """),
+        "expenses": (2, "merchant, note, source_text, occurred_at", """
+            INSERT INTO search_fts (rowid, owner, title, body, created_at)
+            VALUES (new.id * 4 + 2, replace(new.user_id, '-', ''), new.merchant,
+                    coalesce(new.note || ' ', '') || new.source_text, new.occurred_at);
+        """),
+        "liabilities": (3, "liability_type, description", """
+            INSERT INTO search_fts (rowid, owner, title, body, created_at)
+            VALUES (new.id * 4 + 3, replace(new.user_id, '-', ''), new.liability_type, new.description, new.created_at);
+        """),
+    }
+    for table, (code, indexed_columns, insert_doc) in search_triggers.items():
+        delete_doc = f"DELETE FROM search_fts WHERE rowid = old.id * 4 + {code};"
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_search_insert AFTER INSERT ON {table} BEGIN {insert_doc} END")
+        cur.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{table}_search_delete AFTER DELETE ON {table} BEGIN {delete_doc} END")
+        cur.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_search_update
+            AFTER UPDATE OF {indexed_columns} ON {table}
+            BEGIN {delete_doc} {insert_doc} END
+        """)
+    if search_index_missing:
+        rebuild_search_index(cur)
+    
+    # Stored responses for Idempotency-Key replays
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+      user_id TEXT NOT NULL,
+      idempotency_key TEXT NOT NULL,
+      request_fingerprint TEXT NOT NULL,
+      status TEXT NOT NULL, -- 'in_progress' | 'completed'
+      response_status INTEGER,
+      response_body TEXT,
+      locked_at INTEGER NOT NULL, -- epoch seconds
+      created_at TEXT NOT NULL,
+      expires_at INTEGER NOT NULL, -- epoch seconds
+      PRIMARY KEY (user_id, idempotency_key)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at)")
+    
+    # Import jobs for progress reporting on large statement uploads
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS import_jobs (
+      id TEXT PRIMARY KEY,
+      user_id TEXT NOT NULL,
+      filename TEXT,
+      file_format TEXT NOT NULL, -- 'csv' | 'ofx'
+      status TEXT NOT NULL, -- 'running' | 'completed' | 'failed'
+      rows_processed INTEGER DEFAULT 0,
+      expenses_inserted INTEGER DEFAULT 0,
+      income_inserted INTEGER DEFAULT 0,
+      duplicates_skipped INTEGER DEFAULT 0,
+      rows_failed INTEGER DEFAULT 0,
+      errors TEXT,
+      asset_id INTEGER,
+      created_at TEXT NOT NULL,
+      updated_at TEXT NOT NULL,
+      FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+    
     # Database tables created successfully - no dummy data
     
     conn.commit()
     conn.close()
 
-init_db()
+def rebuild_rollups(cursor, user_id: Optional[str] = None):
+    """Recompute monthly rollups from the base expenses/income tables"""
+    user_clause = "WHERE user_id = ?" if user_id else ""
+    params = (user_id,) if user_id else ()
+    for table, rollup, key in (("expenses", "expense_rollups_monthly", "category"),
+                               ("income", "income_rollups_monthly", "income_type")):
+        cursor.execute(f"DELETE FROM {rollup} {user_clause}", params)
+        cursor.execute(f"""
+            INSERT INTO {rollup} (user_id, year_month, {key}, total_cents, txn_count)
+            SELECT user_id, substr(occurred_at, 1, 7), COALESCE({key}, ''), SUM(amount_cents), COUNT(*)
+            FROM {table} {user_clause}
+            GROUP BY 1, 2, 3
+        """, params)
+
+def rebuild_expense_stats(cursor):
+    """Recompute the per-category amount statistics from the expenses table"""
+    cursor.execute("DELETE FROM expense_stats")
+    cursor.execute("""
+        INSERT INTO expense_stats (user_id, category, n, mean, m2)
+        SELECT user_id, lower(trim(coalesce(category, ''))), COUNT(*), AVG(amount_cents),
+               max(0.0, SUM(amount_cents * amount_cents * 1.0) - COUNT(*) * AVG(amount_cents) * AVG(amount_cents))
+        FROM expenses
+        GROUP BY 1, 2
+    """)
+
+def backfill_ledger(cursor):
+    """Post an opening entry (and snapshot) for assets that predate the ledger"""
+    cursor.execute("SELECT id, user_id, asset_value_cents, created_at FROM assets ORDER BY id")
+    for asset in cursor.fetchall():
+        cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 AS next_id FROM ledger_entries")
+        entry_id = cursor.fetchone()["next_id"]
+        created_at = asset["created_at"] or now_iso()
+        cursor.executemany("""
+            INSERT INTO ledger_entries (id, txn_id, user_id, account, asset_id, amount_cents, description, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, 'Opening balance', ?)
+        """, [(entry_id, entry_id, asset["user_id"], f"asset:{asset['id']}", asset["id"], asset["asset_value_cents"], created_at),
+              (entry_id + 1, entry_id, asset["user_id"], "equity:opening", None, -asset["asset_value_cents"], created_at)])
+        cursor.execute("""
+            INSERT INTO asset_balance_snapshots (asset_id, entry_id, user_id, balance_cents, taken_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (asset["id"], entry_id, asset["user_id"], asset["asset_value_cents"], created_at))
+
+def networth_upsert_sql(user_expr: str, day_expr: str, replace: bool = True) -> str:
+    """
+    UPSERT of one user's current totals into networth_daily (shared by triggers and the daily job).
+    With replace=False an existing row for the day is left alone.
+    """
+    on_conflict = """UPDATE
+        SET assets_cents = excluded.assets_cents, liabilities_cents = excluded.liabilities_cents,
+            liquid_assets_cents = excluded.liquid_assets_cents, net_worth_cents = excluded.net_worth_cents
+    """ if replace else "NOTHING"
+    # Skip the balance sums entirely when the row exists and would be left alone
+    where = "true" if replace else f"NOT EXISTS (SELECT 1 FROM networth_daily WHERE user_id = {user_expr} AND day = {day_expr})"
+    return f"""
+        INSERT INTO networth_daily (user_id, day, assets_cents, liabilities_cents, liquid_assets_cents, net_worth_cents)
+        SELECT u, d, a, l, q, a - l FROM (
+            SELECT {user_expr} AS u, {day_expr} AS d,
+                   (SELECT COALESCE(SUM(asset_value_cents), 0) FROM assets WHERE user_id = {user_expr}) AS a,
+                   (SELECT COALESCE(SUM(remaining_amount_cents), 0) FROM liabilities
+                    WHERE user_id = {user_expr} AND is_completed = 0) AS l,
+                   (SELECT COALESCE(SUM(asset_value_cents), 0) FROM assets
+                    WHERE user_id = {user_expr} AND is_liquid = 1) AS q
+            WHERE {where}
+        ) WHERE true
+        ON CONFLICT (user_id, day) DO {on_conflict}
+    """
+
+def rebuild_search_index(cursor):
+    """Repopulate search_fts from messages, expenses and liabilities"""
+    cursor.execute("DELETE FROM search_fts")
+    cursor.execute("""
+        INSERT INTO search_fts (rowid, owner, title, body, created_at)
+        SELECT m.id * 4 + 1, replace(s.user_id, '-', ''), s.title, m.content, m.created_at
+        FROM messages m JOIN sessions s ON s.id = m.session_id
+    """)
+    cursor.execute("""
+        INSERT INTO search_fts (rowid, owner, title, body, created_at)
+        SELECT id * 4 + 2, replace(user_id, '-', ''), merchant, coalesce(note || ' ', '') || source_text, occurred_at
+        FROM expenses
+    """)
+    cursor.execute("""
+        INSERT INTO search_fts (rowid, owner, title, body, created_at)
+        SELECT id * 4 + 3, replace(user_id, '-', ''), liability_type, description, created_at
+        FROM liabilities
+    """)
+    cursor.execute("INSERT INTO search_fts (search_fts) VALUES ('optimize')")
+
+def record_networth_snapshots(cursor, day: Optional[str] = None) -> int:
+    """Write today's (or `day`'s) net-worth row for every user; returns the number of users"""
+    day = day or datetime.datetime.utcnow().date().isoformat()
+    cursor.execute("SELECT id FROM users")
+    user_ids = [(row["id"], day) for row in cursor.fetchall()]
+    cursor.executemany(networth_upsert_sql("?1", "?2"), user_ids)
+    return len(user_ids)
+
+@app.cli.command("snapshot-networth")
+def snapshot_networth_command():
+    """Record today's net worth for every user"""
+    conn = get_conn()
+    count = record_networth_snapshots(conn.cursor())
+    conn.commit()
+    conn.close()
+    print(f"Recorded net worth for {count} users")
+
+@app.cli.command("rebuild-search")
+def rebuild_search_command():
+    """Rebuild the full-text search index from base tables"""
+    conn = get_conn()
+    rebuild_search_index(conn.cursor())
+    conn.commit()
+    conn.close()
+    print("Search index rebuilt.")
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Recompute monthly spending/income rollups from base tables"""
+    conn = get_conn()
+    rebuild_rollups(conn.cursor())
+    conn.commit()
+    conn.close()
+    print("Rollups rebuilt.")
+
+# ------------------- App factory -------------------
+# Bump whenever init_db changes (tables, columns, indexes, triggers). A database stamped with
+# this version skips init_db, so a worker's boot costs one PRAGMA read instead of the DDL.
+SCHEMA_VERSION = 48
+
+def schema_settings() -> str:
+    """Settings compiled into trigger bodies; the stamp covers them so changing one reruns init_db"""
+    return json.dumps({
+        "ANOMALY_Z_SCORE": ANOMALY_Z_SCORE,
+        "ANOMALY_MIN_SAMPLES": ANOMALY_MIN_SAMPLES,
+        "ANOMALY_MIN_RATIO": ANOMALY_MIN_RATIO,
+        "DUPLICATE_WINDOW_DAYS": DUPLICATE_WINDOW_DAYS,
+        "LEDGER_SNAPSHOT_INTERVAL": LEDGER_SNAPSHOT_INTERVAL,
+    }, sort_keys=True)
+
+def ensure_schema() -> bool:
+    """Run init_db once per process unless the database is at SCHEMA_VERSION with the same trigger settings; True if it ran"""
+    with _schema_lock:
+        if _schema_ready[0]:
+            return False
+        conn = connect()
+        try:
+            current = conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+            if current:
+                row = conn.execute("SELECT value FROM schema_meta WHERE key = 'settings'").fetchone()
+                current = row is not None and row["value"] == schema_settings()
+        except sqlite3.OperationalError:
+            current = False  # no schema_meta yet
+        finally:
+            conn.close()
+        if not current:
+            init_db()
+            conn = connect()
+            try:
+                conn.execute("CREATE TABLE IF NOT EXISTS schema_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+                conn.execute("INSERT OR REPLACE INTO schema_meta (key, value) VALUES ('settings', ?)", (schema_settings(),))
+                conn.commit()
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            finally:
+                conn.close()
+        _schema_ready[0] = True
+        return not current
+
+# Proxies in front of the app (nginx: 1) whose X-Forwarded-For/-Proto/-Host are trusted, so
+# request.remote_addr is the client and the per-IP auth limit is not shared by everyone
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+def create_app() -> Flask:
+    """The application with its database schema checked; for WSGI servers and `flask --app "app:create_app()"`"""
+    ensure_schema()
+    if TRUSTED_PROXY_HOPS > 0 and not isinstance(app.wsgi_app, ProxyFix):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS,
+                                x_host=TRUSTED_PROXY_HOPS)
+    return app
+
+# ------------------- LLM policy -------------------
+def cerebras_client(api_key: str):
+    """Cerebras client for the user's API key, importing the SDK on first use"""
+    from cerebras.cloud.sdk import Cerebras
+    return Cerebras(api_key=api_key)
 
-# ------------------- LLM policy -------------------
 SYSTEM_POLICY = f"""
 You are FinanceRouter, a gatekeeping and extraction model for a finance-only assistant.
 
@@ -521,6 +1760,20 @@ def get_user_context_for_llm(user_id: str, cursor) -> str:
             account = asset["account"] or asset["asset_type"]
             context_parts.append(f"- {asset['asset_type']} ({account}): ${value:.2f} - {liquidity}")
     
+    # Short cash-flow outlook so "can I afford X by <month>" questions have something to go on.
+    # Only a forecast /api/forecast already computed for the current data; a chat turn never runs one.
+    try:
+        outlook = user_forecast(user_id, cursor, months=12, cached_only=True)
+        if outlook and (assets or liabilities):
+            median = outlook["cash"]["p50"]
+            low = outlook["cash"]["p5"]
+            context_parts.append("\nCASH FORECAST (liquid cash, median / 5th percentile):")
+            for i in (0, 2, 5, 11):
+                context_parts.append(f"- {outlook['months'][i]}: ${median[i]:.2f} / ${low[i]:.2f}, "
+                                     f"shortfall risk {outlook['probability_cash_shortfall'][i] * 100:.0f}%")
+    except Exception:
+        app.logger.exception("Cash forecast for the chat context failed")
+    
     return "\n".join(context_parts) if context_parts else ""
 
 # ------------------- LLM call -------------------
@@ -634,7 +1887,10 @@ def llm_route_extract(message: str, history: List[dict], user_context: str = "",
     user_model: user's selected model
     """
     # SECURITY: Check for prompt injection attempts
-    if detect_prompt_injection(message):
+    with tracing.span("llm.injection_scan", chars=len(message)) as scan:
+        injected = detect_prompt_injection(message)
+        scan.set(detected=injected)
+    if injected:
         return {
             "topic": "not_finance",
             "intent": "security_violation",
@@ -647,7 +1903,8 @@ def llm_route_extract(message: str, history: List[dict], user_context: str = "",
         }
     
     # SECURITY: Sanitize user input
-    message = sanitize_user_input(message)
+    with tracing.span("llm.sanitize"):
+        message = sanitize_user_input(message)
     
     # Check if user has provided API key - require for ALL queries
     if not user_api_key:
@@ -664,7 +1921,7 @@ def llm_route_extract(message: str, history: List[dict], user_context: str = "",
     
     # Create Cerebras client with user's API key
     try:
-        user_client = Cerebras(api_key=user_api_key)
+        user_client = cerebras_client(user_api_key)
     except Exception as e:
         return {
             "topic": "finance",
@@ -684,20 +1941,27 @@ def llm_route_extract(message: str, history: List[dict], user_context: str = "",
     
     messages = [{"role": "system", "content": enhanced_policy}]
     # include recent history for context (last 20 turns) - SECURITY: sanitize history
-    for m in history[-20:]:
-        if m.get("role") in ("user", "assistant"):
-            # SECURITY: Sanitize historical messages to prevent injection through history
-            content = sanitize_user_input(str(m.get("content", "")))
-            if not detect_prompt_injection(content):
-                messages.append({"role": m["role"], "content": content})
+    with tracing.span("llm.history_scan") as scan:
+        dropped = 0
+        for m in history[-20:]:
+            if m.get("role") in ("user", "assistant"):
+                # SECURITY: Sanitize historical messages to prevent injection through history
+                content = sanitize_user_input(str(m.get("content", "")))
+                if not detect_prompt_injection(content):
+                    messages.append({"role": m["role"], "content": content})
+                else:
+                    dropped += 1
+        scan.set(messages=len(messages) - 1, dropped=dropped)
     
     # SECURITY: Add final sanitized user message
     messages.append({"role": "user", "content": message})
 
+    # Use user's selected model or fall back to default
+    model_to_use = user_model or "llama3.1-8b"
+    started = time.perf_counter()
+    outcome = "error"
+    llm_span = tracing.start_span("llm.completion", model=model_to_use, prompt_chars=sum(len(m["content"]) for m in messages))
     try:
-        # Use user's selected model or fall back to default
-        model_to_use = user_model or "llama3.1-8b"
-        
         resp = user_client.chat.completions.create(
             model=model_to_use,
             response_format={"type": "json_object"},
@@ -705,6 +1969,7 @@ def llm_route_extract(message: str, history: List[dict], user_context: str = "",
             top_p=0.9,
             messages=messages,
         )
+        outcome = "invalid_response"
         content = resp.choices[0].message.content
         try:
             parsed = json.loads(content)
@@ -722,6 +1987,7 @@ def llm_route_extract(message: str, history: List[dict], user_context: str = "",
                     "confidence": 1.0,
                 }
             
+            outcome = "ok"
             return parsed
         except Exception as e:
             # Fallback: reject gracefully
@@ -739,6 +2005,7 @@ def llm_route_extract(message: str, history: List[dict], user_context: str = "",
         # Handle API call errors
         error_message = str(e)
         if "invalid" in error_message.lower() or "unauthorized" in error_message.lower():
+            outcome = "auth_error"
             return {
                 "topic": "not_finance",
                 "intent": "other",
@@ -760,9 +2027,50 @@ def llm_route_extract(message: str, history: List[dict], user_context: str = "",
                 "fallback_reason": f"API error: {error_message}",
                 "confidence": 0.0,
             }
+    finally:
+        LLM_LATENCY.observe(time.perf_counter() - started, model=model_to_use, outcome=outcome)
+        tracing.finish_span(llm_span, outcome=outcome)
+
+# ------------------- Name Resolution -------------------
+# Tie-breakers when several rows match equally well
+NAME_RESOLUTION_ORDER = {
+    "liabilities": "priority_score DESC, id",
+    "assets": "asset_value_cents DESC, id",
+}
+
+def normalized_name(text: Optional[str]) -> str:
+    """Python twin of the name_norm column: lower(trim(name)), which folds ASCII only"""
+    return "".join(ch.lower() if ch.isascii() else ch for ch in (text or "").strip(" "))
+
+def resolve_named_row(cursor, table: str, user_id: str, term: Optional[str], extra_where: str = "") -> Optional[int]:
+    """
+    Map a free-text name (e.g. the LLM's liability_type) to one row id of the user's table.
+    Tiers: exact name_norm match, then prefix (both index range scans). There is no fuzzy
+    tier: callers write to the row, and "student loan" must never resolve to "car loan".
+    On a miss the chat asks the user which row they meant.
+    """
+    name = normalized_name(term)
+    if not name:
+        return None
+    order_by = NAME_RESOLUTION_ORDER[table]
+    
+    cursor.execute(f"SELECT id FROM {table} WHERE user_id = ? AND name_norm = ? {extra_where} ORDER BY {order_by} LIMIT 1",
+                   (user_id, name))
+    row = cursor.fetchone()
+    if row:
+        return row["id"]
+    
+    upper = name[:-1] + chr(ord(name[-1]) + 1)
+    cursor.execute(f"""
+        SELECT id FROM {table}
+        WHERE user_id = ? AND name_norm >= ? AND name_norm < ? {extra_where}
+        ORDER BY length(name_norm), {order_by} LIMIT 1
+    """, (user_id, name, upper))
+    row = cursor.fetchone()
+    return row["id"] if row else None
 
 # ------------------- SQL builder -------------------
-def build_sql_and_params(user_id: str, source_text: str, llm: dict):
+def build_sql_and_params(user_id: str, source_text: str, llm: dict, cursor):
     x = llm.get("extracted", {}) or {}
     created_at = now_iso()
 
@@ -775,15 +2083,23 @@ def build_sql_and_params(user_id: str, source_text: str, llm: dict):
         miss = missing(req)
         if miss:
             raise ValueError(f"missing fields for expense: {miss}")
+        amount_cents = to_cents(float(x.get("amount")))
+        category_source = "llm"
+        if not x.get("category"):
+            # Written back into the extraction so the ledger posting and reply use it too
+            x["category"], x["category_confidence"] = predict_category(
+                cursor, user_id, x.get("merchant"), x.get("note"), source_text)
+            category_source = "model" if x["category"] else None
+        merchant_id = resolve_merchant_id(cursor, x.get("merchant"))
         sql = """
         INSERT INTO expenses (user_id, occurred_at, amount_cents, currency, merchant,
-                              category, account, note, source_text, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                              category, account, note, source_text, created_at, category_source, merchant_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """
         params = [
             user_id,
             x.get("date"),
-            to_cents(float(x.get("amount"))),
+            amount_cents,
             currency_clean(x.get("currency")),
             x.get("merchant"),
             x.get("category"),
@@ -791,6 +2107,8 @@ def build_sql_and_params(user_id: str, source_text: str, llm: dict):
             x.get("note"),
             source_text,
             created_at,
+            category_source,
+            merchant_id,
         ]
         return sql.strip(), params, "expenses"
 
@@ -880,10 +2198,16 @@ def build_sql_and_params(user_id: str, source_text: str, llm: dict):
             total_amount = float(x.get("total_amount"))
             installment_amount = float(x.get("installment_amount"))
             frequency = x.get("frequency")
-            installments_total = int(total_amount / installment_amount) if installment_amount > 0 else 1
         
         # Common processing for both types
         remaining_amount = float(x.get("remaining_amount", total_amount))
+        if not is_one_time_bill:
+            # Installments needed to clear the remaining balance including interest. A loan whose
+            # installment never covers the interest keeps the plain count and is flagged on save.
+            installments_total = amortization.periods_remaining(
+                to_cents(remaining_amount), to_cents(installment_amount), float(x.get("interest_rate") or 0.0), frequency)
+            if installments_total is None:
+                installments_total = max(1, int(total_amount / installment_amount)) if installment_amount > 0 else 1
         
         # Priority processing with smart defaults
         priority_score = x.get("priority_score", 50)  # Default to 50
@@ -1011,16 +2335,19 @@ def build_sql_and_params(user_id: str, source_text: str, llm: dict):
         priority_score = max(1, min(100, int(priority_score)))
         
         liability_type = x.get("liability_type")
+        liability_id = resolve_named_row(cursor, "liabilities", user_id, liability_type)
+        if liability_id is None:
+            raise ValueError(f"No liability found matching '{liability_type}'")
         sql = """
         UPDATE liabilities 
-        SET priority_score = ?, updated_at = ?
-        WHERE user_id = ? AND LOWER(liability_type) LIKE LOWER(?)
+        SET priority_score = ?, version = version + 1, updated_at = ?
+        WHERE id = ? AND user_id = ?
         """
         params = [
             priority_score,
             created_at,
-            user_id,
-            f"%{liability_type}%"
+            liability_id,
+            user_id
         ]
         return sql.strip(), params, "liabilities"
 
@@ -1051,16 +2378,20 @@ def build_sql_and_params(user_id: str, source_text: str, llm: dict):
         if not updates:
             raise ValueError("No fields to update for asset")
         
+        updates.append("version = version + 1")
         updates.append("updated_at = ?")
         params.append(created_at)
         
-        # Add WHERE clause parameters
-        params.extend([user_id, f"%{asset_type}%"])
+        # Resolve the name once, then write by primary key
+        asset_id = resolve_named_row(cursor, "assets", user_id, asset_type)
+        if asset_id is None:
+            raise ValueError(f"No asset found matching '{asset_type}'")
+        params.extend([asset_id, user_id])
         
         sql = f"""
         UPDATE assets 
         SET {', '.join(updates)}
-        WHERE user_id = ? AND LOWER(asset_type) LIKE LOWER(?)
+        WHERE id = ? AND user_id = ?
         """
         return sql.strip(), params, "assets"
 
@@ -1114,16 +2445,20 @@ def build_sql_and_params(user_id: str, source_text: str, llm: dict):
         if not updates:
             raise ValueError("No fields to update for liability")
         
+        updates.append("version = version + 1")
         updates.append("updated_at = ?")
         params.append(created_at)
         
-        # Add WHERE clause parameters
-        params.extend([user_id, f"%{liability_type}%"])
+        # Resolve the name once, then write by primary key
+        liability_id = resolve_named_row(cursor, "liabilities", user_id, liability_type)
+        if liability_id is None:
+            raise ValueError(f"No liability found matching '{liability_type}'")
+        params.extend([liability_id, user_id])
         
         sql = f"""
         UPDATE liabilities 
         SET {', '.join(updates)}
-        WHERE user_id = ? AND LOWER(liability_type) LIKE LOWER(?)
+        WHERE id = ? AND user_id = ?
         """
         return sql.strip(), params, "liabilities"
 
@@ -1156,29 +2491,24 @@ def build_sql_and_params(user_id: str, source_text: str, llm: dict):
 
 def add_to_existing_cash_asset(user_id: str, amount_cents: int, cursor):
     """Add money to existing cash asset or create new one if it doesn't exist"""
-    # Look for existing cash asset
-    cursor.execute("""
-        SELECT id, asset_value_cents 
-        FROM assets 
-        WHERE user_id = ? AND (
-            LOWER(asset_type) LIKE '%cash%' OR 
-            LOWER(account) LIKE '%cash%'
-        )
-        ORDER BY asset_value_cents DESC
-        LIMIT 1
-    """, (user_id,))
-    
-    existing_cash = cursor.fetchone()
+    # Look for existing cash asset by name, then by account via the asset resolver
+    cash_id = resolve_named_row(cursor, "assets", user_id, "cash")
+    if cash_id is None:
+        cash = find_matching_asset(user_id, "cash", cursor, liquid_only=False)
+        cash_id = cash["id"] if cash else None
+    existing_cash = {"id": cash_id} if cash_id is not None else None
+    tag_ledger_posting(cursor, user_id, "income", "chat", description="Cash received")
     
     if existing_cash:
-        # Add to existing cash asset
-        new_balance = existing_cash["asset_value_cents"] + amount_cents
+        # Add to existing cash asset; relative increment so concurrent credits are not lost
         cursor.execute("""
             UPDATE assets 
-            SET asset_value_cents = ?, updated_at = ?
+            SET asset_value_cents = asset_value_cents + ?, version = version + 1, updated_at = ?
             WHERE id = ?
-        """, (new_balance, now_iso(), existing_cash["id"]))
-        return existing_cash["id"], new_balance, True
+        """, (amount_cents, now_iso(), existing_cash["id"]))
+        clear_ledger_posting(cursor, user_id)
+        cursor.execute("SELECT asset_value_cents FROM assets WHERE id = ?", (existing_cash["id"],))
+        return existing_cash["id"], cursor.fetchone()["asset_value_cents"], True
     else:
         # Create new cash asset
         cursor.execute("""
@@ -1187,47 +2517,59 @@ def add_to_existing_cash_asset(user_id: str, amount_cents: int, cursor):
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (user_id, "Cash", amount_cents, "Cash on hand", "Cash", True, 
               now_iso().split('T')[0], now_iso(), now_iso()))
+        clear_ledger_posting(cursor, user_id)
         return cursor.lastrowid, amount_cents, False
 
 def process_liability_payment(user_id: str, payment_data: dict, cursor):
     """Process liability payment with balance checking and updates"""
     liability_type = payment_data["liability_type"]
-    payment_type = payment_data["payment_type"]
-    payment_amount = payment_data.get("payment_amount")
-    payment_account = payment_data["payment_account"]
-    created_at = payment_data["created_at"]
     
     # Find matching liability
+    liability_id = resolve_named_row(cursor, "liabilities", user_id, liability_type, "AND is_completed = 0")
     cursor.execute("""
         SELECT id, liability_type, remaining_amount_cents, installment_amount_cents,
-               installments_total, installments_paid, is_completed
+               installments_total, installments_paid, is_completed, version
         FROM liabilities 
-        WHERE user_id = ? AND LOWER(liability_type) LIKE LOWER(?) AND is_completed = 0
-        ORDER BY priority_score DESC
-        LIMIT 1
-    """, (user_id, f"%{liability_type}%"))
+        WHERE id = ? AND user_id = ?
+    """, (liability_id, user_id))
     
     liability = cursor.fetchone()
     if not liability:
         raise ValueError(f"No active liability found matching '{liability_type}'")
     
-    # Determine payment amount based on payment type
+    return apply_liability_payment(user_id, liability, payment_data["payment_type"], payment_data.get("payment_amount"),
+                                   payment_data["payment_account"], cursor, payment_data["created_at"])
+
+def apply_liability_payment(user_id: str, liability, payment_type: str, payment_amount, payment_account: str,
+                            cursor, updated_at: Optional[str] = None, asset=None, reference_type: str = "liability_payment",
+                            settles_installment: bool = False):
+    """
+    Pay a liability from an asset as one atomic unit. The caller commits, or rolls back on error.
+    The liability update is guarded by its version and the asset debit by its balance, so a
+    concurrent payment or expense makes this raise instead of overdrawing or double-paying.
+    Pass `asset` to pay from a known asset row instead of matching payment_account by name, and
+    `settles_installment` when the payment covers the current due date whatever its amount.
+    """
     remaining_amount_cents = liability["remaining_amount_cents"]
     installment_amount_cents = liability["installment_amount_cents"]
     
+    # Determine payment amount based on payment type
     if payment_type == "full":
         actual_payment_cents = remaining_amount_cents
     elif payment_type == "installment":
         actual_payment_cents = min(installment_amount_cents, remaining_amount_cents)
-    elif payment_type == "partial" and payment_amount:
-        actual_payment_cents = to_cents(float(payment_amount))
-        if actual_payment_cents > remaining_amount_cents:
-            actual_payment_cents = remaining_amount_cents
+    elif payment_type == "partial":
+        if not payment_amount:
+            raise ValueError("Payment amount required for partial payment")
+        actual_payment_cents = min(to_cents(float(payment_amount)), remaining_amount_cents)
     else:
-        raise ValueError("Invalid payment type or missing payment amount for partial payment")
+        raise ValueError("Invalid payment type")
     
-    # Check asset balance
-    balance_ok, result = check_asset_balance(user_id, payment_account, actual_payment_cents, cursor)
+    # Check asset balance (friendly errors; the guarded debit below is authoritative)
+    if asset is None:
+        balance_ok, result = check_asset_balance(user_id, payment_account, actual_payment_cents, cursor)
+    else:
+        balance_ok, result = check_funds(asset, actual_payment_cents)
     if not balance_ok:
         raise ValueError(result)  # Error message from balance check
     
@@ -1240,21 +2582,27 @@ def process_liability_payment(user_id: str, payment_data: dict, cursor):
     # Only increment installments_paid if this is a full installment payment
     # or if the payment amount equals or exceeds the installment amount
     new_installments_paid = liability["installments_paid"]
-    if actual_payment_cents >= installment_amount_cents or payment_type == "installment":
+    if actual_payment_cents >= installment_amount_cents or payment_type == "installment" or settles_installment:
         new_installments_paid += 1
     
-    # Update liability
+    # Update liability only if nobody changed it since we read it
     cursor.execute("""
         UPDATE liabilities 
         SET remaining_amount_cents = ?, 
             installments_paid = ?,
             is_completed = ?,
+            version = version + 1,
             updated_at = ?
-        WHERE id = ?
-    """, (max(0, new_remaining_cents), new_installments_paid, is_completed, created_at, liability["id"]))
+        WHERE id = ? AND version = ? AND is_completed = 0
+    """, (max(0, new_remaining_cents), new_installments_paid, is_completed, updated_at or now_iso(),
+          liability["id"], liability["version"]))
+    if cursor.rowcount != 1:
+        raise ConcurrentUpdateError(f"{liability['liability_type']} was changed by another request. Please try again.")
+    advance_due_dates(cursor, liability["id"])
     
     # Deduct from asset
-    deduct_from_asset(asset["id"], actual_payment_cents, cursor)
+    new_balance_cents = deduct_from_asset(asset["id"], actual_payment_cents, cursor, f"liability:{liability['id']}",
+                                          reference_type, liability["id"], f"{payment_type} payment: {liability['liability_type']}")
     
     # Return payment details for response
     return {
@@ -1263,50 +2611,92 @@ def process_liability_payment(user_id: str, payment_data: dict, cursor):
         "payment_amount": actual_payment_cents / 100,
         "remaining_amount": max(0, new_remaining_cents) / 100,
         "asset_name": asset["asset_type"] or asset["account"],
-        "asset_new_balance": (asset["asset_value_cents"] - actual_payment_cents) / 100,
+        "asset_new_balance": new_balance_cents / 100,
         "is_completed": is_completed,
         "payment_type": payment_type
     }
 
 # ------------------- Asset Balance Checking -------------------
-def find_matching_asset(user_id: str, account_name: str, cursor):
-    """Find asset that matches the account/payment method"""
-    # Normalize account name for matching
-    account_lower = account_name.lower().strip()
+def load_asset_resolution_keys(user_id: str, version: int, cursor) -> list:
+    """Stored resolver keys for the user, rebuilt first if they predate the current asset index version"""
+    cursor.execute("SELECT version FROM asset_resolution_state WHERE user_id = ?", (user_id,))
+    state = cursor.fetchone()
+    if state and state["version"] == version:
+        cursor.execute("SELECT key_type, key, asset_id, weight FROM asset_resolution_keys WHERE user_id = ?", (user_id,))
+        return [tuple(row) for row in cursor.fetchall()]
     
-    # Get all user's liquid assets
+    cursor.execute("SELECT id, asset_type, account FROM assets WHERE user_id = ?", (user_id,))
+    assets = [dict(row) for row in cursor.fetchall()]
+    cursor.execute("SELECT alias, asset_id FROM asset_aliases WHERE user_id = ?", (user_id,))
+    keys = asset_resolver.build_keys(assets, [(row["alias"], row["asset_id"]) for row in cursor.fetchall()])
+    cursor.execute("DELETE FROM asset_resolution_keys WHERE user_id = ?", (user_id,))
+    cursor.executemany("""
+        INSERT INTO asset_resolution_keys (user_id, key_type, key, asset_id, weight) VALUES (?, ?, ?, ?, ?)
+    """, [(user_id,) + key for key in keys])
     cursor.execute("""
-        SELECT id, asset_type, asset_value_cents, account 
-        FROM assets 
-        WHERE user_id = ? AND is_liquid = 1
-        ORDER BY asset_value_cents DESC
-    """, (user_id,))
-    
-    assets = cursor.fetchall()
+        INSERT INTO asset_resolution_state (user_id, version) VALUES (?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET version = excluded.version
+    """, (user_id, version))
+    return keys
+
+def asset_index(user_id: str, cursor) -> Optional[asset_resolver.AssetIndex]:
+    cursor.execute("SELECT asset_index_version FROM users WHERE id = ?", (user_id,))
+    user = cursor.fetchone()
+    if not user:
+        return None
+    version = user["asset_index_version"] or 0
+    return asset_resolver.cached_index(user_id, version, lambda: load_asset_resolution_keys(user_id, version, cursor))
+
+def resolve_assets(user_id: str, text: str, cursor, liquid_only: bool = True, limit: int = 5):
+    """
+    Ranked candidate assets for free text such as "my chase card", typos and partial words included.
+    Returns (rows, scores by asset id, ambiguous); ties are broken by the larger balance.
+    Only for suggestions: writes use find_matching_asset, which never guesses.
+    """
+    index = asset_index(user_id, cursor)
+    if index is None:
+        return [], {}, False
+    ranked = index.resolve(text or "", limit=limit * 2 if liquid_only else limit)
+    if not ranked:
+        return [], {}, False
     
-    # Try exact matches first
-    for asset in assets:
-        if asset["account"] and asset["account"].lower().strip() == account_lower:
-            return asset
-        if asset["asset_type"] and asset["asset_type"].lower().strip() == account_lower:
-            return asset
-    
-    # Try partial matches
-    for asset in assets:
-        if (asset["account"] and account_lower in asset["account"].lower()) or \
-           (asset["asset_type"] and account_lower in asset["asset_type"].lower()):
-            return asset
-        # Special cases for common payment methods
-        if account_lower in ["cash", "cash account"] and asset["asset_type"] and "cash" in asset["asset_type"].lower():
-            return asset
-        if account_lower in ["checking", "checking account"] and asset["asset_type"] and "checking" in asset["asset_type"].lower():
-            return asset
-        if account_lower in ["savings", "savings account"] and asset["asset_type"] and "savings" in asset["asset_type"].lower():
-            return asset
-        if account_lower in ["credit card", "credit"] and asset["asset_type"] and "credit" in asset["asset_type"].lower():
-            return asset
-    
-    return None
+    scores = dict(ranked)
+    cursor.execute(f"""
+        SELECT id, asset_type, asset_value_cents, account, is_liquid
+        FROM assets
+        WHERE id IN ({",".join("?" * len(scores))}) AND user_id = ? {"AND is_liquid = 1" if liquid_only else ""}
+    """, list(scores) + [user_id])
+    rows = sorted(cursor.fetchall(), key=lambda r: (-scores[r["id"]], -r["asset_value_cents"]))[:limit]
+    ambiguous = asset_resolver.is_ambiguous([(r["id"], scores[r["id"]]) for r in rows])
+    return rows, scores, ambiguous
+
+class AmbiguousAssetError(ValueError):
+    """Raised when free text names more than one asset a write could use"""
+
+    def __init__(self, text: str, rows):
+        self.candidates = [{"asset_id": r["id"], "asset_type": r["asset_type"], "account": r["account"]} for r in rows]
+        names = ", ".join(r["asset_type"] or r["account"] for r in rows)
+        super().__init__(f"'{text}' matches more than one asset ({names}). Which one did you mean?")
+
+def find_matching_asset(user_id: str, account_name: str, cursor, liquid_only: bool = True):
+    """
+    The one asset an account/payment method names, by exact name, alias or all of its words.
+    Returns None when nothing matches and raises AmbiguousAssetError when several do.
+    """
+    index = asset_index(user_id, cursor)
+    ids = index.resolve_exact(account_name or "") if index is not None else []
+    if not ids:
+        return None
+    cursor.execute(f"""
+        SELECT id, asset_type, asset_value_cents, account, is_liquid
+        FROM assets
+        WHERE id IN ({",".join("?" * len(ids))}) AND user_id = ? {"AND is_liquid = 1" if liquid_only else ""}
+        ORDER BY asset_value_cents DESC
+    """, ids + [user_id])
+    rows = cursor.fetchall()
+    if len(rows) > 1:
+        raise AmbiguousAssetError(account_name, rows)
+    return rows[0] if rows else None
 
 def check_asset_balance(user_id: str, account_name: str, expense_amount_cents: int, cursor):
     """Check if asset has sufficient balance for expense"""
@@ -1315,19 +2705,447 @@ def check_asset_balance(user_id: str, account_name: str, expense_amount_cents: i
     if not asset:
         return False, f"No asset found matching payment method '{account_name}'. Please add this asset first or use an existing payment method."
     
+    return check_funds(asset, expense_amount_cents)
+
+def check_funds(asset, expense_amount_cents: int):
+    """Balance half of check_asset_balance for an asset row that is already known"""
     if asset["asset_value_cents"] < expense_amount_cents:
         return False, f"Insufficient funds in {asset['asset_type'] or asset['account']}. Available: ${asset['asset_value_cents']/100:.2f}, Required: ${expense_amount_cents/100:.2f}"
     
     return True, asset
 
-def deduct_from_asset(asset_id: str, expense_amount_cents: int, cursor):
-    """Deduct expense amount from asset balance"""
+class InsufficientFundsError(ValueError):
+    """Raised when a guarded debit finds the asset balance too low"""
+
+class ConcurrentUpdateError(ValueError):
+    """Raised when a row changed between being read and being written"""
+
+def expected_version(value) -> int:
+    """The client's `version` for an optimistic update; ValueError (a 400) unless it is an integer"""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError("version must be an integer")
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError("version must be an integer")
+
+def deduct_from_asset(asset_id: str, expense_amount_cents: int, cursor, counter_account: str = "expense",
+                      reference_type: Optional[str] = None, reference_id=None, description: Optional[str] = None) -> int:
+    """
+    Deduct expense amount from asset balance and return the new balance.
+    The balance check and the write are one conditional UPDATE, so two concurrent
+    debits can never both pass a stale balance check and overdraw the asset.
+    counter_account/reference_* label the ledger entry for the debit.
+    """
+    cursor.execute("SELECT user_id FROM assets WHERE id = ?", (asset_id,))
+    owner = cursor.fetchone()
+    if owner:
+        tag_ledger_posting(cursor, owner["user_id"], counter_account, reference_type, reference_id, description)
     cursor.execute("""
         UPDATE assets 
         SET asset_value_cents = asset_value_cents - ?, 
+            version = version + 1,
             updated_at = ?
-        WHERE id = ?
-    """, (expense_amount_cents, now_iso(), asset_id))
+        WHERE id = ? AND asset_value_cents >= ?
+    """, (expense_amount_cents, now_iso(), asset_id, expense_amount_cents))
+    debited = cursor.rowcount == 1
+    if owner:
+        clear_ledger_posting(cursor, owner["user_id"])
+    
+    cursor.execute("SELECT asset_type, account, asset_value_cents FROM assets WHERE id = ?", (asset_id,))
+    asset = cursor.fetchone()
+    if not asset:
+        raise ValueError("Asset not found")
+    if not debited:
+        raise InsufficientFundsError(f"Insufficient funds in {asset['asset_type'] or asset['account']}. Available: ${asset['asset_value_cents']/100:.2f}, Required: ${expense_amount_cents/100:.2f}")
+    return asset["asset_value_cents"]
+
+# ------------------- Expense Categorization -------------------
+CATEGORY_MODEL_JOB_INTERVAL_SECONDS = int(os.getenv("CATEGORY_MODEL_JOB_INTERVAL_SECONDS", "86400"))
+CATEGORY_FOLD_LIMIT = 5000  # new expenses folded into the cached models per prediction
+CATEGORY_USER_TRAIN_LIMIT = 5000  # newest labelled expenses a per-user model starts from
+RECATEGORIZE_BATCH_SIZE = 1000
+
+# Rows whose category came from a person (chat, import) rather than from the model itself
+LABELLED_EXPENSE = "category IS NOT NULL AND category <> '' AND category_source IS NOT 'model'"
+CATEGORY_TRAINING_COLUMNS = "id, user_id, merchant, note, source_text, category, category_source"
+
+def expense_features(row):
+    return categorizer.features(row["merchant"], row["note"], row["source_text"])
+
+def train_category_model(cursor, n_features: int, user_id: Optional[str] = None) -> categorizer.CategoryModel:
+    """Fit a model from labelled expenses: every user's, or one user's newest ones"""
+    model = categorizer.CategoryModel(n_features)
+    cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM expenses")
+    model.trained_through = cursor.fetchone()["max_id"]
+    if user_id is None:
+        cursor.execute(f"SELECT {CATEGORY_TRAINING_COLUMNS} FROM expenses WHERE {LABELLED_EXPENSE} AND id <= ?",
+                       (model.trained_through,))
+    else:
+        cursor.execute(f"""
+            SELECT {CATEGORY_TRAINING_COLUMNS} FROM expenses
+            WHERE user_id = ? AND {LABELLED_EXPENSE} AND id <= ?
+            ORDER BY occurred_at DESC LIMIT ?
+        """, (user_id, model.trained_through, CATEGORY_USER_TRAIN_LIMIT))
+    for row in cursor:
+        model.add(row["category"], expense_features(row))
+    return model
+
+def fold_new_expenses(cursor, global_model) -> None:
+    """Learn from expenses written since the models were built (by any process), oldest first"""
+    cursor.execute(f"SELECT {CATEGORY_TRAINING_COLUMNS} FROM expenses WHERE id > ? ORDER BY id LIMIT ?",
+                   (global_model.trained_through, CATEGORY_FOLD_LIMIT))
+    for row in cursor.fetchall():
+        global_model.trained_through = row["id"]
+        if not row["category"] or row["category_source"] == "model":
+            continue
+        feats = expense_features(row)
+        global_model.add(row["category"], feats)
+        user_model = categorizer.cached_model(row["user_id"])
+        if user_model is not None and row["id"] > user_model.trained_through:
+            user_model.add(row["category"], feats)
+            user_model.trained_through = row["id"]
+
+def global_category_model(cursor):
+    """The cached global model, loaded from category_models on first use"""
+    with categorizer.lock():
+        global_model = categorizer.cached_model("global")
+        if global_model is None:
+            cursor.execute("SELECT model FROM category_models WHERE scope = 'global'")
+            row = cursor.fetchone()
+            try:
+                global_model = categorizer.CategoryModel.from_bytes(row["model"]) if row else None
+            except ValueError:
+                global_model = None  # saved in the old pickled format; the category model job rewrites it
+            global_model = categorizer.cache_model("global", global_model or categorizer.CategoryModel(categorizer.GLOBAL_FEATURES))
+        return global_model
+
+def category_models(cursor, user_id: str):
+    """(global, user) models, loaded or trained on first use and kept current incrementally"""
+    with categorizer.lock():
+        global_model = global_category_model(cursor)
+        user_model = categorizer.cached_model(user_id)
+        if user_model is None:
+            user_model = categorizer.cache_model(user_id, train_category_model(cursor, categorizer.USER_FEATURES, user_id))
+        fold_new_expenses(cursor, global_model)
+        return global_model, user_model
+
+def predict_categories(cursor, user_id: str, items: List[tuple]) -> List[tuple]:
+    """(category, confidence) per (merchant, note, source_text); category is None when the model is unsure"""
+    global_model, user_model = category_models(cursor, user_id)
+    results = []
+    with categorizer.lock():
+        for merchant, note, source_text in items:
+            label, confidence = categorizer.predict(global_model, user_model,
+                                                    categorizer.features(merchant, note, source_text))
+            results.append(((label if confidence >= categorizer.MIN_CONFIDENCE else None), confidence))
+    return results
+
+def predict_category(cursor, user_id: str, merchant: Optional[str], note: Optional[str], source_text: Optional[str]):
+    return predict_categories(cursor, user_id, [(merchant, note, source_text)])[0]
+
+def category_model_job(cursor) -> dict:
+    """Retrain the global model from scratch and persist it for other processes"""
+    model = train_category_model(cursor, categorizer.GLOBAL_FEATURES)
+    cursor.execute("""
+        INSERT INTO category_models (scope, trained_through, model, updated_at) VALUES ('global', ?, ?, ?)
+        ON CONFLICT (scope) DO UPDATE SET trained_through = excluded.trained_through,
+                                          model = excluded.model, updated_at = excluded.updated_at
+    """, (model.trained_through, model.to_bytes(), now_iso()))
+    categorizer.cache_model("global", model)
+    return {"documents": int(model.n_docs), "categories": len(model.labels)}
+
+scheduler.register("category_model", CATEGORY_MODEL_JOB_INTERVAL_SECONDS, category_model_job)
+
+def recategorize_expenses(cursor, user_id: Optional[str] = None) -> dict:
+    """
+    Re-run the model over uncategorized and model-categorized expenses in id order.
+    Categories that came from the user or an import are never touched.
+    """
+    stats = {"scanned": 0, "updated": 0}
+    last_id = 0
+    while True:
+        cursor.execute(f"""
+            SELECT {CATEGORY_TRAINING_COLUMNS} FROM expenses
+            WHERE id > ? {"AND user_id = ?" if user_id else ""}
+              AND (category IS NULL OR category = '' OR category_source = 'model')
+            ORDER BY id LIMIT ?
+        """, (last_id,) + ((user_id,) if user_id else ()) + (RECATEGORIZE_BATCH_SIZE,))
+        rows = cursor.fetchall()
+        if not rows:
+            return stats
+        updates = []
+        for row_user, group in itertools.groupby(sorted(rows, key=lambda r: r["user_id"]), key=lambda r: r["user_id"]):
+            group = list(group)
+            predictions = predict_categories(cursor, row_user, [(r["merchant"], r["note"], r["source_text"]) for r in group])
+            for row, (label, _) in zip(group, predictions):
+                if label and label != row["category"]:
+                    updates.append((label, row["id"]))
+        cursor.executemany("UPDATE expenses SET category = ?, category_source = 'model' WHERE id = ?", updates)
+        stats["scanned"] += len(rows)
+        stats["updated"] += len(updates)
+        last_id = rows[-1]["id"]
+
+@app.cli.command("recategorize-expenses")
+def recategorize_expenses_command():
+    """Assign model categories to every uncategorized expense"""
+    conn = get_conn()
+    cur = conn.cursor()
+    print(f"category_model: {category_model_job(cur)}")
+    conn.commit()
+    stats = recategorize_expenses(cur)
+    conn.commit()
+    conn.close()
+    print(f"Recategorized {stats['updated']} of {stats['scanned']} expenses")
+
+# ------------------- Merchants -------------------
+MERCHANT_BACKFILL_JOB_INTERVAL_SECONDS = int(os.getenv("MERCHANT_BACKFILL_JOB_INTERVAL_SECONDS", "3600"))
+MERCHANT_BACKFILL_BATCH_SIZE = 1000
+MERCHANT_BACKFILL_JOB_LIMIT = 50000  # rows per scheduled run, so one run never holds the write lock for long
+
+def lookup_merchant_alias(cursor, key: str) -> Optional[int]:
+    cursor.execute("SELECT merchant_id FROM merchant_aliases WHERE alias = ?", (key,))
+    row = cursor.fetchone()
+    return row["merchant_id"] if row else None
+
+def resolve_merchant_id(cursor, name: Optional[str]) -> Optional[int]:
+    """
+    Canonical merchant id for a free-text merchant, creating the merchant on first sight.
+    A key that extends a known name of at least MIN_PREFIX_WORDS words ("blue bottle coffee"
+    vs "blue bottle"), or that such a known name extends, joins that merchant; "home" and
+    "home depot" stay apart. Every key seen is stored as an alias. The alias cache only
+    learns it once the transaction commits: a rolled-back merchant id is reused by SQLite.
+    """
+    key = merchants.normalize(name)
+    if not key:
+        return None
+    merchant_id = merchants.cached(key)
+    if merchant_id is not None:
+        return merchant_id
+    
+    merchant_id = lookup_merchant_alias(cursor, key)
+    if merchant_id is None:
+        for prefix in merchants.prefixes(key):
+            merchant_id = lookup_merchant_alias(cursor, prefix)
+            if merchant_id is not None:
+                break
+    if merchant_id is None and merchants.may_prefix(key):
+        # Aliases that start with this key as whole words; "!" sorts right after " "
+        cursor.execute("""
+            SELECT merchant_id FROM merchant_aliases WHERE alias > ? AND alias < ?
+            ORDER BY length(alias) LIMIT 1
+        """, (key + " ", key + "!"))
+        row = cursor.fetchone()
+        merchant_id = row["merchant_id"] if row else None
+    if merchant_id is None:
+        cursor.execute("INSERT INTO merchants (name, created_at) VALUES (?, ?)", (merchants.display_name(name), now_iso()))
+        merchant_id = cursor.lastrowid
+    
+    cursor.execute("INSERT OR IGNORE INTO merchant_aliases (alias, merchant_id, created_at) VALUES (?, ?, ?)",
+                   (key, merchant_id, now_iso()))
+    if cursor.rowcount == 0:
+        # Another writer stored this alias first; theirs wins
+        merchant_id = lookup_merchant_alias(cursor, key)
+    if isinstance(cursor.connection, InstrumentedConnection):
+        cursor.connection.after_commit(lambda: merchants.remember(key, merchant_id))
+    return merchant_id
+
+def backfill_merchants(cursor, limit: Optional[int] = None) -> dict:
+    """Resolve merchant_id for expenses written before merchants existed (or whose merchant changed)"""
+    stats = {"scanned": 0, "resolved": 0}
+    last_id = 0
+    while limit is None or stats["scanned"] < limit:
+        cursor.execute("""
+            SELECT id, merchant FROM expenses
+            WHERE merchant_id IS NULL AND merchant IS NOT NULL AND id > ?
+            ORDER BY id LIMIT ?
+        """, (last_id, MERCHANT_BACKFILL_BATCH_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        updates = [(merchant_id, row["id"]) for row in rows
+                   for merchant_id in [resolve_merchant_id(cursor, row["merchant"])] if merchant_id is not None]
+        cursor.executemany("UPDATE expenses SET merchant_id = ? WHERE id = ?", updates)
+        stats["scanned"] += len(rows)
+        stats["resolved"] += len(updates)
+        last_id = rows[-1]["id"]
+    return stats
+
+def merchant_backfill_job(cursor) -> dict:
+    return backfill_merchants(cursor, MERCHANT_BACKFILL_JOB_LIMIT)
+
+scheduler.register("merchant_backfill", MERCHANT_BACKFILL_JOB_INTERVAL_SECONDS, merchant_backfill_job)
+
+@app.cli.command("backfill-merchants")
+def backfill_merchants_command():
+    """Resolve canonical merchants for every expense that has none"""
+    conn = get_conn()
+    stats = backfill_merchants(conn.cursor())
+    conn.commit()
+    conn.close()
+    print(f"Resolved merchants for {stats['resolved']} of {stats['scanned']} expenses")
+
+# ------------------- Ledger -------------------
+def tag_ledger_posting(cursor, user_id: str, counter_account: str, reference_type: Optional[str] = None,
+                       reference_id=None, description: Optional[str] = None):
+    """
+    Name the counter account for the user's next asset balance change (consumed by the ledger
+    triggers). Call clear_ledger_posting() right after the write: one that leaves the balance
+    unchanged fires no trigger and would leave the label for an unrelated later change.
+    """
+    cursor.execute("""
+        INSERT OR REPLACE INTO ledger_pending (user_id, counter_account, reference_type, reference_id, description)
+        VALUES (?, ?, ?, ?, ?)
+    """, (user_id, counter_account, reference_type, None if reference_id is None else str(reference_id), description))
+
+def clear_ledger_posting(cursor, user_id: str):
+    cursor.execute("DELETE FROM ledger_pending WHERE user_id = ?", (user_id,))
+
+def asset_balances_as_of(cursor, user_id: str, as_of: str) -> dict:
+    """{asset_id: balance_cents} at timestamp as_of, from the nearest snapshot plus its tail of entries"""
+    cursor.execute("""
+        WITH assets_seen AS (
+            SELECT DISTINCT asset_id FROM asset_balance_snapshots WHERE user_id = ?
+        ),
+        base AS (
+            SELECT a.asset_id, s.entry_id, s.balance_cents
+            FROM assets_seen a
+            LEFT JOIN asset_balance_snapshots s
+              ON s.asset_id = a.asset_id
+             AND s.entry_id = (SELECT MAX(entry_id) FROM asset_balance_snapshots
+                               WHERE asset_id = a.asset_id AND taken_at <= ?)
+        )
+        SELECT b.asset_id,
+               COALESCE(b.balance_cents, 0) + COALESCE((
+                   SELECT SUM(e.amount_cents) FROM ledger_entries e
+                   WHERE e.asset_id = b.asset_id AND e.id > COALESCE(b.entry_id, 0) AND e.created_at <= ?
+               ), 0) AS balance_cents
+        FROM base b
+    """, (user_id, as_of, as_of))
+    return {row["asset_id"]: row["balance_cents"] for row in cursor.fetchall()}
+
+def snapshot_asset_balances(cursor, user_id: Optional[str] = None) -> int:
+    """Snapshot every asset with entries since its last snapshot; returns the number taken"""
+    user_clause = "AND a.user_id = ?" if user_id else ""
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO asset_balance_snapshots (asset_id, entry_id, user_id, balance_cents, taken_at)
+        SELECT a.id, e.id, a.user_id, a.asset_value_cents, ?
+        FROM assets a
+        JOIN ledger_entries e ON e.id = (SELECT MAX(id) FROM ledger_entries WHERE asset_id = a.id)
+        WHERE e.id > COALESCE((SELECT MAX(entry_id) FROM asset_balance_snapshots WHERE asset_id = a.id), 0)
+          {user_clause}
+    """, (now_iso(),) + ((user_id,) if user_id else ()))
+    return cursor.rowcount
+
+@app.cli.command("snapshot-balances")
+def snapshot_balances_command():
+    """Snapshot asset balances so historical balance lookups replay fewer entries"""
+    conn = get_conn()
+    count = snapshot_asset_balances(conn.cursor())
+    conn.commit()
+    conn.close()
+    print(f"Snapshotted {count} assets")
+
+def serialize_ledger_entry(row) -> dict:
+    return {
+        "id": row["id"],
+        "txn_id": row["txn_id"],
+        "amount": row["amount_cents"] / 100,
+        "counter_account": row["counter_account"],
+        "reference_type": row["reference_type"],
+        "reference_id": row["reference_id"],
+        "description": row["description"],
+        "created_at": row["created_at"],
+    }
+
+# ------------------- Scheduled Jobs -------------------
+DUE_SOON_DAYS = int(os.getenv("DUE_SOON_DAYS", "3"))
+DUE_DATE_JOB_INTERVAL_SECONDS = int(os.getenv("DUE_DATE_JOB_INTERVAL_SECONDS", "900"))
+NETWORTH_JOB_INTERVAL_SECONDS = int(os.getenv("NETWORTH_JOB_INTERVAL_SECONDS", "3600"))
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+
+MONTHS_PER_INSTALLMENT = {"monthly": 1, "quarterly": 3, "yearly": 12, "annually": 12}
+
+def advanced_due_date_sql(periods: str) -> str:
+    """
+    SQL expression for next_due_date moved forward by `periods` installments.
+    Month-based frequencies keep the day of the original due_date, clamped to the month end.
+    """
+    months = f"({periods}) * CASE LOWER(frequency) {' '.join(f'WHEN {k!r} THEN {v}' for k, v in MONTHS_PER_INSTALLMENT.items())} ELSE 1 END"
+    anchor_day = "CAST(strftime('%d', due_date) AS INTEGER)"
+    return f"""CASE LOWER(frequency)
+        WHEN 'weekly' THEN date(next_due_date, '+' || (7 * ({periods})) || ' days')
+        WHEN 'biweekly' THEN date(next_due_date, '+' || (14 * ({periods})) || ' days')
+        ELSE MIN(date(next_due_date, 'start of month', '+' || ({months}) || ' months', '+' || ({anchor_day} - 1) || ' days'),
+                 date(next_due_date, 'start of month', '+' || ({months} + 1) || ' months', '-1 day'))
+    END"""
+
+def advance_due_dates(cursor, liability_id: Optional[int] = None) -> int:
+    """Roll next_due_date forward for installments paid since the last sweep, in one UPDATE"""
+    pending = "installments_paid - due_installments_applied"
+    cursor.execute(f"""
+        UPDATE liabilities
+        SET next_due_date = CASE WHEN is_completed = 0 AND LOWER(frequency) <> 'one-time'
+                                 THEN {advanced_due_date_sql(pending)} ELSE next_due_date END,
+            due_installments_applied = installments_paid,
+            version = version + 1,
+            updated_at = ?
+        WHERE installments_paid > due_installments_applied {"AND id = ?" if liability_id else ""}
+    """, (now_iso(),) + ((liability_id,) if liability_id else ()))
+    return cursor.rowcount
+
+def sweep_liability_events(cursor) -> int:
+    """Emit due_soon/overdue events for every active liability in one INSERT ... SELECT"""
+    today = datetime.datetime.utcnow().date().isoformat()
+    cursor.execute("""
+        INSERT OR IGNORE INTO liability_events (user_id, liability_id, event_type, due_date, amount_cents, created_at)
+        SELECT user_id, id,
+               CASE WHEN next_due_date < ? THEN 'overdue' ELSE 'due_soon' END,
+               next_due_date,
+               CASE WHEN LOWER(frequency) = 'one-time' THEN remaining_amount_cents
+                    ELSE MIN(installment_amount_cents, remaining_amount_cents) END,
+               ?
+        FROM liabilities
+        WHERE is_completed = 0 AND next_due_date <= date(?, ?)
+    """, (today, now_iso(), today, f"+{DUE_SOON_DAYS} days"))
+    return cursor.rowcount
+
+def due_dates_job(cursor) -> dict:
+    # Advance first so installments already paid do not produce overdue events
+    return {"advanced": advance_due_dates(cursor), "events": sweep_liability_events(cursor)}
+
+def networth_job(cursor) -> dict:
+    return {"users": record_networth_snapshots(cursor)}
+
+scheduler.register("due_dates", DUE_DATE_JOB_INTERVAL_SECONDS, due_dates_job)
+scheduler.register("networth_snapshots", NETWORTH_JOB_INTERVAL_SECONDS, networth_job)
+
+@app.before_request
+def start_scheduler():
+    if SCHEDULER_ENABLED:
+        scheduler.start(get_conn)
+
+@app.cli.command("run-jobs")
+def run_jobs_command():
+    """Run every scheduled job now, regardless of its next run time"""
+    conn = get_conn()
+    scheduler.ensure_jobs(conn.cursor())
+    conn.commit()
+    for name in scheduler.registered_jobs():
+        print(f"{name}: {scheduler.run_job(conn, name)}")
+    conn.close()
+
+def serialize_liability_event(row) -> dict:
+    return {
+        "id": row["id"],
+        "liability_id": row["liability_id"],
+        "liability_type": row["liability_type"],
+        "event_type": row["event_type"],
+        "due_date": row["due_date"],
+        "amount": row["amount_cents"] / 100,
+        "created_at": row["created_at"],
+        "acknowledged": row["acknowledged_at"] is not None,
+    }
 
 # ------------------- API endpoints -------------------
 @app.post("/api/sessions")
@@ -1367,6 +3185,7 @@ def get_messages(sid):
 
 @app.post("/api/chat")
 @token_required
+@idempotent
 def chat():
     data = request.get_json(force=True) or {}
     user_id = request.current_user_id
@@ -1381,16 +3200,18 @@ def chat():
     conn = get_conn()
     cur = conn.cursor()
 
-    # ensure session exists and belongs to user
-    cur.execute("SELECT id FROM sessions WHERE id = ? AND user_id = ?", (session_id, user_id))
-    if not cur.fetchone():
-        conn.close()
-        return jsonify({"error": "invalid session_id"}), 404
+    with tracing.span("chat.history") as load:
+        # ensure session exists and belongs to user
+        cur.execute("SELECT id FROM sessions WHERE id = ? AND user_id = ?", (session_id, user_id))
+        if not cur.fetchone():
+            conn.close()
+            return jsonify({"error": "invalid session_id"}), 404
 
-    # fetch recent history
-    cur.execute("SELECT role, content FROM messages WHERE session_id = ? ORDER BY id ASC", (session_id,))
-    history_rows = cur.fetchall()
-    history = [{"role": r["role"], "content": r["content"]} for r in history_rows]
+        # fetch recent history
+        cur.execute("SELECT role, content FROM messages WHERE session_id = ? ORDER BY id ASC", (session_id,))
+        history_rows = cur.fetchall()
+        history = [{"role": r["role"], "content": r["content"]} for r in history_rows]
+        load.set(messages=len(history))
 
     # save user message
     cur.execute("INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
@@ -1398,7 +3219,9 @@ def chat():
     conn.commit()
 
     # Get current user context for LLM
-    user_context = get_user_context_for_llm(user_id, cur)
+    with tracing.span("chat.user_context") as context_span:
+        user_context = get_user_context_for_llm(user_id, cur)
+        context_span.set(chars=len(user_context))
     
     # Get user's Cerebras API key and selected model
     cur.execute("SELECT cerebras_api_key, selected_model FROM users WHERE id = ?", (user_id,))
@@ -1407,7 +3230,9 @@ def chat():
     user_model = user_row["selected_model"] if user_row and user_row["selected_model"] else "llama3.1-8b"
 
     # call LLM router with real-time context, user's API key, and selected model
-    llm_json = llm_route_extract(message, history, user_context, user_api_key, user_model)
+    with tracing.span("chat.llm_route") as route_span:
+        llm_json = llm_route_extract(message, history, user_context, user_api_key, user_model)
+        route_span.set(intent=str(llm_json.get("intent")), action=str(llm_json.get("action")))
 
     status = "answered"
     reply = llm_json.get("answer_draft") or "Okay."
@@ -1487,8 +3312,11 @@ def chat():
             reply = llm_json.get("answer_draft") or "I can help you with finance-related questions."
 
     elif llm_json.get("action") == "save":
+        save_span = tracing.start_span("chat.save", intent=str(llm_json.get("intent")))
         try:
-            sql_result = build_sql_and_params(user_id, message, llm_json)
+            with tracing.span("chat.build_sql") as build_span:
+                sql_result = build_sql_and_params(user_id, message, llm_json, cur)
+                build_span.set(table="payment" if sql_result[0] == "PAYMENT_PROCESSING" else sql_result[2])
             
             # Check if this is a payment processing request
             if sql_result[0] == "PAYMENT_PROCESSING":
@@ -1512,44 +3340,61 @@ def chat():
                     reply = f"✅ Made ${payment_amount:.2f} payment on {liability_type}. Remaining: ${remaining:.2f}. Deducted from {asset_name}. New balance: ${new_balance:.2f}"
                 
                 meta["payment_result"] = payment_result
-                meta["table"] = "payment"
+                meta["table"] = table = "payment"
             
             else:
                 sql, params, table = sql_result
             
+            if table == "payment":
+                pass  # Already committed above
+            
             # Special handling for expenses - check asset balance before saving
-            if table == "expenses" and llm_json.get("intent") == "record_expense":
+            elif table == "expenses" and llm_json.get("intent") == "record_expense":
                 extracted = llm_json.get("extracted", {})
                 account_name = extracted.get("account")
                 expense_amount = float(extracted.get("amount", 0))
                 expense_amount_cents = to_cents(expense_amount)
                 
                 # Check if user has sufficient balance in the specified asset
-                balance_ok, result = check_asset_balance(user_id, account_name, expense_amount_cents, cur)
+                with tracing.span("chat.balance_check", amount_cents=expense_amount_cents) as balance_span:
+                    balance_ok, result = check_asset_balance(user_id, account_name, expense_amount_cents, cur)
+                    balance_span.set(ok=balance_ok)
                 
                 if not balance_ok:
                     # Insufficient funds or asset not found
                     status = "rejected"
                     reply = result  # Error message
                 else:
-                    # Sufficient funds - record expense and deduct from asset
-                    cur.execute(sql, params)
-                    rid = cur.lastrowid
-                    conn.commit()
-                    
-                    # Deduct from asset
+                    # Sufficient funds - deduct from asset and record expense in one transaction
                     asset = result  # Asset object returned from check_asset_balance
-                    deduct_from_asset(asset["id"], expense_amount_cents, cur)
-                    conn.commit()
+                    try:
+                        cur.execute(sql, params)
+                        rid = cur.lastrowid
+                        new_balance_cents = deduct_from_asset(
+                            asset["id"], expense_amount_cents, cur, f"expense:{extracted.get('category') or 'uncategorized'}",
+                            "expense", rid, extracted.get("merchant"))
+                        conn.commit()
+                    except InsufficientFundsError as e:
+                        # Balance was spent by a concurrent request after our check
+                        conn.rollback()
+                        raise e
                     
                     status = "saved"
                     asset_name = asset["asset_type"] or asset["account"] or "your account"
-                    new_balance = (asset["asset_value_cents"] - expense_amount_cents) / 100
+                    new_balance = new_balance_cents / 100
                     reply = f"✅ Recorded ${expense_amount:.2f} expense and deducted from {asset_name}. New balance: ${new_balance:.2f}"
                     meta["record_id"] = rid
                     meta["table"] = table
                     meta["asset_updated"] = asset["id"]
                     meta["new_balance"] = new_balance
+                    if "category_confidence" in extracted:
+                        meta["predicted_category"] = {"category": extracted.get("category"),
+                                                      "confidence": round(extracted["category_confidence"], 3)}
+                    cur.execute(f"{EXPENSE_ALERT_SELECT} WHERE a.expense_id = ? ORDER BY a.id", (rid,))
+                    alerts = [serialize_expense_alert(r) for r in cur.fetchall()]
+                    if alerts:
+                        meta["alerts"] = alerts
+                        reply += " " + " ".join(expense_alert_message(a) for a in alerts)
             
             # Special handling for cash asset additions
             elif table == "assets" and llm_json.get("intent") == "add_asset":
@@ -1691,12 +3536,39 @@ def chat():
                         reply = "Added your asset."
                     else:
                         reply = "Saved your transaction."
+                    if table == "liabilities":
+                        cur.execute("""
+                            SELECT remaining_amount_cents, installment_amount_cents, interest_rate, frequency
+                            FROM liabilities WHERE id = ?
+                        """, (rid,))
+                        saved = cur.fetchone()
+                        meta["amortizing"] = amortization.periods_remaining(
+                            saved["remaining_amount_cents"], saved["installment_amount_cents"],
+                            saved["interest_rate"], saved["frequency"]) is not None
+                        if not meta["amortizing"]:
+                            reply += " Note: the installment doesn't cover the interest, so this balance will never be paid off at that rate."
                     meta["record_id"] = rid
                     meta["table"] = table
                 
+        except AmbiguousAssetError as e:
+            conn.rollback()
+            status = "clarify"
+            reply = str(e)
+            meta["asset_candidates"] = e.candidates
+        except InsufficientFundsError as e:
+            conn.rollback()
+            status = "rejected"
+            reply = str(e)
+        except ConcurrentUpdateError as e:
+            conn.rollback()
+            status = "rejected"
+            reply = str(e)
         except Exception as e:
+            conn.rollback()
             status = "clarify"
             reply = f"I’m missing details to save this: {e}"
+            save_span.set(exception=type(e).__name__)
+        tracing.finish_span(save_span, status=status)
 
     # save assistant message
     cur.execute("INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
@@ -1704,6 +3576,7 @@ def chat():
     conn.commit()
     conn.close()
 
+    tracing.current().set(**{"chat.status": status})
     return jsonify({"status": status, "reply": reply, "meta": meta})
 
 # ------------------- Dashboard API -------------------
@@ -1814,7 +3687,7 @@ def get_assets():
     try:
         cur.execute("""
         SELECT id, asset_type, asset_value_cents, asset_description, account, 
-               is_liquid, date_received, created_at, updated_at
+               is_liquid, date_received, version, created_at, updated_at
         FROM assets WHERE user_id = ?
         ORDER BY asset_value_cents DESC
         """, (user_id,))
@@ -1832,6 +3705,7 @@ def get_assets():
                 "account": row["account"],
                 "is_liquid": bool(row["is_liquid"]),
                 "date_received": row["date_received"],
+                "version": row["version"],
                 "created_at": row["created_at"],
                 "updated_at": row["updated_at"]
             }
@@ -1854,6 +3728,7 @@ def get_tentative_assets():
 
 @app.post("/api/assets")
 @token_required
+@idempotent
 def create_asset():
     """Create a new asset"""
     user_id = request.current_user_id
@@ -1892,6 +3767,7 @@ def create_asset():
 
 @app.put("/api/assets/<int:asset_id>")
 @token_required
+@idempotent
 def update_asset(asset_id):
     """Update an existing asset"""
     user_id = request.current_user_id
@@ -1937,17 +3813,173 @@ def update_asset(asset_id):
         if not updates:
             return jsonify({"error": "No fields to update"}), 400
         
+        updates.append("version = version + 1")
         updates.append("updated_at = ?")
         params.append(now_iso())
         params.append(asset_id)
         params.append(user_id)
         
         sql = f"UPDATE assets SET {', '.join(updates)} WHERE id = ? AND user_id = ?"
+        # Optional optimistic concurrency: only apply if the client saw the latest version
+        if 'version' in data:
+            sql += " AND version = ?"
+            params.append(expected_version(data['version']))
         cur.execute(sql, params)
+        if cur.rowcount == 0:
+            return jsonify({"error": "Asset was changed by another request. Reload and try again."}), 409
         conn.commit()
         
         return jsonify({"message": "Asset updated successfully"})
         
+    except ValueError as e:
+        return jsonify({"error": f"Invalid data: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.get("/api/assets/<int:asset_id>/ledger")
+@token_required
+def get_asset_ledger(asset_id):
+    """Ledger entries for one asset (newest first) with its balance at an optional point in time"""
+    user_id = request.current_user_id
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute("SELECT asset_value_cents FROM assets WHERE id = ? AND user_id = ?", (asset_id, user_id))
+        asset = cur.fetchone()
+        if not asset:
+            return jsonify({"error": "Asset not found"}), 404
+        
+        limit = page_limit(request.args)
+        before = request.args.get("before", type=int)
+        cur.execute(f"""
+            SELECT e.id, e.txn_id, e.amount_cents, e.reference_type, e.reference_id, e.description, e.created_at,
+                   c.account AS counter_account
+            FROM ledger_entries e
+            JOIN ledger_entries c ON c.txn_id = e.txn_id AND c.id <> e.id
+            WHERE e.asset_id = ? {"AND e.id < ?" if before else ""}
+            ORDER BY e.id DESC
+            LIMIT ?
+        """, [asset_id] + ([before] if before else []) + [limit + 1])
+        rows = cur.fetchall()
+        
+        as_of = request.args.get("as_of") or now_iso()
+        ledger_balance = asset_balances_as_of(cur, user_id, as_of).get(asset_id, 0)
+        response = {
+            "asset_id": asset_id,
+            "balance": asset["asset_value_cents"] / 100,
+            "as_of": as_of,
+            "ledger_balance": ledger_balance / 100,
+            "entries": [serialize_ledger_entry(r) for r in rows[:limit]],
+            "next_before": rows[limit - 1]["id"] if len(rows) > limit else None,
+        }
+        if not request.args.get("as_of"):
+            # Any difference means a balance changed outside the ledger
+            response["drift"] = (asset["asset_value_cents"] - ledger_balance) / 100
+        return jsonify(response)
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.get("/api/assets/resolve")
+@token_required
+def resolve_asset():
+    """Ranked assets matching free text (?q=my chase card), as used for expenses and payments"""
+    user_id = request.current_user_id
+    query = (request.args.get("q") or "").strip()
+    if not query:
+        return jsonify({"error": "q is required"}), 400
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        rows, scores, ambiguous = resolve_assets(user_id, query, cur, liquid_only=request.args.get("liquid_only", "true") == "true")
+        conn.commit()  # keys may have been rebuilt
+        return jsonify({
+            "query": query,
+            "ambiguous": ambiguous,
+            "candidates": [{
+                "asset_id": r["id"],
+                "asset_type": r["asset_type"],
+                "account": r["account"],
+                "asset_value": r["asset_value_cents"] / 100,
+                "is_liquid": bool(r["is_liquid"]),
+                "score": scores[r["id"]],
+            } for r in rows],
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.get("/api/assets/<int:asset_id>/aliases")
+@token_required
+def get_asset_aliases(asset_id):
+    """Aliases registered for an asset"""
+    user_id = request.current_user_id
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute("SELECT alias, created_at FROM asset_aliases WHERE user_id = ? AND asset_id = ? ORDER BY alias",
+                    (user_id, asset_id))
+        return jsonify({"asset_id": asset_id, "aliases": [dict(r) for r in cur.fetchall()]})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.post("/api/assets/<int:asset_id>/aliases")
+@token_required
+def add_asset_alias(asset_id):
+    """Register a name (e.g. "chase card") that should always resolve to this asset"""
+    user_id = request.current_user_id
+    data = request.get_json() or {}
+    alias = asset_resolver.normalize(data.get("alias"))
+    if not alias:
+        return jsonify({"error": "alias is required"}), 400
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute("SELECT id FROM assets WHERE id = ? AND user_id = ?", (asset_id, user_id))
+        if not cur.fetchone():
+            return jsonify({"error": "Asset not found"}), 404
+        cur.execute("SELECT asset_id FROM asset_aliases WHERE user_id = ? AND alias = ?", (user_id, alias))
+        existing = cur.fetchone()
+        if existing and existing["asset_id"] != asset_id:
+            return jsonify({"error": f"'{alias}' is already an alias of another asset"}), 409
+        if not existing:
+            cur.execute("INSERT INTO asset_aliases (user_id, alias, asset_id, created_at) VALUES (?, ?, ?, ?)",
+                        (user_id, alias, asset_id, now_iso()))
+            conn.commit()
+        return jsonify({"message": "Alias saved", "asset_id": asset_id, "alias": alias})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.delete("/api/assets/<int:asset_id>/aliases/<alias>")
+@token_required
+def delete_asset_alias(asset_id, alias):
+    """Remove an alias from an asset"""
+    user_id = request.current_user_id
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute("DELETE FROM asset_aliases WHERE user_id = ? AND asset_id = ? AND alias = ?",
+                    (user_id, asset_id, asset_resolver.normalize(alias)))
+        if cur.rowcount == 0:
+            return jsonify({"error": "Alias not found"}), 404
+        conn.commit()
+        return jsonify({"message": "Alias deleted"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -2017,7 +4049,7 @@ def get_liabilities():
         SELECT id, liability_type, total_amount_cents, remaining_amount_cents,
                installment_amount_cents, installments_total, installments_paid,
                frequency, due_date, next_due_date, interest_rate, priority_score,
-               is_completed, description, created_at, updated_at
+               is_completed, description, version, created_at, updated_at
         FROM liabilities WHERE user_id = ?
         ORDER BY priority_score DESC, next_due_date ASC
         """, (user_id,))
@@ -2045,6 +4077,7 @@ def get_liabilities():
                 "importance_score": row["priority_score"],  # For compatibility
                 "is_completed": bool(row["is_completed"]),
                 "description": row["description"],
+                "version": row["version"],
                 "created_at": row["created_at"],
                 "updated_at": row["updated_at"]
             }
@@ -2195,13 +4228,20 @@ def update_liability(liability_id):
         if not updates:
             return jsonify({"error": "No fields to update"}), 400
         
+        updates.append("version = version + 1")
         updates.append("updated_at = ?")
         params.append(now_iso())
         params.append(liability_id)
         params.append(user_id)
         
         sql = f"UPDATE liabilities SET {', '.join(updates)} WHERE id = ? AND user_id = ?"
+        # Optional optimistic concurrency: only apply if the client saw the latest version
+        if 'version' in data:
+            sql += " AND version = ?"
+            params.append(expected_version(data['version']))
         cur.execute(sql, params)
+        if cur.rowcount == 0:
+            return jsonify({"error": "Liability was changed by another request. Reload and try again."}), 409
         conn.commit()
         
         return jsonify({"message": "Liability updated successfully"})
@@ -2215,6 +4255,7 @@ def update_liability(liability_id):
 
 @app.post("/api/liabilities/<int:liability_id>/pay")
 @token_required
+@idempotent
 def make_liability_payment(liability_id):
     """Make a payment on a specific liability"""
     user_id = request.current_user_id
@@ -2227,7 +4268,7 @@ def make_liability_payment(liability_id):
         # First check if liability exists and belongs to user
         cur.execute("""
             SELECT id, liability_type, remaining_amount_cents, installment_amount_cents,
-                   installments_total, installments_paid, is_completed
+                   installments_total, installments_paid, is_completed, version
             FROM liabilities 
             WHERE id = ? AND user_id = ?
         """, (liability_id, user_id))
@@ -2244,208 +4285,1625 @@ def make_liability_payment(liability_id):
         payment_amount = data.get('payment_amount')  # For partial payments
         payment_account = data.get('payment_account', 'Cash')  # Asset to pay from
         
-        # Validate payment type and amount
-        remaining_amount_cents = liability["remaining_amount_cents"]
-        installment_amount_cents = liability["installment_amount_cents"]
-        
-        if payment_type == "full":
-            actual_payment_cents = remaining_amount_cents
-        elif payment_type == "installment":
-            actual_payment_cents = min(installment_amount_cents, remaining_amount_cents)
-        elif payment_type == "partial":
-            if not payment_amount:
-                return jsonify({"error": "Payment amount required for partial payment"}), 400
-            actual_payment_cents = to_cents(float(payment_amount))
-            if actual_payment_cents > remaining_amount_cents:
-                actual_payment_cents = remaining_amount_cents
-        else:
-            return jsonify({"error": "Invalid payment type"}), 400
+        # Liability update and asset debit commit together or not at all
+        payment_details = apply_liability_payment(user_id, liability, payment_type, payment_amount,
+                                                  payment_account, cur)
+        conn.commit()
         
-        # Check asset balance
-        balance_ok, result = check_asset_balance(user_id, payment_account, actual_payment_cents, cur)
-        if not balance_ok:
-            return jsonify({"error": result}), 400
+        return jsonify({
+            "message": "Payment processed successfully",
+            "payment_details": payment_details
+        })
+        
+    except ConcurrentUpdateError as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.get("/api/liabilities/types") 
+@token_required
+def get_liability_types():
+    """Get distinct liability types used by the user"""
+    user_id = request.current_user_id
+    
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute("""
+        SELECT DISTINCT liability_type 
+        FROM liabilities 
+        WHERE user_id = ? AND liability_type IS NOT NULL AND liability_type != ''
+        ORDER BY liability_type
+        """, (user_id,))
+        
+        rows = cur.fetchall()
+        liability_types = [row["liability_type"] for row in rows]
         
-        asset = result  # Asset object returned from check_asset_balance
+        # Add some common default types if user has no liabilities yet
+        if not liability_types:
+            liability_types = [
+                "Credit Card",
+                "Student Loan", 
+                "Car Loan",
+                "Mortgage",
+                "Personal Loan",
+                "Rent",
+                "Utilities",
+                "Insurance",
+                "Subscription",
+                "Other"
+            ]
+        
+        return jsonify({"liability_types": liability_types})
         
-        # Calculate new liability state
-        new_remaining_cents = remaining_amount_cents - actual_payment_cents
-        is_completed = new_remaining_cents <= 0
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+SCHEDULE_COLUMNS = """id, liability_type, remaining_amount_cents, installment_amount_cents, installments_paid,
+               frequency, next_due_date, interest_rate, is_completed"""
+
+@app.get("/api/liabilities/<int:liability_id>/schedule")
+@token_required
+def get_liability_schedule(liability_id):
+    """Amortization schedule (principal/interest split, balance, due dates) for one liability"""
+    user_id = request.current_user_id
+    
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute(f"SELECT {SCHEDULE_COLUMNS} FROM liabilities WHERE id = ? AND user_id = ?", (liability_id, user_id))
+        row = cur.fetchone()
+        if not row:
+            return jsonify({"error": "Liability not found"}), 404
         
-        # Only increment installments_paid if this is a full installment payment
-        # or if the payment amount equals or exceeds the installment amount
-        new_installments_paid = liability["installments_paid"]
-        if actual_payment_cents >= installment_amount_cents or payment_type == "installment":
-            new_installments_paid += 1
+        return jsonify(amortization.cached_schedule(dict(row)))
+        
+    except ValueError as e:
+        return jsonify({"error": f"Invalid data: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.get("/api/liabilities/schedules")
+@token_required
+def get_liability_schedules():
+    """Amortization schedules for all of the user's active liabilities"""
+    user_id = request.current_user_id
+    include_completed = request.args.get("include_completed") in ("1", "true")
+    
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute(f"""
+        SELECT {SCHEDULE_COLUMNS} FROM liabilities
+        WHERE user_id = ? {"" if include_completed else "AND is_completed = 0"}
+        ORDER BY priority_score DESC, next_due_date ASC
+        """, (user_id,))
+        
+        schedules = [amortization.cached_schedule(dict(row)) for row in cur.fetchall()]
+        return jsonify({
+            "schedules": schedules,
+            "total_interest": round(sum(s["total_interest"] for s in schedules), 2),
+            "total_payments": round(sum(s["total_payments"] for s in schedules), 2)
+        })
+        
+    except ValueError as e:
+        return jsonify({"error": f"Invalid data: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+# ------------------- Autopay API -------------------
+AUTOPAY_JOB_INTERVAL_SECONDS = int(os.getenv("AUTOPAY_JOB_INTERVAL_SECONDS", "900"))
+AUTOPAY_MAX_LEAD_DAYS = 30
+AUTOPAY_PAYMENT_TYPES = {"installment": "installment", "full": "full", "fixed": "partial"}
+
+def due_autopay_rules(cursor, today: str, user_id: Optional[str] = None) -> list:
+    """Every active rule whose liability falls due within its lead days, grouped by user"""
+    cursor.execute(f"""
+        SELECT r.id AS rule_id, r.user_id, r.amount_policy, r.fixed_amount_cents,
+               l.id, l.liability_type, l.remaining_amount_cents, l.installment_amount_cents,
+               l.installments_total, l.installments_paid, l.is_completed, l.version, l.next_due_date,
+               a.id AS asset_id, a.asset_type, a.account, a.asset_value_cents, a.is_liquid
+        FROM autopay_rules r
+        JOIN liabilities l ON l.id = r.liability_id
+        LEFT JOIN assets a ON a.id = r.asset_id AND a.user_id = r.user_id
+        WHERE r.is_active = 1 AND l.is_completed = 0
+          AND l.next_due_date <= date(?, '+' || r.lead_days || ' days')
+          AND (r.last_paid_due_date IS NULL OR r.last_paid_due_date <> l.next_due_date)
+          {"AND r.user_id = ?" if user_id else ""}
+        ORDER BY r.user_id, l.next_due_date, l.priority_score DESC
+    """, (today,) + ((user_id,) if user_id else ()))
+    return cursor.fetchall()
+
+def record_autopay_outcome(cursor, rule, status: str, error: Optional[str], amount_cents: int, attempted_at: str):
+    cursor.execute("""
+        UPDATE autopay_rules
+        SET last_status = ?, last_error = ?, last_attempt_at = ?,
+            last_paid_due_date = CASE WHEN ? = 'paid' THEN ? ELSE last_paid_due_date END
+        WHERE id = ?
+    """, (status, error, attempted_at, status, rule["next_due_date"], rule["rule_id"]))
+    cursor.execute("""
+        INSERT OR IGNORE INTO liability_events (user_id, liability_id, event_type, due_date, amount_cents, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (rule["user_id"], rule["id"], f"autopay_{status}", rule["next_due_date"], amount_cents, attempted_at))
+
+def run_autopay(conn, user_id: Optional[str] = None, today: Optional[str] = None) -> dict:
+    """
+    Pay every due autopay rule. Each user's rules run in one transaction, each rule inside a
+    savepoint, so a rule that fails (insufficient funds, concurrent change) is rolled back
+    and recorded without undoing the user's other payments.
+    """
+    cur = conn.cursor()
+    today = today or datetime.datetime.utcnow().date().isoformat()
+    summary = {"users": 0, "paid": 0, "failed": 0, "paid_amount": 0.0}
+
+    for uid, rules in itertools.groupby(due_autopay_rules(cur, today, user_id), key=lambda r: r["user_id"]):
+        summary["users"] += 1
+        balances = {}  # running balance per source asset within this user's batch
+        attempted_at = now_iso()
+        if not conn.in_transaction:
+            # Otherwise the first SAVEPOINT would open the transaction and each RELEASE would commit
+            cur.execute("BEGIN")
+        for rule in rules:
+            cur.execute("SAVEPOINT autopay_rule")
+            try:
+                if rule["asset_id"] is None or not rule["is_liquid"]:
+                    raise ValueError("Autopay source asset is missing or not liquid")
+                asset = {
+                    "id": rule["asset_id"],
+                    "asset_type": rule["asset_type"],
+                    "account": rule["account"],
+                    "asset_value_cents": balances.get(rule["asset_id"], rule["asset_value_cents"]),
+                }
+                fixed = rule["fixed_amount_cents"] / 100 if rule["fixed_amount_cents"] else None
+                # An autopay run settles the due period even when a fixed amount is below the
+                # installment; otherwise the due date never moves and the rule stops firing
+                result = apply_liability_payment(uid, rule, AUTOPAY_PAYMENT_TYPES[rule["amount_policy"]], fixed, None,
+                                                 cur, attempted_at, asset=asset, reference_type="autopay",
+                                                 settles_installment=True)
+                amount_cents = to_cents(result["payment_amount"])
+                balances[rule["asset_id"]] = to_cents(result["asset_new_balance"])
+                record_autopay_outcome(cur, rule, "paid", None, amount_cents, attempted_at)
+                cur.execute("RELEASE autopay_rule")
+                summary["paid"] += 1
+                summary["paid_amount"] += result["payment_amount"]
+            except ValueError as e:
+                cur.execute("ROLLBACK TO autopay_rule")
+                cur.execute("RELEASE autopay_rule")
+                amount_cents = rule["fixed_amount_cents"] or min(rule["installment_amount_cents"], rule["remaining_amount_cents"])
+                record_autopay_outcome(cur, rule, "failed", str(e), amount_cents, attempted_at)
+                summary["failed"] += 1
+        conn.commit()
+
+    summary["paid_amount"] = round(summary["paid_amount"], 2)
+    return summary
+
+def autopay_job(cursor) -> dict:
+    return run_autopay(cursor.connection)
+
+scheduler.register("autopay", AUTOPAY_JOB_INTERVAL_SECONDS, autopay_job)
+
+def serialize_autopay_rule(row) -> dict:
+    return {
+        "id": row["id"],
+        "liability_id": row["liability_id"],
+        "liability_type": row["liability_type"],
+        "next_due_date": row["next_due_date"],
+        "asset_id": row["asset_id"],
+        "asset_name": row["asset_type"] or row["account"],
+        "amount_policy": row["amount_policy"],
+        "fixed_amount": row["fixed_amount_cents"] / 100 if row["fixed_amount_cents"] is not None else None,
+        "lead_days": row["lead_days"],
+        "is_active": bool(row["is_active"]),
+        "last_status": row["last_status"],
+        "last_error": row["last_error"],
+        "last_attempt_at": row["last_attempt_at"],
+    }
+
+AUTOPAY_RULE_SELECT = """
+    SELECT r.*, l.liability_type, l.next_due_date, a.asset_type, a.account
+    FROM autopay_rules r
+    JOIN liabilities l ON l.id = r.liability_id
+    LEFT JOIN assets a ON a.id = r.asset_id
+"""
+
+@app.get("/api/autopay")
+@token_required
+def get_autopay_rules():
+    """List the user's autopay rules"""
+    user_id = request.current_user_id
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute(AUTOPAY_RULE_SELECT + " WHERE r.user_id = ? ORDER BY l.next_due_date", (user_id,))
+        return jsonify({"rules": [serialize_autopay_rule(r) for r in cur.fetchall()]})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.put("/api/liabilities/<int:liability_id>/autopay")
+@token_required
+def set_autopay_rule(liability_id):
+    """Create or replace the autopay rule for a liability"""
+    user_id = request.current_user_id
+    data = request.get_json() or {}
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute("SELECT id FROM liabilities WHERE id = ? AND user_id = ?", (liability_id, user_id))
+        if not cur.fetchone():
+            return jsonify({"error": "Liability not found"}), 404
         
-        # Update liability
+        cur.execute("SELECT is_liquid FROM assets WHERE id = ? AND user_id = ?", (data.get("asset_id"), user_id))
+        asset = cur.fetchone()
+        if not asset:
+            return jsonify({"error": "Source asset not found"}), 400
+        if not asset["is_liquid"]:
+            return jsonify({"error": "Autopay can only pay from a liquid asset"}), 400
+        
+        amount_policy = data.get("amount_policy", "installment")
+        if amount_policy not in AUTOPAY_PAYMENT_TYPES:
+            return jsonify({"error": f"amount_policy must be one of: {', '.join(AUTOPAY_PAYMENT_TYPES)}"}), 400
+        fixed_amount_cents = None
+        if amount_policy == "fixed":
+            fixed_amount_cents = to_cents(float(data.get("fixed_amount") or 0))
+            if fixed_amount_cents <= 0:
+                return jsonify({"error": "fixed_amount is required for the fixed amount policy"}), 400
+        lead_days = int(data.get("lead_days", 0))
+        if not 0 <= lead_days <= AUTOPAY_MAX_LEAD_DAYS:
+            return jsonify({"error": f"lead_days must be between 0 and {AUTOPAY_MAX_LEAD_DAYS}"}), 400
+        
+        now = now_iso()
         cur.execute("""
-            UPDATE liabilities 
-            SET remaining_amount_cents = ?, 
-                installments_paid = ?,
-                is_completed = ?,
-                updated_at = ?
-            WHERE id = ?
-        """, (max(0, new_remaining_cents), new_installments_paid, is_completed, now_iso(), liability_id))
+            INSERT INTO autopay_rules (user_id, liability_id, asset_id, amount_policy, fixed_amount_cents,
+                                       lead_days, is_active, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (liability_id) DO UPDATE
+            SET asset_id = excluded.asset_id, amount_policy = excluded.amount_policy,
+                fixed_amount_cents = excluded.fixed_amount_cents, lead_days = excluded.lead_days,
+                is_active = excluded.is_active, updated_at = excluded.updated_at
+        """, (user_id, liability_id, data["asset_id"], amount_policy, fixed_amount_cents, lead_days,
+              bool(data.get("is_active", True)), now, now))
+        conn.commit()
         
-        # Deduct from asset
-        deduct_from_asset(asset["id"], actual_payment_cents, cur)
+        cur.execute(AUTOPAY_RULE_SELECT + " WHERE r.liability_id = ?", (liability_id,))
+        return jsonify({"message": "Autopay rule saved", "rule": serialize_autopay_rule(cur.fetchone())})
+    
+    except ValueError as e:
+        return jsonify({"error": f"Invalid data: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.delete("/api/liabilities/<int:liability_id>/autopay")
+@token_required
+def delete_autopay_rule(liability_id):
+    """Remove the autopay rule for a liability"""
+    user_id = request.current_user_id
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        cur.execute("DELETE FROM autopay_rules WHERE liability_id = ? AND user_id = ?", (liability_id, user_id))
+        if cur.rowcount == 0:
+            return jsonify({"error": "Autopay rule not found"}), 404
         conn.commit()
+        return jsonify({"message": "Autopay rule deleted"})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.post("/api/autopay/run")
+@token_required
+def run_autopay_now():
+    """Run the user's due autopay rules immediately"""
+    conn = get_conn()
+    try:
+        return jsonify(run_autopay(conn, request.current_user_id))
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+# ------------------- Recommendations API -------------------
+@app.get("/api/liabilities/events")
+@token_required
+def get_liability_events():
+    """Due-soon and overdue events produced by the due-date job, newest first"""
+    user_id = request.current_user_id
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        limit = page_limit(request.args)
+        clauses, params = ["e.user_id = ?"], [user_id]
+        if request.args.get("before"):
+            clauses.append("e.id < ?")
+            params.append(int(request.args["before"]))
+        if request.args.get("unacknowledged") == "true":
+            clauses.append("e.acknowledged_at IS NULL")
+        cur.execute(f"""
+            SELECT e.*, l.liability_type
+            FROM liability_events e JOIN liabilities l ON l.id = e.liability_id
+            WHERE {" AND ".join(clauses)}
+            ORDER BY e.id DESC
+            LIMIT ?
+        """, params + [limit + 1])
+        rows = cur.fetchall()
+        return jsonify({
+            "events": [serialize_liability_event(r) for r in rows[:limit]],
+            "next_before": rows[limit - 1]["id"] if len(rows) > limit else None,
+        })
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.post("/api/liabilities/events/ack")
+@token_required
+def acknowledge_liability_events():
+    """Mark events as read; body {"ids": [...]} or {"all": true}"""
+    user_id = request.current_user_id
+    data = request.get_json() or {}
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        if data.get("all"):
+            cur.execute("UPDATE liability_events SET acknowledged_at = ? WHERE user_id = ? AND acknowledged_at IS NULL",
+                        (now_iso(), user_id))
+        else:
+            ids = [int(i) for i in data.get("ids") or []]
+            if not ids:
+                return jsonify({"error": "ids or all is required"}), 400
+            cur.execute(f"""
+                UPDATE liability_events SET acknowledged_at = ?
+                WHERE user_id = ? AND acknowledged_at IS NULL AND id IN ({",".join("?" * len(ids))})
+            """, [now_iso(), user_id] + ids)
+        acknowledged = cur.rowcount
+        conn.commit()
+        return jsonify({"acknowledged": acknowledged})
+    
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid ids: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.get("/api/recommendations")
+@token_required
+def get_recommendations():
+    """Get financial recommendations based on user's liabilities and assets"""
+    user_id = request.current_user_id
+    
+    try:
+        budget_override = request.args.get("budget")
+        budget_override = float(budget_override) if budget_override is not None else None
+        if budget_override is not None and not (math.isfinite(budget_override) and budget_override >= 0):
+            raise ValueError("budget must be a finite amount of 0 or more")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {str(e)}"}), 400
+    
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        # Get user information
+        cur.execute("SELECT monthly_income_cents, currency_preference FROM users WHERE id = ?", (user_id,))
+        user_row = cur.fetchone()
+        
+        if not user_row:
+            return jsonify({"error": "User not found"}), 404
         
+        monthly_income = (user_row["monthly_income_cents"] or 0) / 100
+        
+        # Get user's liquid assets total
+        cur.execute("SELECT SUM(asset_value_cents) as total FROM assets WHERE user_id = ? AND is_liquid = 1", (user_id,))
+        assets_result = cur.fetchone()
+        total_liquid_assets = (assets_result["total"] / 100) if assets_result["total"] else 0
+        
+        # Get active liabilities with priority calculation
+        cur.execute("""
+        SELECT id, liability_type, total_amount_cents, remaining_amount_cents,
+               installment_amount_cents, installments_total, installments_paid,
+               frequency, next_due_date, interest_rate, priority_score, description
+        FROM liabilities 
+        WHERE user_id = ? AND is_completed = 0 
+        ORDER BY priority_score DESC, next_due_date ASC
+        """, (user_id,))
+        
+        liabilities = cur.fetchall()
+        
+        # Calculate available budget (70% of income)
+        available_budget = monthly_income * 0.7
+        
+        # Simulate payoff strategies over all active debts; ?budget= overrides the 70% default
+        payoff_budget = available_budget if budget_override is None else budget_override
+        payoff_plan = payoff_planner.plan_payoff([dict(l) for l in liabilities], to_cents(payoff_budget))
+        optimal_allocation = {}
+        if payoff_plan["recommended_strategy"]:
+            best = payoff_plan["strategies"][payoff_plan["recommended_strategy"]]
+            optimal_allocation = {a["liability_id"]: a["amount"] for a in best["current_month_allocation"]}
+        
+        # Generate recommendations
+        recommendations = []
+        remaining_budget = available_budget
+        
+        for liability in liabilities:
+            installment = liability["installment_amount_cents"] / 100
+            priority_score = liability["priority_score"]
+            remaining_amount = liability["remaining_amount_cents"] / 100
+            
+            # Determine urgency based on priority score and due date
+            urgency = "High" if priority_score >= 80 else "Medium" if priority_score >= 60 else "Low"
+            
+            # Determine recommended action based on budget and priority
+            if remaining_budget >= installment:
+                recommended_action = "Pay this month"
+                remaining_budget -= installment
+            elif priority_score >= 80:
+                recommended_action = "High priority - consider partial payment or reallocation"
+            else:
+                recommended_action = "Defer to next month or consider minimum payment"
+            
+            recommendation = {
+                "liability": {
+                    "id": liability["id"],
+                    "liability_type": liability["liability_type"],
+                    "remaining_amount": remaining_amount,
+                    "installment_amount": installment,
+                    "installments_total": liability["installments_total"],
+                    "installments_paid": liability["installments_paid"],
+                    "next_due_date": liability["next_due_date"],
+                    "description": liability["description"] or f"{liability['liability_type']} payment"
+                },
+                "priority_score": priority_score,
+                "recommended_action": recommended_action,
+                "amount": installment,
+                "optimal_payment": optimal_allocation.get(liability["id"], 0.0),
+                "interest_rate": liability["interest_rate"],
+                "urgency": urgency
+            }
+            recommendations.append(recommendation)
+        
+        # Calculate budget utilization
+        total_recommended_payments = sum(r["amount"] for r in recommendations if r["recommended_action"] == "Pay this month")
+        
+        return jsonify({
+            "total_income": monthly_income,
+            "available_budget": available_budget,
+            "remaining_budget": max(0, remaining_budget),
+            "total_liquid_assets": total_liquid_assets,
+            "recommendations": recommendations,
+            "budget_utilization": (total_recommended_payments / available_budget * 100) if available_budget > 0 else 0,
+            "payoff_plan": payoff_plan
+        })
+        
+    except ValueError as e:
+        return jsonify({"error": f"Invalid data: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+# ------------------- Expenses & Trades API -------------------
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 200
+SUMMARY_PERIOD_FORMATS = {
+    "day": "%Y-%m-%d",
+    "week": "%Y-W%W",
+    "month": "%Y-%m",
+    "year": "%Y",
+}
+
+def encode_cursor(occurred_at: str, row_id: int) -> str:
+    """Opaque keyset cursor for (occurred_at, id) pagination"""
+    return base64.urlsafe_b64encode(f"{occurred_at}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        occurred_at, _, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rpartition("|")
+        return occurred_at, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+def page_limit(args) -> int:
+    return max(1, min(PAGE_SIZE_MAX, int(args.get("limit", PAGE_SIZE_DEFAULT))))
+
+def date_range_filters(args, column: str = "occurred_at"):
+    """Translate ?from=YYYY-MM-DD&to=YYYY-MM-DD into an index-friendly half-open range"""
+    clauses, params = [], []
+    if args.get("from"):
+        clauses.append(f"{column} >= ?")
+        params.append(datetime.date.fromisoformat(args["from"]).isoformat())
+    if args.get("to"):
+        # occurred_at may be a date or a timestamp, so compare against the start of the next day
+        clauses.append(f"{column} < ?")
+        params.append((datetime.date.fromisoformat(args["to"]) + datetime.timedelta(days=1)).isoformat())
+    return clauses, params
+
+def expense_filters(user_id: str, args):
+    clauses, params = ["user_id = ?"], [user_id]
+    range_clauses, range_params = date_range_filters(args)
+    clauses += range_clauses
+    params += range_params
+    if args.get("category"):
+        clauses.append("category = ? COLLATE NOCASE")
+        params.append(args["category"])
+    if args.get("merchant"):
+        clauses.append("merchant LIKE ?")
+        params.append(f"%{args['merchant']}%")
+    if args.get("merchant_id"):
+        clauses.append("merchant_id = ?")
+        params.append(int(args["merchant_id"]))
+    return clauses, params
+
+def keyset_page(cur, sql: str, clauses: list, params: list, args, serialize):
+    """Run a newest-first (occurred_at, id) keyset query and build the page payload"""
+    limit = page_limit(args)
+    if args.get("cursor"):
+        occurred_at, row_id = decode_cursor(args["cursor"])
+        clauses = clauses + ["(occurred_at, id) < (?, ?)"]
+        params = params + [occurred_at, row_id]
+    cur.execute(f"{sql} WHERE {' AND '.join(clauses)} ORDER BY occurred_at DESC, id DESC LIMIT ?",
+                params + [limit + 1])
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1]["occurred_at"], rows[-1]["id"]) if has_more else None
+    return [serialize(r) for r in rows], next_cursor
+
+def serialize_expense(row) -> dict:
+    return {
+        "id": row["id"],
+        "occurred_at": row["occurred_at"],
+        "amount": row["amount_cents"] / 100,
+        "currency": row["currency"],
+        "merchant": row["merchant"],
+        "merchant_id": row["merchant_id"],
+        "category": row["category"],
+        "category_source": row["category_source"],
+        "account": row["account"],
+        "note": row["note"],
+        "created_at": row["created_at"]
+    }
+
+def serialize_trade(row) -> dict:
+    return {
+        "id": row["id"],
+        "occurred_at": row["occurred_at"],
+        "action": row["action"],
+        "symbol": row["symbol"],
+        "shares": row["shares"],
+        "price_per_share": row["price_per_share_cents"] / 100,
+        "total": round(row["shares"] * row["price_per_share_cents"]) / 100,
+        "currency": row["currency"],
+        "account": row["account"],
+        "fees": (row["fees_cents"] or 0) / 100,
+        "note": row["note"],
+        "created_at": row["created_at"]
+    }
+
+@app.get("/api/expenses")
+@token_required
+def get_expenses():
+    """List expenses newest first with keyset pagination and filters"""
+    user_id = request.current_user_id
+
+    conn = get_conn()
+    cur = conn.cursor()
+
+    try:
+        clauses, params = expense_filters(user_id, request.args)
+        expenses, next_cursor = keyset_page(cur, """
+            SELECT id, occurred_at, amount_cents, currency, merchant, merchant_id, category, category_source,
+                   account, note, created_at
+            FROM expenses
+        """, clauses, params, request.args, serialize_expense)
+
+        return jsonify({"expenses": expenses, "next_cursor": next_cursor})
+
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+EXPENSE_ALERT_SELECT = """
+    SELECT a.*, r.occurred_at AS related_occurred_at
+    FROM expense_alerts a LEFT JOIN expenses r ON r.id = a.related_expense_id
+"""
+
+def serialize_expense_alert(row) -> dict:
+    variance = row["baseline_variance"]
+    return {
+        "id": row["id"],
+        "expense_id": row["expense_id"],
+        "alert_type": row["alert_type"],
+        "category": row["category"],
+        "amount": row["amount_cents"] / 100,
+        "baseline_mean": round(row["baseline_mean_cents"] / 100, 2) if row["baseline_mean_cents"] is not None else None,
+        "baseline_stddev": round(variance ** 0.5 / 100, 2) if variance is not None else None,
+        "related_expense_id": row["related_expense_id"],
+        "related_occurred_at": row["related_occurred_at"],
+        "created_at": row["created_at"],
+        "acknowledged_at": row["acknowledged_at"]
+    }
+
+def expense_alert_message(alert: dict) -> str:
+    if alert["alert_type"] == "unusual_amount":
+        return (f"⚠️ That is well above your usual {alert['category'] or 'uncategorized'} expense "
+                f"(about ${alert['baseline_mean']:.2f}).")
+    return f"⚠️ This looks like a possible duplicate of an expense on {alert['related_occurred_at']}."
+
+@app.get("/api/alerts")
+@token_required
+def get_expense_alerts():
+    """Unusual-amount and possible-duplicate alerts raised on new expenses, newest first"""
+    user_id = request.current_user_id
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        limit = page_limit(request.args)
+        clauses, params = ["a.user_id = ?"], [user_id]
+        if request.args.get("before"):
+            clauses.append("a.id < ?")
+            params.append(int(request.args["before"]))
+        if request.args.get("unacknowledged") == "true":
+            clauses.append("a.acknowledged_at IS NULL")
+        if request.args.get("type"):
+            clauses.append("a.alert_type = ?")
+            params.append(request.args["type"])
+        cur.execute(f"""
+            {EXPENSE_ALERT_SELECT}
+            WHERE {" AND ".join(clauses)}
+            ORDER BY a.id DESC
+            LIMIT ?
+        """, params + [limit + 1])
+        rows = cur.fetchall()
+        return jsonify({
+            "alerts": [serialize_expense_alert(r) for r in rows[:limit]],
+            "next_before": rows[limit - 1]["id"] if len(rows) > limit else None,
+        })
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.post("/api/alerts/ack")
+@token_required
+def acknowledge_expense_alerts():
+    """Mark alerts as read; body {"ids": [...]} or {"all": true}"""
+    user_id = request.current_user_id
+    data = request.get_json() or {}
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        if data.get("all"):
+            cur.execute("UPDATE expense_alerts SET acknowledged_at = ? WHERE user_id = ? AND acknowledged_at IS NULL",
+                        (now_iso(), user_id))
+        else:
+            ids = [int(i) for i in data.get("ids") or []]
+            if not ids:
+                return jsonify({"error": "ids or all is required"}), 400
+            cur.execute(f"""
+                UPDATE expense_alerts SET acknowledged_at = ?
+                WHERE user_id = ? AND acknowledged_at IS NULL AND id IN ({",".join("?" * len(ids))})
+            """, [now_iso(), user_id] + ids)
+        acknowledged = cur.rowcount
+        conn.commit()
+        return jsonify({"acknowledged": acknowledged})
+    
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid ids: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.get("/api/expenses/merchants")
+@token_required
+def get_merchant_totals():
+    """Spending per canonical merchant, largest first"""
+    user_id = request.current_user_id
+    
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        clauses, params = date_range_filters(request.args)
+        where = " AND ".join(["e.user_id = ?", "e.merchant_id IS NOT NULL"] + [f"e.{c}" for c in clauses])
+        # merchants.name is whoever spelled the merchant first; show this user's latest
+        # spelling instead (a bare column next to MAX() comes from the row holding the max)
+        cur.execute(f"""
+            SELECT e.merchant_id, e.merchant AS name, SUM(e.amount_cents) AS total_cents, COUNT(*) AS count,
+                   MAX(e.occurred_at) AS last_occurred_at
+            FROM expenses e
+            WHERE {where}
+            GROUP BY e.merchant_id
+            ORDER BY total_cents DESC
+            LIMIT ?
+        """, [user_id] + params + [page_limit(request.args)])
+        merchant_totals = [{
+            "merchant_id": r["merchant_id"],
+            "merchant": merchants.display_name(r["name"]) or r["name"],
+            "total": r["total_cents"] / 100,
+            "count": r["count"],
+            "last_occurred_at": r["last_occurred_at"]
+        } for r in cur.fetchall()]
+        
+        return jsonify({"merchants": merchant_totals})
+    
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.post("/api/expenses/recategorize")
+@token_required
+def recategorize_user_expenses():
+    """Assign model categories to the user's uncategorized (or model-categorized) expenses"""
+    user_id = request.current_user_id
+    
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        stats = recategorize_expenses(cur, user_id)
+        conn.commit()
+        return jsonify({"message": "Expenses recategorized", **stats})
+    
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.get("/api/expenses/summary")
+@token_required
+def get_expenses_summary():
+    """Per-category and per-period expense rollups computed in SQL"""
+    user_id = request.current_user_id
+    period = request.args.get("period", "month")
+    if period not in SUMMARY_PERIOD_FORMATS:
+        return jsonify({"error": f"period must be one of: {', '.join(SUMMARY_PERIOD_FORMATS)}"}), 400
+    period_expr = f"strftime('{SUMMARY_PERIOD_FORMATS[period]}', substr(occurred_at, 1, 10))"
+
+    conn = get_conn()
+    cur = conn.cursor()
+
+    try:
+        clauses, params = expense_filters(user_id, request.args)
+        where = " AND ".join(clauses)
+
+        cur.execute(f"""
+            SELECT COALESCE(category, 'Uncategorized') AS category,
+                   SUM(amount_cents) AS total_cents, COUNT(*) AS count
+            FROM expenses WHERE {where}
+            GROUP BY 1 ORDER BY total_cents DESC
+        """, params)
+        by_category = [{"category": r["category"], "total": r["total_cents"] / 100, "count": r["count"]}
+                       for r in cur.fetchall()]
+
+        cur.execute(f"""
+            SELECT {period_expr} AS period, SUM(amount_cents) AS total_cents, COUNT(*) AS count
+            FROM expenses WHERE {where}
+            GROUP BY 1 ORDER BY 1
+        """, params)
+        by_period = [{"period": r["period"], "total": r["total_cents"] / 100, "count": r["count"]}
+                     for r in cur.fetchall()]
+
+        breakdown = None
+        if request.args.get("breakdown") in ("1", "true"):
+            cur.execute(f"""
+                SELECT {period_expr} AS period, COALESCE(category, 'Uncategorized') AS category,
+                       SUM(amount_cents) AS total_cents, COUNT(*) AS count
+                FROM expenses WHERE {where}
+                GROUP BY 1, 2 ORDER BY 1, total_cents DESC
+            """, params)
+            breakdown = [{"period": r["period"], "category": r["category"],
+                          "total": r["total_cents"] / 100, "count": r["count"]} for r in cur.fetchall()]
+
+        return jsonify({
+            "period": period,
+            "total": sum(c["total"] for c in by_category),
+            "count": sum(c["count"] for c in by_category),
+            "by_category": by_category,
+            "by_period": by_period,
+            "breakdown": breakdown
+        })
+
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.get("/api/trades")
+@token_required
+def get_trades():
+    """List trades newest first with keyset pagination and filters"""
+    user_id = request.current_user_id
+
+    conn = get_conn()
+    cur = conn.cursor()
+
+    try:
+        clauses, params = ["user_id = ?"], [user_id]
+        range_clauses, range_params = date_range_filters(request.args)
+        clauses += range_clauses
+        params += range_params
+        if request.args.get("symbol"):
+            clauses.append("symbol = ?")
+            params.append(request.args["symbol"].upper())
+        if request.args.get("action"):
+            clauses.append("action = ?")
+            params.append(request.args["action"].lower())
+
+        trades, next_cursor = keyset_page(cur, """
+            SELECT id, occurred_at, action, symbol, shares, price_per_share_cents, currency,
+                   account, fees_cents, note, created_at
+            FROM trades
+        """, clauses, params, request.args, serialize_trade)
+
+        return jsonify({"trades": trades, "next_cursor": next_cursor})
+
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+# ------------------- Search API -------------------
+# Type code stored in search_fts.rowid % 4, and a boost applied to the bm25 score
+SEARCH_TYPES = {
+    "message": (1, 0.8),
+    "expense": (2, 1.0),
+    "liability": (3, 1.0),
+}
+SEARCH_TYPE_NAMES = {code: name for name, (code, _) in SEARCH_TYPES.items()}
+SEARCH_MAX_TERMS = 16
+SEARCH_HIGHLIGHT = ("<mark>", "</mark>")
+
+SEARCH_SNIPPET_WORDS = 16
+
+def search_words(text: Optional[str]) -> List[str]:
+    words = re.findall(r"\w+", (text or "").lower())[:SEARCH_MAX_TERMS]
+    if not words:
+        raise ValueError("q must contain at least one word")
+    return words
+
+def fts_query(owner: str, words: List[str]) -> str:
+    """
+    FTS5 MATCH expression: every word must appear in the title or body and the last one
+    may be a prefix, so "plumb" finds "plumber". Words are quoted, so operators and
+    punctuation in user input are never parsed as query syntax.
+    """
+    terms = " ".join(f'"{w}"' for w in words) + "*"
+    return f'owner : "{owner}" AND {{title body}} : ({terms})'
+
+def highlight_words(text: Optional[str], words: List[str], size: Optional[int] = None) -> Optional[str]:
+    """
+    Wrap query words in SEARCH_HIGHLIGHT markers, optionally cutting a window of `size`
+    words around the first hit. Done in Python on the fetched page because FTS5's
+    snippet() re-runs the whole MATCH for every row it is asked about.
+    """
+    if not text:
+        return text
+    start, end = SEARCH_HIGHLIGHT
+    exact, prefix = set(words[:-1]), words[-1]
+    spans = list(re.finditer(r"\w+", text))
+    hits = [i for i, m in enumerate(spans) if m.group().lower() in exact or m.group().lower().startswith(prefix)]
+    first, last = 0, len(spans)
+    if size and len(spans) > size:
+        first = max(0, min((hits[0] if hits else 0) - size // 4, len(spans) - size))
+        last = first + size
+    out, pos = [], spans[first].start() if first else 0
+    for i in hits:
+        if first <= i < last:
+            out += [text[pos:spans[i].start()], start, spans[i].group(), end]
+            pos = spans[i].end()
+    out.append(text[pos:spans[last - 1].end()] if last < len(spans) else text[pos:])
+    return ("…" if first else "") + "".join(out) + ("…" if last < len(spans) else "")
+
+def search_details(cur, user_id: str, ids_by_type: dict) -> dict:
+    """Source rows for a page of hits, keyed by (type, id)"""
+    details = {}
+    if ids_by_type.get("message"):
+        ids = ids_by_type["message"]
+        cur.execute(f"""
+            SELECT m.id, m.session_id, m.role FROM messages m JOIN sessions s ON s.id = m.session_id
+            WHERE m.id IN ({",".join("?" * len(ids))}) AND s.user_id = ?
+        """, ids + [user_id])
+        for r in cur.fetchall():
+            details[("message", r["id"])] = {"session_id": r["session_id"], "role": r["role"]}
+    if ids_by_type.get("expense"):
+        ids = ids_by_type["expense"]
+        cur.execute(f"""
+            SELECT id, amount_cents, currency, category FROM expenses
+            WHERE id IN ({",".join("?" * len(ids))}) AND user_id = ?
+        """, ids + [user_id])
+        for r in cur.fetchall():
+            details[("expense", r["id"])] = {"amount": r["amount_cents"] / 100, "currency": r["currency"],
+                                              "category": r["category"]}
+    if ids_by_type.get("liability"):
+        ids = ids_by_type["liability"]
+        cur.execute(f"""
+            SELECT id, remaining_amount_cents, is_completed FROM liabilities
+            WHERE id IN ({",".join("?" * len(ids))}) AND user_id = ?
+        """, ids + [user_id])
+        for r in cur.fetchall():
+            details[("liability", r["id"])] = {"remaining_amount": r["remaining_amount_cents"] / 100,
+                                                "is_completed": bool(r["is_completed"])}
+    return details
+
+@app.get("/api/search")
+@token_required
+def search():
+    """Full-text search over the user's chat messages, expenses and liabilities"""
+    user_id = request.current_user_id
+    
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        words = search_words(request.args.get("q"))
+        match = fts_query(user_id.replace("-", ""), words)
+        types = [t.strip() for t in request.args.get("types", "").split(",") if t.strip()] or list(SEARCH_TYPES)
+        unknown = [t for t in types if t not in SEARCH_TYPES]
+        if unknown:
+            raise ValueError(f"Unknown types: {', '.join(unknown)}")
+        limit = page_limit(request.args)
+        
+        # bm25 is negative (lower is better), so a boost above 1.0 ranks a type higher
+        boost = " ".join(f"WHEN {code} THEN {weight}" for code, weight in SEARCH_TYPES.values())
+        clauses, params = [f"rowid % 4 IN ({','.join(str(SEARCH_TYPES[t][0]) for t in types)})"], []
+        if request.args.get("cursor"):
+            score, row_id = decode_cursor(request.args["cursor"])
+            clauses.append("(score, rowid) > (?, ?)")
+            params += [float(score), row_id]
+        
+        cur.execute(f"""
+            SELECT * FROM (
+                SELECT rowid, bm25(search_fts, 0.0, 4.0, 1.0) * (CASE rowid % 4 {boost} END) AS score
+                FROM search_fts
+                WHERE search_fts MATCH ?
+            )
+            WHERE {' AND '.join(clauses)}
+            ORDER BY score, rowid
+            LIMIT ?
+        """, [match] + params + [limit + 1])
+        rows = cur.fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        snippets = {}
+        if rows:
+            cur.execute(f"SELECT rowid, title, body, created_at FROM search_fts WHERE rowid IN ({','.join('?' * len(rows))})",
+                        [r["rowid"] for r in rows])
+            snippets = {r["rowid"]: r for r in cur.fetchall()}
+        
+        ids_by_type = {}
+        for r in rows:
+            ids_by_type.setdefault(SEARCH_TYPE_NAMES[r["rowid"] % 4], []).append(r["rowid"] // 4)
+        details = search_details(cur, user_id, ids_by_type)
+        
+        results = []
+        for r in rows:
+            key = (SEARCH_TYPE_NAMES[r["rowid"] % 4], r["rowid"] // 4)
+            if key not in details or r["rowid"] not in snippets:
+                continue
+            doc = snippets[r["rowid"]]
+            results.append({
+                "type": key[0],
+                "id": key[1],
+                "title": highlight_words(doc["title"], words),
+                "snippet": highlight_words(doc["body"], words, SEARCH_SNIPPET_WORDS),
+                "score": round(-r["score"], 4),
+                "date": doc["created_at"],
+                **details[key]
+            })
+        next_cursor = encode_cursor(repr(rows[-1]["score"]), rows[-1]["rowid"]) if has_more else None
+        
+        return jsonify({"results": results, "next_cursor": next_cursor})
+    
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+# ------------------- Reports API -------------------
+def month_sequence(end_month: str, count: int) -> List[str]:
+    """The `count` YYYY-MM months ending at end_month, oldest first"""
+    year, month = int(end_month[:4]), int(end_month[5:7])
+    months = []
+    for _ in range(count):
+        months.append(f"{year:04d}-{month:02d}")
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return months[::-1]
+
+@app.get("/api/reports/month-over-month")
+@token_required
+def get_month_over_month_report():
+    """Monthly spending and income with change vs the previous month, read from rollups"""
+    user_id = request.current_user_id
+
+    try:
+        months_count = max(1, min(120, int(request.args.get("months", 6))))
+        end_month = request.args.get("to") or datetime.date.today().isoformat()[:7]
+        datetime.datetime.strptime(end_month, "%Y-%m")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {str(e)}"}), 400
+
+    # One extra month so the first reported month has a comparison
+    months = month_sequence(end_month, months_count + 1)
+
+    conn = get_conn()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("""
+            SELECT year_month, category, total_cents, txn_count FROM expense_rollups_monthly
+            WHERE user_id = ? AND year_month BETWEEN ? AND ? AND txn_count > 0
+        """, (user_id, months[0], months[-1]))
+        spending = {m: {"total_cents": 0, "count": 0, "categories": {}} for m in months}
+        for r in cur.fetchall():
+            bucket = spending.get(r["year_month"])
+            if bucket is None:
+                continue  # e.g. "2026-5-" from a date that is not zero-padded sorts inside the range
+            bucket["total_cents"] += r["total_cents"]
+            bucket["count"] += r["txn_count"]
+            bucket["categories"][r["category"] or "Uncategorized"] = r["total_cents"] / 100
+
+        cur.execute("""
+            SELECT year_month, SUM(total_cents) AS total_cents FROM income_rollups_monthly
+            WHERE user_id = ? AND year_month BETWEEN ? AND ?
+            GROUP BY year_month
+        """, (user_id, months[0], months[-1]))
+        income = {r["year_month"]: r["total_cents"] for r in cur.fetchall()}
+
+        report = []
+        for previous, month in zip(months, months[1:]):
+            spent = spending[month]["total_cents"]
+            prev_spent = spending[previous]["total_cents"]
+            report.append({
+                "month": month,
+                "spending": spent / 100,
+                "income": income.get(month, 0) / 100,
+                "net": (income.get(month, 0) - spent) / 100,
+                "transactions": spending[month]["count"],
+                "spending_change": (spent - prev_spent) / 100,
+                "spending_change_pct": round((spent - prev_spent) / prev_spent * 100, 2) if prev_spent else None,
+                "by_category": spending[month]["categories"]
+            })
+
+        return jsonify({"months": report})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.get("/api/reports/year-to-date")
+@token_required
+def get_year_to_date_report():
+    """Year-to-date spending by category and income by type, compared with the same period last year"""
+    user_id = request.current_user_id
+    today = datetime.date.today()
+
+    try:
+        year = int(request.args.get("year", today.year))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {str(e)}"}), 400
+    last_month = today.isoformat()[5:7] if year == today.year else "12"
+
+    conn = get_conn()
+    cur = conn.cursor()
+
+    try:
+        def totals(rollup: str, key: str, y: int) -> dict:
+            cur.execute(f"""
+                SELECT {key} AS name, SUM(total_cents) AS total_cents FROM {rollup}
+                WHERE user_id = ? AND year_month BETWEEN ? AND ?
+                GROUP BY {key} HAVING SUM(txn_count) > 0
+                ORDER BY total_cents DESC
+            """, (user_id, f"{y:04d}-01", f"{y:04d}-{last_month}"))
+            return {(r["name"] or "Uncategorized"): r["total_cents"] / 100 for r in cur.fetchall()}
+
+        spending = totals("expense_rollups_monthly", "category", year)
+        previous_spending = totals("expense_rollups_monthly", "category", year - 1)
+        income = totals("income_rollups_monthly", "income_type", year)
+        previous_income = totals("income_rollups_monthly", "income_type", year - 1)
+
         return jsonify({
-            "message": "Payment processed successfully",
-            "payment_details": {
-                "liability_id": liability_id,
-                "liability_type": liability["liability_type"],
-                "payment_amount": actual_payment_cents / 100,
-                "remaining_amount": max(0, new_remaining_cents) / 100,
-                "asset_name": asset["asset_type"] or asset["account"],
-                "asset_new_balance": (asset["asset_value_cents"] - actual_payment_cents) / 100,
-                "is_completed": is_completed,
-                "payment_type": payment_type
+            "year": year,
+            "through_month": f"{year:04d}-{last_month}",
+            "total_spending": sum(spending.values()),
+            "total_income": sum(income.values()),
+            "spending_by_category": spending,
+            "income_by_type": income,
+            "previous_year": {
+                "total_spending": sum(previous_spending.values()),
+                "total_income": sum(previous_income.values()),
+                "spending_by_category": previous_spending,
+                "income_by_type": previous_income
             }
         })
-        
-    except ValueError as e:
-        return jsonify({"error": str(e)}), 400
+
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
         conn.close()
 
-@app.get("/api/liabilities/types") 
+# ------------------- Net Worth History API -------------------
+NETWORTH_RESOLUTIONS = ("day", "week", "month")
+
+def networth_bucket_sql(resolution: str) -> str:
+    """SQL expression grouping networth_daily.day into day/week (Monday start)/month buckets"""
+    if resolution == "week":
+        return "date(day, '-6 days', 'weekday 1')"
+    if resolution == "month":
+        return "substr(day, 1, 7)"
+    return "day"
+
+@app.get("/api/networth/history")
 @token_required
-def get_liability_types():
-    """Get distinct liability types used by the user"""
+def get_networth_history():
+    """Net-worth time series downsampled to day/week/month buckets (last value in each bucket)"""
     user_id = request.current_user_id
-    
     conn = get_conn()
     cur = conn.cursor()
-    
+
     try:
+        to_date = datetime.date.fromisoformat(request.args["to"]) if request.args.get("to") else datetime.datetime.utcnow().date()
+        from_date = (datetime.date.fromisoformat(request.args["from"]) if request.args.get("from")
+                     else to_date - datetime.timedelta(days=365))
+        if from_date > to_date:
+            return jsonify({"error": "from must be on or before to"}), 400
+        resolution = request.args.get("resolution")
+        if not resolution:
+            # Keep the payload around a few hundred points at most
+            span = (to_date - from_date).days
+            resolution = "day" if span <= 92 else "week" if span <= 731 else "month"
+        if resolution not in NETWORTH_RESOLUTIONS:
+            return jsonify({"error": f"resolution must be one of: {', '.join(NETWORTH_RESOLUTIONS)}"}), 400
+
+        # SQLite returns the bare columns from the row holding MAX(day), i.e. each bucket's closing values
+        cur.execute(f"""
+            SELECT {networth_bucket_sql(resolution)} AS period, MAX(day) AS day,
+                   assets_cents, liabilities_cents, liquid_assets_cents, net_worth_cents
+            FROM networth_daily
+            WHERE user_id = ? AND day >= ? AND day <= ?
+            GROUP BY period
+            ORDER BY period
+        """, (user_id, from_date.isoformat(), to_date.isoformat()))
+        points = [{
+            "period": row["period"],
+            "date": row["day"],
+            "total_assets": row["assets_cents"] / 100,
+            "total_liabilities": row["liabilities_cents"] / 100,
+            "liquid_assets": row["liquid_assets_cents"] / 100,
+            "net_worth": row["net_worth_cents"] / 100,
+        } for row in cur.fetchall()]
+
+        # Value carried into the range, so charts can start at `from` even on a quiet first day
         cur.execute("""
-        SELECT DISTINCT liability_type 
-        FROM liabilities 
-        WHERE user_id = ? AND liability_type IS NOT NULL AND liability_type != ''
-        ORDER BY liability_type
-        """, (user_id,))
-        
-        rows = cur.fetchall()
-        liability_types = [row["liability_type"] for row in rows]
-        
-        # Add some common default types if user has no liabilities yet
-        if not liability_types:
-            liability_types = [
-                "Credit Card",
-                "Student Loan", 
-                "Car Loan",
-                "Mortgage",
-                "Personal Loan",
-                "Rent",
-                "Utilities",
-                "Insurance",
-                "Subscription",
-                "Other"
-            ]
-        
-        return jsonify({"liability_types": liability_types})
-        
+            SELECT day, net_worth_cents FROM networth_daily
+            WHERE user_id = ? AND day < ?
+            ORDER BY day DESC LIMIT 1
+        """, (user_id, from_date.isoformat()))
+        previous = cur.fetchone()
+
+        return jsonify({
+            "from": from_date.isoformat(),
+            "to": to_date.isoformat(),
+            "resolution": resolution,
+            "starting_net_worth": previous["net_worth_cents"] / 100 if previous else None,
+            "points": points,
+        })
+
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {str(e)}"}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
         conn.close()
 
-# ------------------- Recommendations API -------------------
-@app.get("/api/recommendations")
+# ------------------- Forecast API -------------------
+def load_forecast_inputs(user_id: str, cursor) -> dict:
+    """Collect the balances, recurring income, installments and spending history a forecast needs"""
+    cursor.execute("SELECT monthly_income_cents FROM users WHERE id = ?", (user_id,))
+    user_row = cursor.fetchone()
+    monthly_income_cents = (user_row["monthly_income_cents"] or 0) if user_row else 0
+    
+    cursor.execute("SELECT frequency, SUM(amount_cents) AS total FROM income WHERE user_id = ? GROUP BY frequency", (user_id,))
+    for row in cursor.fetchall():
+        monthly_income_cents += (row["total"] or 0) * forecast.INCOME_PER_MONTH.get((row["frequency"] or "").lower(), 0)
+    
+    cursor.execute("""
+        SELECT COALESCE(SUM(asset_value_cents), 0) AS total,
+               COALESCE(SUM(CASE WHEN is_liquid = 1 THEN asset_value_cents ELSE 0 END), 0) AS liquid
+        FROM assets WHERE user_id = ?
+    """, (user_id,))
+    assets_row = cursor.fetchone()
+    
+    cursor.execute("""
+        SELECT id, remaining_amount_cents, installment_amount_cents, frequency, interest_rate, next_due_date
+        FROM liabilities WHERE user_id = ? AND is_completed = 0
+    """, (user_id,))
+    liabilities = [dict(r) for r in cursor.fetchall()]
+    
+    # Last 12 complete months of spending, straight from the rollups
+    current_month = datetime.date.today().isoformat()[:7]
+    cursor.execute("""
+        SELECT year_month, SUM(total_cents) AS total FROM expense_rollups_monthly
+        WHERE user_id = ? AND year_month < ? AND year_month >= ?
+        GROUP BY year_month HAVING SUM(txn_count) > 0
+    """, (user_id, current_month, month_sequence(current_month, 13)[0]))
+    expense_history = [r["total"] for r in cursor.fetchall()]
+    
+    return {
+        "monthly_income_cents": monthly_income_cents,
+        "liquid_assets_cents": assets_row["liquid"],
+        "total_assets_cents": assets_row["total"],
+        "total_liabilities_cents": sum(l["remaining_amount_cents"] for l in liabilities),
+        "liabilities": liabilities,
+        "expense_history": expense_history,
+    }
+
+def user_forecast(user_id: str, cursor, months: int = 12, paths: int = forecast.DEFAULT_PATHS,
+                  cached_only: bool = False) -> Optional[dict]:
+    """Cached Monte Carlo forecast; recomputed only when the user's data version changes"""
+    cursor.execute("SELECT data_version FROM users WHERE id = ?", (user_id,))
+    row = cursor.fetchone()
+    version = row["data_version"] if row else 0
+    today = datetime.date.today()
+    key = (user_id, version, today.isoformat(), months, paths)
+    if cached_only:
+        return forecast.cached_result(key)
+    return forecast.cached_simulation(
+        key, lambda: load_forecast_inputs(user_id, cursor),
+        months=months, paths=paths, seed=zlib.crc32(f"{user_id}:{version}".encode()), start=today)
+
+@app.get("/api/forecast")
 @token_required
-def get_recommendations():
-    """Get financial recommendations based on user's liabilities and assets"""
+def get_forecast():
+    """Monte Carlo projection of liquid cash and net worth with percentile bands"""
     user_id = request.current_user_id
     
+    try:
+        months = max(1, min(forecast.MAX_MONTHS, int(request.args.get("months", 12))))
+        paths = max(100, min(forecast.MAX_PATHS, int(request.args.get("paths", forecast.DEFAULT_PATHS))))
+        target_amount = request.args.get("target_amount")
+        target_amount_cents = to_cents(float(target_amount)) if target_amount else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {str(e)}"}), 400
+    
     conn = get_conn()
     cur = conn.cursor()
     
     try:
-        # Get user information
-        cur.execute("SELECT monthly_income_cents, currency_preference FROM users WHERE id = ?", (user_id,))
-        user_row = cur.fetchone()
-        
-        if not user_row:
-            return jsonify({"error": "User not found"}), 404
-        
-        monthly_income = (user_row["monthly_income_cents"] or 0) / 100
-        
-        # Get user's liquid assets total
-        cur.execute("SELECT SUM(asset_value_cents) as total FROM assets WHERE user_id = ? AND is_liquid = 1", (user_id,))
-        assets_result = cur.fetchone()
-        total_liquid_assets = (assets_result["total"] / 100) if assets_result["total"] else 0
-        
-        # Get active liabilities with priority calculation
-        cur.execute("""
-        SELECT id, liability_type, total_amount_cents, remaining_amount_cents,
-               installment_amount_cents, installments_total, installments_paid,
-               next_due_date, interest_rate, priority_score, description
-        FROM liabilities 
-        WHERE user_id = ? AND is_completed = 0 
-        ORDER BY priority_score DESC, next_due_date ASC
-        """, (user_id,))
-        
-        liabilities = cur.fetchall()
-        
-        # Calculate available budget (70% of income)
-        available_budget = monthly_income * 0.7
-        
-        # Generate recommendations
-        recommendations = []
-        remaining_budget = available_budget
-        
-        for liability in liabilities:
-            installment = liability["installment_amount_cents"] / 100
-            priority_score = liability["priority_score"]
-            remaining_amount = liability["remaining_amount_cents"] / 100
-            
-            # Determine urgency based on priority score and due date
-            urgency = "High" if priority_score >= 80 else "Medium" if priority_score >= 60 else "Low"
-            
-            # Determine recommended action based on budget and priority
-            if remaining_budget >= installment:
-                recommended_action = "Pay this month"
-                remaining_budget -= installment
-            elif priority_score >= 80:
-                recommended_action = "High priority - consider partial payment or reallocation"
-            else:
-                recommended_action = "Defer to next month or consider minimum payment"
-            
-            recommendation = {
-                "liability": {
-                    "id": liability["id"],
-                    "liability_type": liability["liability_type"],
-                    "remaining_amount": remaining_amount,
-                    "installment_amount": installment,
-                    "installments_total": liability["installments_total"],
-                    "installments_paid": liability["installments_paid"],
-                    "next_due_date": liability["next_due_date"],
-                    "description": liability["description"] or f"{liability['liability_type']} payment"
-                },
-                "priority_score": priority_score,
-                "recommended_action": recommended_action,
-                "amount": installment,
-                "urgency": urgency
+        result = user_forecast(user_id, cur, months, paths)
+        response = forecast.public_view(result)
+        
+        if target_amount_cents is not None:
+            target_month = (request.args.get("target_date") or result["months"][-1])[:7]
+            probability = forecast.probability_of_affording(result, target_amount_cents, target_month)
+            if probability is None:
+                return jsonify({"error": f"target_date must fall within the forecast ({result['months'][0]} to {result['months'][-1]})"}), 400
+            response["target"] = {
+                "amount": target_amount_cents / 100,
+                "month": target_month,
+                "probability": probability
             }
-            recommendations.append(recommendation)
         
-        # Calculate budget utilization
-        total_recommended_payments = sum(r["amount"] for r in recommendations if r["recommended_action"] == "Pay this month")
+        return jsonify(response)
         
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+# ------------------- Statement Import API -------------------
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_ERRORS = 20  # error samples kept on the job row
+
+def update_import_job(cursor, job_id: str, stats: dict, status: str = "running"):
+    """Persist import progress so GET /api/import/<id> can report it while the upload runs"""
+    cursor.execute("""
+        UPDATE import_jobs
+        SET status = ?, rows_processed = ?, expenses_inserted = ?, income_inserted = ?,
+            duplicates_skipped = ?, rows_failed = ?, errors = ?, updated_at = ?
+        WHERE id = ?
+    """, (status, stats["rows_processed"], stats["expenses_inserted"], stats["income_inserted"],
+          stats["duplicates_skipped"], stats["rows_failed"], json.dumps(stats["errors"]), now_iso(), job_id))
+
+def flush_import_batch(user_id: str, batch: list, account: str, currency: str, asset_id, stats: dict, cursor):
+    """
+    Insert one batch of statement rows, skipping content hashes that already exist. The
+    SELECT only saves work on known duplicates; counts and the asset change come from the
+    rows each INSERT OR IGNORE actually wrote, so a concurrent import of the same file
+    cannot move the asset twice.
+    """
+    hashes = [row["content_hash"] for row in batch]
+    placeholders = ",".join("?" * len(hashes))
+    existing = set()
+    for table in ("expenses", "income"):
+        cursor.execute(f"SELECT content_hash FROM {table} WHERE user_id = ? AND content_hash IN ({placeholders})",
+                       [user_id] + hashes)
+        existing.update(r["content_hash"] for r in cursor.fetchall())
+
+    created_at = now_iso()
+    net_cents = 0
+    inserted = 0
+    uncategorized = [row for row in batch if row["amount_cents"] < 0 and not row.get("category")]
+    predictions = dict(zip((row["content_hash"] for row in uncategorized), predict_categories(
+        cursor, user_id, [(row["description"], row.get("note"), row["source_text"]) for row in uncategorized])))
+    for row in batch:
+        if row["content_hash"] in existing:
+            stats["duplicates_skipped"] += 1
+            continue
+        existing.add(row["content_hash"])
+        if row["amount_cents"] < 0:
+            category, category_source = row.get("category"), "import"
+            if not category:
+                category, _ = predictions[row["content_hash"]]
+                category_source = "model" if category else None
+            cursor.execute("""
+                INSERT OR IGNORE INTO expenses (user_id, occurred_at, amount_cents, currency, merchant,
+                                                category, account, note, source_text, created_at, content_hash,
+                                                category_source, merchant_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, row["occurred_at"], -row["amount_cents"], currency, row["description"] or None,
+                  category, account, row.get("note"), row["source_text"], created_at, row["content_hash"],
+                  category_source, resolve_merchant_id(cursor, row["description"])))
+            counter = "expenses_inserted"
+        else:
+            cursor.execute("""
+                INSERT OR IGNORE INTO income (user_id, income_type, amount_cents, frequency,
+                                              source, occurred_at, created_at, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, row.get("category") or "other", row["amount_cents"], "one-time",
+                  row["description"] or None, row["occurred_at"], created_at, row["content_hash"]))
+            counter = "income_inserted"
+        if cursor.rowcount == 1:
+            stats[counter] += 1
+            net_cents += row["amount_cents"]
+            inserted += 1
+        else:
+            # Written by a concurrent import since the SELECT above
+            stats["duplicates_skipped"] += 1
+
+    # Reconcile the linked asset in the same transaction as the inserts
+    if asset_id and net_cents:
+        tag_ledger_posting(cursor, user_id, "statement_import", "import_job", stats.get("job_id"),
+                           f"{inserted} statement rows")
+        cursor.execute("""
+            UPDATE assets
+            SET asset_value_cents = asset_value_cents + ?, version = version + 1, updated_at = ?
+            WHERE id = ?
+        """, (net_cents, created_at, asset_id))
+        clear_ledger_posting(cursor, user_id)
+    stats["net_change_cents"] += net_cents
+
+def run_statement_import(user_id: str, rows, job_id: str, account: str, currency: str, asset, conn):
+    """Stream parsed statement rows into expenses/income in batched transactions"""
+    cur = conn.cursor()
+    stats = {"rows_processed": 0, "expenses_inserted": 0, "income_inserted": 0, "duplicates_skipped": 0,
+             "rows_failed": 0, "errors": [], "net_change_cents": 0, "job_id": job_id}
+    cur.execute("SELECT COALESCE(MAX(id), 0) AS last_id FROM expense_alerts")
+    first_alert_id = cur.fetchone()["last_id"] + 1
+    asset_id = asset["id"] if asset else None
+    occurrences = {}
+    statement_balance = None  # (date, cents) of the newest balance seen in the file
+    batch = []
+
+    for row in rows:
+        if "ledger_balance_cents" in row:
+            statement_balance = (row.get("ledger_balance_date") or "9999-12-31", row["ledger_balance_cents"])
+            continue
+        stats["rows_processed"] += 1
+        if "error" in row:
+            stats["rows_failed"] += 1
+            if len(stats["errors"]) < IMPORT_MAX_ERRORS:
+                stats["errors"].append(row["error"])
+            continue
+
+        if row.get("balance_cents") is not None and (statement_balance is None or row["occurred_at"] >= statement_balance[0]):
+            statement_balance = (row["occurred_at"], row["balance_cents"])
+
+        # Identical rows within one statement are distinguished by their occurrence index,
+        # so re-importing the same or an overlapping file yields the same hashes
+        if row.get("reference"):
+            discriminator = f"ref:{row['reference']}"
+        else:
+            key = (row["occurred_at"], row["amount_cents"], statement_import.normalize_description(row["description"]))
+            occurrences[key] = occurrences.get(key, 0) + 1
+            discriminator = f"n:{occurrences[key]}"
+        row["content_hash"] = statement_import.content_hash(
+            user_id, row["occurred_at"], row["amount_cents"], row["description"], discriminator)
+        batch.append(row)
+
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            flush_import_batch(user_id, batch, account, currency, asset_id, stats, cur)
+            update_import_job(cur, job_id, stats)
+            conn.commit()
+            batch = []
+
+    if batch:
+        flush_import_batch(user_id, batch, account, currency, asset_id, stats, cur)
+
+    # A statement closing balance is authoritative for the linked asset
+    reconciled_balance = None
+    if asset_id:
+        if statement_balance is not None:
+            tag_ledger_posting(cur, user_id, "equity:reconciliation", "import_job", job_id, "Statement closing balance")
+            cur.execute("UPDATE assets SET asset_value_cents = ?, version = version + 1, updated_at = ? WHERE id = ?",
+                        (statement_balance[1], now_iso(), asset_id))
+            clear_ledger_posting(cur, user_id)
+        cur.execute("SELECT asset_value_cents FROM assets WHERE id = ?", (asset_id,))
+        reconciled_balance = cur.fetchone()["asset_value_cents"]
+
+    # Alerts raised by the expense triggers for rows of this import
+    cur.execute("SELECT COUNT(*) AS alerts FROM expense_alerts WHERE user_id = ? AND id >= ?", (user_id, first_alert_id))
+    stats["alerts"] = cur.fetchone()["alerts"]
+
+    update_import_job(cur, job_id, stats, status="completed")
+    conn.commit()
+    return stats, reconciled_balance
+
+def serialize_import_job(row) -> dict:
+    return {
+        "import_id": row["id"],
+        "filename": row["filename"],
+        "format": row["file_format"],
+        "status": row["status"],
+        "rows_processed": row["rows_processed"],
+        "expenses_inserted": row["expenses_inserted"],
+        "income_inserted": row["income_inserted"],
+        "duplicates_skipped": row["duplicates_skipped"],
+        "rows_failed": row["rows_failed"],
+        "errors": json.loads(row["errors"]) if row["errors"] else [],
+        "asset_id": row["asset_id"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"]
+    }
+
+@app.post("/api/import")
+@token_required
+def import_statement():
+    """Bulk import a CSV or OFX bank statement into expenses and income"""
+    user_id = request.current_user_id
+    upload = request.files.get("file")
+    if not upload:
+        return jsonify({"error": "A statement file is required (multipart field 'file')"}), 400
+
+    filename = upload.filename or "statement"
+    file_format = (request.form.get("format") or "").lower()
+    if not file_format:
+        file_format = "ofx" if filename.lower().endswith((".ofx", ".qfx")) else "csv"
+    if file_format not in ("csv", "ofx"):
+        return jsonify({"error": "format must be 'csv' or 'ofx'"}), 400
+
+    try:
+        mapping = json.loads(request.form["mapping"]) if request.form.get("mapping") else None
+    except ValueError:
+        return jsonify({"error": "mapping must be a JSON object"}), 400
+    account = (request.form.get("account") or "").strip()
+    currency = currency_clean(request.form.get("currency"))
+    date_format = request.form.get("date_format") or None
+    negative_is_expense = (request.form.get("sign_convention") or "negative_is_expense") != "positive_is_expense"
+    job_id = request.form.get("import_id") or str(uuid.uuid4())
+
+    conn = get_conn()
+    cur = conn.cursor()
+
+    try:
+        asset = None
+        if account:
+            try:
+                asset = find_matching_asset(user_id, account, cur)
+            except AmbiguousAssetError as e:
+                return jsonify({"error": str(e), "candidates": e.candidates}), 400
+            if not asset:
+                return jsonify({"error": f"No asset found matching account '{account}'. Please add this asset first."}), 400
+
+        cur.execute("""
+            INSERT INTO import_jobs (id, user_id, filename, file_format, status, errors, asset_id, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (job_id, user_id, filename, file_format, "running", "[]", asset["id"] if asset else None, now_iso(), now_iso()))
+        conn.commit()
+
+        text_stream = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", errors="replace", newline="")
+        if file_format == "ofx":
+            rows = statement_import.iter_ofx_rows(text_stream, negative_is_expense)
+        else:
+            rows = statement_import.iter_csv_rows(text_stream, mapping, date_format, negative_is_expense)
+
+        try:
+            stats, reconciled_balance = run_statement_import(
+                user_id, rows, job_id, account or "Import", currency, asset, conn)
+        except ValueError as e:
+            conn.rollback()
+            cur.execute("UPDATE import_jobs SET status = ?, errors = ?, updated_at = ? WHERE id = ?",
+                        ("failed", json.dumps([str(e)]), now_iso(), job_id))
+            conn.commit()
+            return jsonify({"error": str(e), "import_id": job_id}), 400
+
         return jsonify({
-            "total_income": monthly_income,
-            "available_budget": available_budget,
-            "remaining_budget": max(0, remaining_budget),
-            "total_liquid_assets": total_liquid_assets,
-            "recommendations": recommendations,
-            "budget_utilization": (total_recommended_payments / available_budget * 100) if available_budget > 0 else 0
+            "message": "Import completed",
+            "import_id": job_id,
+            "rows_processed": stats["rows_processed"],
+            "expenses_inserted": stats["expenses_inserted"],
+            "income_inserted": stats["income_inserted"],
+            "duplicates_skipped": stats["duplicates_skipped"],
+            "rows_failed": stats["rows_failed"],
+            "errors": stats["errors"],
+            "alerts": stats["alerts"],
+            "net_change": stats["net_change_cents"] / 100,
+            "asset_id": asset["id"] if asset else None,
+            "asset_new_balance": reconciled_balance / 100 if reconciled_balance is not None else None
         })
-        
+
+    except sqlite3.IntegrityError:
+        return jsonify({"error": "import_id already in use"}), 409
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.get("/api/import/<job_id>")
+@token_required
+def get_import_status(job_id):
+    """Get progress of a statement import"""
+    user_id = request.current_user_id
+
+    conn = get_conn()
+    cur = conn.cursor()
+
+    try:
+        cur.execute("SELECT * FROM import_jobs WHERE id = ? AND user_id = ?", (job_id, user_id))
+        row = cur.fetchone()
+        if not row:
+            return jsonify({"error": "Import not found"}), 404
+        return jsonify({"import": serialize_import_job(row)})
+
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -2473,7 +5931,7 @@ def get_available_models():
         
         # Create Cerebras client with user's API key
         try:
-            user_client = Cerebras(api_key=user_api_key)
+            user_client = cerebras_client(user_api_key)
             
             # Fetch available models
             models_response = user_client.models.list()
@@ -2604,6 +6062,29 @@ def update_profile():
         conn.close()
 
 # ------------------- Auth API -------------------
+# Every auth attempt takes a token from the client IP's bucket and, where an account is named,
+# from that account's bucket, so neither a single client nor a spread-out guess at one account
+# can fill the password hashing pool.
+AUTH_IP_LIMIT = rate_limit.from_env("AUTH_RATE_LIMIT_IP", 30, 10)
+AUTH_ACCOUNT_LIMIT = rate_limit.from_env("AUTH_RATE_LIMIT_ACCOUNT", 5, 5)
+
+def retry_later(message: str, status: int, seconds: float):
+    resp = jsonify({"error": message})
+    resp.status_code = status
+    resp.headers["Retry-After"] = str(max(1, math.ceil(seconds)))
+    return resp
+
+def auth_rate_limited(account: Optional[str] = None):
+    """A 429 response if this client or account is over its limit, else None"""
+    wait = AUTH_IP_LIMIT.take(f"ip:{request.remote_addr}")
+    if not wait and account:
+        # One bucket per account however the email is cased or padded
+        wait = AUTH_ACCOUNT_LIMIT.take(f"account:{account.strip().lower()}")
+    return retry_later("Too many attempts, please try again later", 429, wait) if wait else None
+
+def hashing_busy():
+    return retry_later("Server is busy, please try again", 503, 1)
+
 @app.post("/api/auth/register")
 def register():
     """User registration with password hashing"""
@@ -2618,6 +6099,10 @@ def register():
     if len(password) < 6:
         return jsonify({"error": "Password must be at least 6 characters"}), 400
     
+    limited = auth_rate_limited(email)
+    if limited:
+        return limited
+    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -2629,7 +6114,7 @@ def register():
         
         # Create new user
         user_id = str(uuid.uuid4())
-        password_hash = generate_password_hash(password)
+        password_hash = passwords.hash_password(password)
         secret_key = generate_secret_key()  # Generate secret key for new user
         
         cur.execute("""
@@ -2637,15 +6122,12 @@ def register():
                           currency_preference, created_at, updated_at)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (user_id, name, email, password_hash, secret_key, 0, "USD", now_iso(), now_iso()))
-        
+        tokens = issue_tokens(cur, user_id)
         conn.commit()
         
-        # Generate JWT token
-        token = generate_token(user_id)
-        
         return jsonify({
             "message": "Registration successful",
-            "access_token": token,
+            **tokens,
             "secret_key": secret_key,  # Return secret key to user
             "user": {
                 "id": user_id,
@@ -2654,6 +6136,8 @@ def register():
             }
         })
         
+    except passwords.HashingBusy:
+        return hashing_busy()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -2669,6 +6153,10 @@ def login():
     if not email or not password:
         return jsonify({"error": "Email and password are required"}), 400
     
+    limited = auth_rate_limited(email)
+    if limited:
+        return limited
+    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -2677,15 +6165,21 @@ def login():
         cur.execute("SELECT id, name, email, password_hash, secret_key FROM users WHERE email = ?", (email,))
         user_row = cur.fetchone()
         
-        if not user_row or not check_password_hash(user_row["password_hash"], password):
+        if not user_row or not passwords.verify_password(user_row["password_hash"], password):
             return jsonify({"error": "Invalid email or password"}), 401
         
-        # Generate JWT token
-        token = generate_token(user_row["id"])
+        # Upgrade hashes made before PASSWORD_HASH_METHOD changed while the password is at hand
+        if passwords.needs_rehash(user_row["password_hash"]):
+            cur.execute("UPDATE users SET password_hash = ?, updated_at = ? WHERE id = ?",
+                        (passwords.hash_password(password), now_iso(), user_row["id"]))
+            conn.commit()
+        
+        tokens = issue_tokens(cur, user_row["id"])
+        conn.commit()
         
         return jsonify({
             "message": "Login successful",
-            "access_token": token,
+            **tokens,
             "user": {
                 "id": user_row["id"],
                 "name": user_row["name"],
@@ -2693,6 +6187,56 @@ def login():
             }
         })
         
+    except passwords.HashingBusy:
+        return hashing_busy()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.post("/api/auth/refresh")
+def refresh_tokens():
+    """Exchange a refresh token for a new access/refresh pair"""
+    data = request.get_json() or {}
+    refresh_token = (data.get("refresh_token") or "").strip()
+    
+    if not refresh_token:
+        return jsonify({"error": "Refresh token is required"}), 400
+    
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        tokens = rotate_refresh_token(cur, refresh_token)
+        # Commit either way: a detected reuse revokes the family
+        conn.commit()
+        if not tokens:
+            return jsonify({"error": "Refresh token is invalid or expired"}), 401
+        return jsonify(tokens)
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        conn.close()
+
+@app.post("/api/auth/logout")
+@token_required
+def logout():
+    """Revoke the token used for this request and the session's refresh tokens"""
+    data = request.get_json(silent=True) or {}
+    conn = get_conn()
+    cur = conn.cursor()
+    
+    try:
+        revoke_token(cur, request.token_claims)
+        if data.get("refresh_token"):
+            row = cur.execute("SELECT family_id FROM refresh_tokens WHERE token_hash = ? AND user_id = ?",
+                              (refresh_token_hash(data["refresh_token"]), request.current_user_id)).fetchone()
+            if row:
+                revoke_refresh_family(cur, row["family_id"])
+        conn.commit()
+        return jsonify({"message": "Logged out"})
+    
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -2712,6 +6256,10 @@ def reset_password():
     if len(new_password) < 6:
         return jsonify({"error": "Password must be at least 6 characters"}), 400
     
+    limited = auth_rate_limited(email)
+    if limited:
+        return limited
+    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -2724,9 +6272,11 @@ def reset_password():
             return jsonify({"error": "Invalid email or secret key"}), 401
         
         # Update password
-        password_hash = generate_password_hash(new_password)
+        password_hash = passwords.hash_password(new_password)
         cur.execute("UPDATE users SET password_hash = ?, updated_at = ? WHERE id = ?", 
                    (password_hash, now_iso(), user_row["id"]))
+        # Sessions signed in with the old password stop working immediately
+        revoke_user_tokens(cur, user_row["id"])
         conn.commit()
         
         return jsonify({
@@ -2738,6 +6288,8 @@ def reset_password():
             }
         })
         
+    except passwords.HashingBusy:
+        return hashing_busy()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -2754,6 +6306,10 @@ def get_secret_key():
     if not password:
         return jsonify({"error": "Password is required"}), 400
     
+    limited = auth_rate_limited(user_id)
+    if limited:
+        return limited
+    
     conn = get_conn()
     cur = conn.cursor()
     
@@ -2762,8 +6318,9 @@ def get_secret_key():
         cur.execute("SELECT password_hash, secret_key FROM users WHERE id = ?", (user_id,))
         user_row = cur.fetchone()
         
-        if not user_row or not check_password_hash(user_row["password_hash"], password):
-            return jsonify({"error": "Invalid password"}), 401
+        if not user_row or not passwords.verify_password(user_row["password_hash"], password):
+            # 403, not 401: the session is valid, so the client must not refresh or log out
+            return jsonify({"error": "Invalid password"}), 403
         
         if not user_row["secret_key"]:
             return jsonify({"error": "No secret key found. Please log in again to generate one."}), 404
@@ -2773,6 +6330,8 @@ def get_secret_key():
             "message": "Secret key retrieved successfully"
         })
         
+    except passwords.HashingBusy:
+        return hashing_busy()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
@@ -2780,4 +6339,4 @@ def get_secret_key():
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "5000"))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    create_app().run(host="0.0.0.0", port=port, debug=True)
@@ -0,0 +1,169 @@
+# Resolves free-text payment methods ("my chase card", "checking") to asset ids.
+# Each user's assets are indexed by normalized full name, user aliases, word tokens
+# and character trigrams. The keys are stored in the asset_resolution_keys table and
+# held in an in-process cache keyed on the user's asset index version, so a lookup is a
+# few dict probes instead of a scan over every asset.
+
+import math, re, threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+RESOLVER_CACHE_SIZE = 1024
+AMBIGUITY_MARGIN = 0.05  # candidates scoring within this of the best one are reported as ambiguous
+MIN_SCORE = 0.3
+
+# Words that say nothing about which asset is meant
+STOPWORDS = {"my", "the", "a", "an", "from", "with", "using", "via", "by", "on", "in", "account", "acct"}
+
+# Spellings folded onto one token (replaces the old cash/checking/savings/credit special cases)
+SYNONYMS = {
+    "chequing": "checking",
+    "current": "checking",
+    "debit": "checking",
+    "saving": "savings",
+    "cc": "credit",
+    "creditcard": "credit",
+    "wallet": "cash",
+}
+
+_cache = OrderedDict()
+_stats = {"hits": 0, "misses": 0}
+_cache_lock = threading.Lock()
+
+def tokens(text: Optional[str]) -> List[str]:
+    words = re.sub(r"[^a-z0-9]+", " ", (text or "").lower()).split()
+    return [SYNONYMS.get(w, w) for w in words if w not in STOPWORDS]
+
+def normalize(text: Optional[str]) -> str:
+    """Lowercase, punctuation-free, stopword-free form used for exact name and alias keys"""
+    return " ".join(tokens(text))
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def build_keys(assets: Iterable[dict], aliases: Iterable[Tuple[str, int]]) -> List[tuple]:
+    """(key_type, key, asset_id, weight) rows for one user's assets and aliases"""
+    assets = list(assets)
+    token_sets = {}
+    for asset in assets:
+        token_sets[asset["id"]] = set(tokens(asset.get("asset_type"))) | set(tokens(asset.get("account")))
+    # Rare tokens identify an asset better than ones every asset shares
+    doc_freq = defaultdict(int)
+    for toks in token_sets.values():
+        for tok in toks:
+            doc_freq[tok] += 1
+
+    keys = set()
+    for asset in assets:
+        for field in ("asset_type", "account"):
+            name = normalize(asset.get(field))
+            if name:
+                keys.add(("name", name, asset["id"], 1.0))
+        for tok in token_sets[asset["id"]]:
+            keys.add(("token", tok, asset["id"], round(math.log(1 + len(assets) / doc_freq[tok]), 4)))
+            for gram in trigrams(tok):
+                keys.add(("trigram", gram, asset["id"], 1.0))
+    for alias, asset_id in aliases:
+        name = normalize(alias)
+        if name:
+            keys.add(("alias", name, asset_id, 1.0))
+    return sorted(keys)
+
+class AssetIndex:
+    """In-memory lookup tables built from stored keys"""
+
+    def __init__(self, keys: Iterable[tuple]):
+        self.exact: Dict[str, List[int]] = defaultdict(list)
+        self.tokens: Dict[str, Dict[int, float]] = defaultdict(dict)
+        self.trigrams: Dict[str, set] = defaultdict(set)
+        self.trigram_counts: Dict[int, int] = defaultdict(int)
+        for key_type, key, asset_id, weight in keys:
+            if key_type in ("name", "alias"):
+                self.exact[key].append(asset_id)
+            elif key_type == "token":
+                self.tokens[key][asset_id] = weight
+            elif key_type == "trigram":
+                self.trigrams[key].add(asset_id)
+                self.trigram_counts[asset_id] += 1
+
+    def resolve(self, query: str, limit: int = 5) -> List[Tuple[int, float]]:
+        """Ranked (asset_id, score) candidates; 1.0 is an exact name or alias match"""
+        name = normalize(query)
+        if not name:
+            return []
+        scores = defaultdict(float)
+        for asset_id in self.exact.get(name, ()):
+            scores[asset_id] = 1.0
+
+        # Token overlap weighted by rarity; unknown query words count against the match
+        query_tokens = name.split()
+        total = 0.0
+        token_scores = defaultdict(float)
+        for tok in query_tokens:
+            postings = self.tokens.get(tok)
+            if not postings:
+                total += 1.0
+                continue
+            weight = max(postings.values())
+            total += weight
+            for asset_id, w in postings.items():
+                token_scores[asset_id] += w
+
+        # Trigram overlap catches typos ("chekcing") and partial words ("sav")
+        grams = set()
+        for tok in query_tokens:
+            grams |= trigrams(tok)
+        gram_hits = defaultdict(int)
+        for gram in grams:
+            for asset_id in self.trigrams.get(gram, ()):
+                gram_hits[asset_id] += 1
+
+        for asset_id in set(token_scores) | set(gram_hits):
+            token_score = token_scores.get(asset_id, 0.0) / total if total else 0.0
+            # Dice coefficient between the query's and the asset's trigrams
+            gram_score = 2 * gram_hits.get(asset_id, 0) / (len(grams) + self.trigram_counts[asset_id])
+            # Below 1.0 so an exact name or alias always ranks first
+            scores[asset_id] = max(scores[asset_id], round(0.95 * max(token_score, gram_score), 4))
+
+        ranked = sorted(((a, s) for a, s in scores.items() if s >= MIN_SCORE), key=lambda item: -item[1])
+        return ranked[:limit]
+
+    def resolve_exact(self, query: str) -> List[int]:
+        """Asset ids a write may use: exact name or alias matches, else assets holding every query word"""
+        name = normalize(query)
+        if not name:
+            return []
+        if name in self.exact:
+            return sorted(set(self.exact[name]))
+        matches = None
+        for tok in name.split():
+            postings = set(self.tokens.get(tok, ()))
+            matches = postings if matches is None else matches & postings
+            if not matches:
+                return []
+        return sorted(matches)
+
+def is_ambiguous(ranked: List[Tuple[int, float]]) -> bool:
+    return len(ranked) > 1 and ranked[0][1] - ranked[1][1] <= AMBIGUITY_MARGIN
+
+def cached_index(user_id: str, version: int, loader) -> AssetIndex:
+    """AssetIndex for a user, rebuilt via loader() only when the asset index version changes"""
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry and entry[0] == version:
+            _stats["hits"] += 1
+            _cache.move_to_end(user_id)
+            return entry[1]
+        _stats["misses"] += 1
+    index = AssetIndex(loader())
+    with _cache_lock:
+        _cache[user_id] = (version, index)
+        _cache.move_to_end(user_id)
+        while len(_cache) > RESOLVER_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
+
+def cache_stats() -> dict:
+    with _cache_lock:
+        return {"entries": len(_cache), **_stats}
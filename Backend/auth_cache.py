@@ -0,0 +1,98 @@
+# Verified-token cache and token revocations for token_required.
+# A token this process has already verified is looked up by a SHA-256 of the token (the
+# token itself is never kept) and skips signature verification until its `exp`.
+# Revocations live in the token_revocations table; each process mirrors them in memory and
+# pulls new rows at most every SYNC_SECONDS, so checking a token never touches the database.
+
+import hashlib, threading, time
+from collections import OrderedDict
+from typing import Optional
+
+TOKEN_CACHE_SIZE = 10000
+SYNC_SECONDS = 5
+
+_tokens = OrderedDict()
+_stats = {"hits": 0, "misses": 0}
+_tokens_lock = threading.Lock()
+
+_revoked_jtis = {}  # jti -> exp; dropped once the token would have expired anyway
+_user_cutoffs = {}  # user_id -> (epoch, expires_at); tokens issued before epoch are revoked
+_revocations_lock = threading.Lock()
+_sync_state = {"last_id": 0, "last_sync": 0.0}
+_sync_lock = threading.Lock()
+
+def token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+def cached_claims(key: bytes, now: Optional[float] = None) -> Optional[dict]:
+    """Claims of a previously verified token, or None if unknown or expired"""
+    now = time.time() if now is None else now
+    with _tokens_lock:
+        claims = _tokens.get(key)
+        if claims is None:
+            _stats["misses"] += 1
+            return None
+        if claims.get("exp", 0) <= now:
+            _stats["misses"] += 1
+            del _tokens[key]
+            return None
+        _stats["hits"] += 1
+        _tokens.move_to_end(key)
+        return claims
+
+def remember_claims(key: bytes, claims: dict) -> None:
+    with _tokens_lock:
+        _tokens[key] = claims
+        _tokens.move_to_end(key)
+        while len(_tokens) > TOKEN_CACHE_SIZE:
+            _tokens.popitem(last=False)
+
+def cache_stats() -> dict:
+    with _tokens_lock:
+        return {"entries": len(_tokens), **_stats}
+
+def forget(key: bytes) -> None:
+    with _tokens_lock:
+        _tokens.pop(key, None)
+
+def apply_revocation(jti: Optional[str], user_id: Optional[str], revoked_before: Optional[float], expires_at: int) -> None:
+    """Mirror one token_revocations row"""
+    with _revocations_lock:
+        if jti:
+            _revoked_jtis[jti] = expires_at
+        if user_id and revoked_before is not None:
+            current = _user_cutoffs.get(user_id)
+            if current is None or revoked_before > current[0]:
+                _user_cutoffs[user_id] = (revoked_before, expires_at)
+
+def is_revoked(claims: dict) -> bool:
+    with _revocations_lock:
+        if claims.get("jti") in _revoked_jtis:
+            return True
+        cutoff = _user_cutoffs.get(claims.get("user_id"))
+        return cutoff is not None and claims.get("iat", 0) < cutoff[0]
+
+def sync_due(now: Optional[float] = None) -> bool:
+    now = time.time() if now is None else now
+    return now - _sync_state["last_sync"] >= SYNC_SECONDS
+
+def sync(fetch_rows) -> None:
+    """
+    Pull revocations newer than the last one seen; fetch_rows(last_id) returns
+    (id, jti, user_id, revoked_before, expires_at) rows in id order. One caller at a time.
+    """
+    if not _sync_lock.acquire(blocking=False):
+        return
+    try:
+        now = time.time()
+        for row_id, jti, user_id, revoked_before, expires_at in fetch_rows(_sync_state["last_id"]):
+            apply_revocation(jti, user_id, revoked_before, expires_at)
+            _sync_state["last_id"] = row_id
+        _sync_state["last_sync"] = now
+        with _revocations_lock:
+            for jti in [j for j, exp in _revoked_jtis.items() if exp <= now]:
+                del _revoked_jtis[jti]
+            for user_id in [u for u, (_, exp) in _user_cutoffs.items() if exp <= now]:
+                del _user_cutoffs[user_id]
+    finally:
+        _sync_lock.release()
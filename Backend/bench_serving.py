@@ -0,0 +1,126 @@
+"""
+Serving benchmark: throughput of the Werkzeug dev server (`python app.py`) against gunicorn
+(`gunicorn -c gunicorn.conf.py wsgi:app`) on the same read-heavy request mix.
+
+    python bench_serving.py [--server dev|gunicorn|both] [--concurrency 16] [--seconds 10]
+
+Each server is started on a scratch database, seeded with one user holding a few assets and
+liabilities, then driven by keep-alive client threads for the given time. The client runs
+on the same machine, so on small machines it competes with the server for CPU.
+"""
+
+import argparse, http.client, json, os, signal, statistics, subprocess, sys, tempfile, threading, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PATHS = ["/api/dashboard", "/api/assets", "/api/liabilities", "/api/profile"]
+
+def start_server(kind: str, port: int, db_path: str, workers: int, threads: int) -> subprocess.Popen:
+    env = dict(os.environ, PORT=str(port), DB_PATH=db_path, SCHEDULER_ENABLED="0",
+               WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads))
+    cmd = ([sys.executable, "app.py"] if kind == "dev" else
+           [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"])
+    proc = subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            request(http.client.HTTPConnection("127.0.0.1", port, timeout=5), "GET", "/api/profile")
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    stop_server(proc)
+    raise RuntimeError(f"{kind} server did not start on port {port}")
+
+def stop_server(proc: subprocess.Popen) -> None:
+    os.killpg(proc.pid, signal.SIGTERM)
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+
+def request(conn, method: str, path: str, body=None, token=None):
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    resp = conn.getresponse()
+    data = resp.read()
+    return resp.status, data
+
+def seed(port: int) -> str:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    _, data = request(conn, "POST", "/api/auth/register",
+                      {"name": "Bench", "email": "bench@example.com", "password": "bench-password"})
+    token = json.loads(data)["access_token"]
+    for i in range(5):
+        request(conn, "POST", "/api/assets", {"name": f"Account {i}", "amount": 1000 * (i + 1), "type": "liquid"}, token)
+    for i in range(3):
+        request(conn, "POST", "/api/liabilities", {"name": f"Loan {i}", "amount": 5000, "payment_type": "monthly",
+                                                   "installment_amount": 250, "priority_score": 5}, token)
+    return token
+
+def drive(port: int, token: str, concurrency: int, seconds: float) -> dict:
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + seconds
+
+    def client(offset: int):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        mine, failed, i = [], 0, offset
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                status, _ = request(conn, "GET", PATHS[i % len(PATHS)], token=token)
+                if status != 200:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            mine.append(time.perf_counter() - started)
+            i += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    workers = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+        "errors": errors[0],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--server", choices=["dev", "gunicorn", "both"], default="both")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=(os.cpu_count() or 1) * 2 + 1, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument("--port", type=int, default=5099)
+    args = parser.parse_args()
+
+    kinds = ["dev", "gunicorn"] if args.server == "both" else [args.server]
+    print(f"{'server':<10} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in kinds:
+            proc = start_server(kind, args.port, os.path.join(tmp, f"{kind}.db"), args.workers, args.threads)
+            try:
+                token = seed(args.port)
+                drive(args.port, token, args.concurrency, 1)  # warm-up
+                r = drive(args.port, token, args.concurrency, args.seconds)
+            finally:
+                stop_server(proc)
+            print(f"{kind:<10} {r['requests']:>9} {r['rps']:>9.1f} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['errors']:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Startup benchmark: what a fresh worker process pays before it can serve a request.
+
+    python bench_startup.py [--runs 5] [--top 10]
+
+Each run starts a new interpreter with `-X importtime` against a scratch database (nothing
+real is touched) and reports the median of:
+  - importing app.py (total, and its slowest direct imports)
+  - create_app() on an empty database (schema created) and on one already at SCHEMA_VERSION
+"""
+
+import argparse, os, re, statistics, subprocess, sys, tempfile
+from collections import defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$")
+
+PROBE = """
+import time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.create_app()
+t2 = time.perf_counter()
+print(f"import_ms={(t1 - t0) * 1000:.1f} create_app_ms={(t2 - t1) * 1000:.1f}")
+"""
+
+def run_once(db_path: str):
+    env = dict(os.environ, DB_PATH=db_path, SCHEDULER_ENABLED="0")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=HERE, env=env,
+                          capture_output=True, text=True, check=True)
+    timings = dict(kv.split("=") for kv in proc.stdout.split())
+    direct = {}
+    for line in proc.stderr.splitlines():
+        m = IMPORT_LINE.match(line)
+        # app itself is at depth 0 (one space); its own imports are one level (two spaces) deeper
+        if m and len(m.group(3)) == 3:
+            direct[m.group(4)] = int(m.group(2)) / 1000
+    return float(timings["import_ms"]), float(timings["create_app_ms"]), direct
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    imports, fresh, current = [], [], []
+    modules = defaultdict(list)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Warm-up run so every run below reads compiled bytecode
+        run_once(os.path.join(tmp, "warmup.db"))
+        for i in range(args.runs):
+            db_path = os.path.join(tmp, f"run{i}.db")
+            import_ms, create_ms, direct = run_once(db_path)
+            imports.append(import_ms)
+            fresh.append(create_ms)
+            for name, ms in direct.items():
+                modules[name].append(ms)
+            # Same database again: now stamped with SCHEMA_VERSION
+            import_ms, create_ms, _ = run_once(db_path)
+            imports.append(import_ms)
+            current.append(create_ms)
+
+    print(f"import app            {statistics.median(imports):8.1f} ms")
+    print(f"create_app (new db)   {statistics.median(fresh):8.1f} ms")
+    print(f"create_app (current)  {statistics.median(current):8.1f} ms")
+    print(f"\nSlowest imports of app.py (cumulative, median of {args.runs}):")
+    slowest = sorted(modules.items(), key=lambda kv: statistics.median(kv[1]), reverse=True)
+    for name, samples in slowest[:args.top]:
+        print(f"  {name:<28} {statistics.median(samples):8.1f} ms")
+
+if __name__ == "__main__":
+    main()
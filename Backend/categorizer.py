@@ -0,0 +1,173 @@
+# Local expense categorizer: multinomial naive Bayes over hashed merchant words, text
+# words and word bigrams. A global model trained on every user's
+# labelled expenses is interpolated with a small per-user model, so a new user gets
+# sensible defaults while an established user's own habits ("Costco" -> "Household") win.
+# A model is just per-class count rows, so learning from a new expense is an in-place add
+# and a prediction is one fancy-indexed gather over a few dozen columns.
+
+import io, re, threading, zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+GLOBAL_FEATURES = 2 ** 16
+USER_FEATURES = 2 ** 12
+ALPHA = 0.1  # additive smoothing per feature bucket
+USER_HALF_WEIGHT_DOCS = 20  # labelled rows at which the user model gets half the weight
+MIN_CONFIDENCE = 0.5
+MODEL_CACHE_SIZE = 256
+
+_cache = OrderedDict()
+_stats = {"hits": 0, "misses": 0}
+_lock = threading.RLock()
+
+def _hash(token: str) -> int:
+    return zlib.crc32(token.encode())
+
+def features(merchant: Optional[str], note: Optional[str], source_text: Optional[str]) -> np.ndarray:
+    """Hashed feature ids for one expense; digits are dropped so "CHIPOTLE 1234" == "Chipotle" """
+    merchant_words = re.findall(r"[a-z]{2,}", (merchant or "").lower())
+    words = re.findall(r"[a-z]{2,}", f"{note or ''} {source_text or ''}".lower())
+    tokens = [f"m:{w}" for w in merchant_words]
+    tokens += [f"w:{w}" for w in words]
+    tokens += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    if len(merchant_words) > 1:
+        tokens.append("m:" + " ".join(merchant_words))
+    return np.fromiter((_hash(t) for t in tokens), dtype=np.int64, count=len(tokens))
+
+class CategoryModel:
+    """Per-class feature counts; labels are matched case-insensitively and keep their first spelling"""
+
+    def __init__(self, n_features: int):
+        self.n_features = n_features
+        self.labels: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.counts = np.zeros((0, n_features), dtype=np.float32)
+        self.totals = np.zeros(0)
+        self.docs = np.zeros(0)
+        self.trained_through = 0  # highest expense id folded into the counts
+
+    def add(self, label: Optional[str], feats: np.ndarray) -> None:
+        key = (label or "").strip().lower()
+        if not key or not len(feats):
+            return
+        row = self.index.get(key)
+        if row is None:
+            row = self.index[key] = len(self.labels)
+            self.labels.append(label.strip())
+            self.counts = np.vstack([self.counts, np.zeros((1, self.n_features), dtype=np.float32)])
+            self.totals = np.append(self.totals, 0.0)
+            self.docs = np.append(self.docs, 0.0)
+        np.add.at(self.counts[row], feats % self.n_features, 1.0)
+        self.totals[row] += len(feats)
+        self.docs[row] += 1
+
+    @property
+    def n_docs(self) -> float:
+        return float(self.docs.sum())
+
+    def feature_probs(self, feats: np.ndarray) -> np.ndarray:
+        """(classes, len(feats)) smoothed P(feature | class)"""
+        cols = feats % self.n_features
+        return (self.counts[:, cols] + ALPHA) / (self.totals[:, None] + ALPHA * self.n_features)
+
+    def background_probs(self, feats: np.ndarray) -> np.ndarray:
+        """(len(feats),) P(feature) over all classes, the backoff for classes this model never saw"""
+        cols = feats % self.n_features
+        return (self.counts[:, cols].sum(axis=0) + ALPHA) / (self.totals.sum() + ALPHA * self.n_features)
+
+    def knows(self, feats: np.ndarray) -> bool:
+        return bool(len(self.labels)) and bool(self.counts[:, feats % self.n_features].any())
+
+    def to_bytes(self) -> bytes:
+        buf = io.BytesIO()
+        np.savez_compressed(buf, labels=np.array(self.labels, dtype=str), counts=self.counts,
+                            totals=self.totals, docs=self.docs,
+                            meta=np.array([self.n_features, self.trained_through]))
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "CategoryModel":
+        """Raises ValueError for a blob that needs unpickling (labels saved as an object array)"""
+        data = np.load(io.BytesIO(blob), allow_pickle=False)
+        model = cls(int(data["meta"][0]))
+        model.trained_through = int(data["meta"][1])
+        model.labels = [str(l) for l in data["labels"]]
+        model.index = {l.lower(): i for i, l in enumerate(model.labels)}
+        model.counts, model.totals, model.docs = data["counts"], data["totals"], data["docs"]
+        return model
+
+def predict(global_model: CategoryModel, user_model: Optional[CategoryModel],
+            feats: np.ndarray) -> Tuple[Optional[str], float]:
+    """(label, posterior) from the interpolated models; (None, 0.0) when no feature was seen in training"""
+    if not (global_model.knows(feats) or (user_model is not None and user_model.knows(feats))):
+        return None, 0.0
+    labels = list(global_model.labels)
+    index = dict(global_model.index)
+    if user_model is not None:
+        for label in user_model.labels:
+            if label.lower() not in index:
+                index[label.lower()] = len(labels)
+                labels.append(label)
+    if not labels:
+        return None, 0.0
+
+    # Classes a model has never seen fall back to its class-independent feature distribution
+    def expand(model: CategoryModel):
+        probs = np.full((len(labels), len(feats)), 1.0 / model.n_features)
+        prior = np.full(len(labels), 1.0 / len(labels))
+        if model.labels:
+            probs[:] = model.background_probs(feats)
+            rows = [index[l.lower()] for l in model.labels]
+            probs[rows] = model.feature_probs(feats)
+            prior = np.full(len(labels), 0.5 / (model.n_docs + 0.5 * len(labels)))
+            prior[rows] = (model.docs + 0.5) / (model.n_docs + 0.5 * len(labels))
+        return probs, prior
+
+    probs, prior = expand(global_model)
+    if user_model is not None and user_model.labels:
+        weight = user_model.n_docs / (user_model.n_docs + USER_HALF_WEIGHT_DOCS)
+        user_probs, user_prior = expand(user_model)
+        probs = (1 - weight) * probs + weight * user_probs
+        prior = (1 - weight) * prior + weight * user_prior
+    scores = np.log(prior / prior.sum()) + np.log(probs).sum(axis=1)
+    scores -= scores.max()
+    posterior = np.exp(scores)
+    posterior /= posterior.sum()
+    best = int(posterior.argmax())
+    return labels[best], float(posterior[best])
+
+def cached_model(scope: str) -> Optional[CategoryModel]:
+    with _lock:
+        model = _cache.get(scope)
+        if model is not None:
+            _stats["hits"] += 1
+            _cache.move_to_end(scope)
+        else:
+            _stats["misses"] += 1
+        return model
+
+def cache_model(scope: str, model: CategoryModel) -> CategoryModel:
+    with _lock:
+        _cache[scope] = model
+        _cache.move_to_end(scope)
+        while len(_cache) > MODEL_CACHE_SIZE:
+            oldest = next(iter(_cache))
+            if oldest == "global":
+                _cache.move_to_end(oldest)
+                oldest = next(iter(_cache))
+            del _cache[oldest]
+    return model
+
+def cached_users() -> List[str]:
+    with _lock:
+        return [scope for scope in _cache if scope != "global"]
+
+def cache_stats() -> dict:
+    with _lock:
+        return {"entries": len(_cache), **_stats}
+
+def lock() -> threading.RLock:
+    """Held while folding rows into or reading from the cached models"""
+    return _lock
@@ -58,7 +58,7 @@ def chat():
 
     elif llm_json.get("action") == "save":
         try:
-            sql, params, table = build_sql_and_params(user_id, message, llm_json)
+            sql, params, table = build_sql_and_params(user_id, message, llm_json, cur)
             
             # Special handling for expenses - check asset balance before saving
             if table == "expenses" and llm_json.get("intent") == "record_expense":
@@ -0,0 +1,152 @@
+# Monte Carlo cash-flow and net-worth forecasting.
+# Every simulation path is a row of a (paths, months) NumPy array, so thousands of
+# paths over several years are a handful of vectorized operations.
+
+import datetime, threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from payoff_planner import monthly_minimum_cents, add_months
+
+PERCENTILES = (5, 25, 50, 75, 95)
+DEFAULT_PATHS = 2000
+MAX_PATHS = 10000
+MAX_MONTHS = 60
+DEFAULT_EXPENSE_CV = 0.25  # assumed volatility when there is too little spending history
+FORECAST_CACHE_SIZE = 256
+
+# Recurring income rows converted to a monthly amount
+INCOME_PER_MONTH = {
+    "weekly": 52 / 12,
+    "biweekly": 26 / 12,
+    "monthly": 1.0,
+    "quarterly": 1 / 3,
+    "yearly": 1 / 12,
+    "annually": 1 / 12,
+}
+
+_cache = OrderedDict()
+_stats = {"hits": 0, "misses": 0}
+_cache_lock = threading.Lock()
+
+def liability_outflows(liabilities: List[dict], months: int, start: datetime.date):
+    """Deterministic (months,) installment outflow and (months,) interest cost in cents"""
+    payments = np.zeros(months)
+    interest = np.zeros(months)
+    month_index = np.arange(months)
+    for l in liabilities:
+        remaining = float(l["remaining_amount_cents"] or 0)
+        if remaining <= 0:
+            continue
+        if (l.get("frequency") or "").lower() == "one-time":
+            due = l.get("next_due_date") or start.isoformat()
+            offset = max(0, (int(due[:4]) - start.year) * 12 + int(due[5:7]) - start.month)
+            if offset < months:
+                payments[offset] += remaining
+            continue
+        minimum = monthly_minimum_cents(l["installment_amount_cents"], l.get("frequency"), remaining)
+        rate = float(l.get("interest_rate") or 0.0) / 100.0 / 12.0
+        if minimum <= 0:
+            interest += remaining * rate
+            continue
+        # Balance drawn down by the installment (interest shown separately as a cost)
+        opening = np.clip(remaining - minimum * month_index, 0, None)
+        payments += np.minimum(opening, minimum)
+        interest += opening * rate
+    return payments, interest
+
+def expense_distribution(monthly_totals: List[int]):
+    """Mean and standard deviation of monthly spending in cents"""
+    history = np.array(monthly_totals, dtype=float)
+    if history.size == 0:
+        return 0.0, 0.0
+    mean = float(history.mean())
+    std = float(history.std(ddof=1)) if history.size >= 3 else mean * DEFAULT_EXPENSE_CV
+    return mean, std
+
+def simulate(inputs: dict, months: int = 12, paths: int = DEFAULT_PATHS, seed: Optional[int] = None,
+             start: Optional[datetime.date] = None) -> dict:
+    """
+    Project liquid cash and net worth month by month.
+    inputs: liquid_assets_cents, total_assets_cents, total_liabilities_cents, monthly_income_cents,
+            expense_history (list of monthly spending totals in cents), liabilities (active rows)
+    """
+    start = start or datetime.date.today()
+    months = max(1, min(MAX_MONTHS, int(months)))
+    paths = max(100, min(MAX_PATHS, int(paths)))
+    rng = np.random.default_rng(seed)
+
+    income = float(inputs["monthly_income_cents"])
+    mean, std = expense_distribution(inputs["expense_history"])
+    if mean > 0 and std > 0:
+        # Lognormal keeps spending positive while matching the historical mean and variance
+        sigma2 = np.log1p((std / mean) ** 2)
+        expenses = rng.lognormal(np.log(mean) - sigma2 / 2, np.sqrt(sigma2), size=(paths, months))
+    else:
+        expenses = np.full((paths, months), mean)
+
+    debt_payments, debt_interest = liability_outflows(inputs["liabilities"], months, start)
+
+    cash = inputs["liquid_assets_cents"] + np.cumsum(income - expenses - debt_payments, axis=1)
+    net_worth = (inputs["total_assets_cents"] - inputs["total_liabilities_cents"]
+                 + np.cumsum(income - expenses - debt_interest, axis=1))
+
+    labels = [add_months(start, m + 1) for m in range(months)]
+    cash_bands = np.percentile(cash, PERCENTILES, axis=0) / 100
+    worth_bands = np.percentile(net_worth, PERCENTILES, axis=0) / 100
+    shortfall = (np.minimum.accumulate(cash, axis=1) < 0).mean(axis=0)
+
+    return {
+        "months": labels,
+        "paths": paths,
+        "assumptions": {
+            "monthly_income": income / 100,
+            "mean_monthly_expenses": round(mean / 100, 2),
+            "expense_std_dev": round(std / 100, 2),
+            "expense_history_months": len(inputs["expense_history"]),
+            "debt_payments": (np.round(debt_payments) / 100).tolist(),
+        },
+        "cash": {f"p{p}": np.round(band, 2).tolist() for p, band in zip(PERCENTILES, cash_bands)},
+        "net_worth": {f"p{p}": np.round(band, 2).tolist() for p, band in zip(PERCENTILES, worth_bands)},
+        "probability_cash_shortfall": np.round(shortfall, 4).tolist(),
+        # 1%-resolution quantiles stand in for the raw paths so cached results stay small
+        "_cash_quantiles": np.percentile(cash, np.arange(101), axis=0),
+    }
+
+def probability_of_affording(result: dict, amount_cents: float, month: str) -> Optional[float]:
+    """Share of paths whose cash in `month` (YYYY-MM) covers amount_cents"""
+    if month not in result["months"]:
+        return None
+    quantiles = result["_cash_quantiles"][:, result["months"].index(month)]
+    # Invert the empirical CDF: the share of paths below amount_cents, then its complement
+    below = np.interp(amount_cents, quantiles, np.arange(101) / 100, left=0.0, right=1.0)
+    return round(1.0 - float(below), 4)
+
+def cached_simulation(key: tuple, inputs_loader, **kwargs) -> dict:
+    """simulate() memoized on a key that includes the user's data version"""
+    with _cache_lock:
+        if key in _cache:
+            _stats["hits"] += 1
+            _cache.move_to_end(key)
+            return _cache[key]
+        _stats["misses"] += 1
+    result = simulate(inputs_loader(), **kwargs)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > FORECAST_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+def cached_result(key: tuple) -> Optional[dict]:
+    """The memoized simulation for key, or None; never runs one"""
+    with _cache_lock:
+        return _cache.get(key)
+
+def cache_stats() -> dict:
+    with _cache_lock:
+        return {"entries": len(_cache), **_stats}
+
+def public_view(result: dict) -> dict:
+    return {k: v for k, v in result.items() if not k.startswith("_")}
@@ -0,0 +1,48 @@
+# gunicorn settings for wsgi:app; each one can be overridden from the environment.
+#   gunicorn -c gunicorn.conf.py wsgi:app
+# Workers are processes and each runs GUNICORN_THREADS request threads (gthread): the
+# threads cover requests waiting on the LLM or SQLite, the processes cover CPU-bound work.
+# On SIGTERM a worker stops accepting connections, finishes in-flight requests for up to
+# graceful_timeout seconds, then lets a running scheduled job finish before it exits.
+
+import gc, os, shutil, tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", str((os.cpu_count() or 1) * 2 + 1)))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))  # chat requests wait on the LLM
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+accesslog = os.getenv("GUNICORN_ACCESS_LOG")  # e.g. "-" for stdout; off by default
+errorlog = os.getenv("GUNICORN_ERROR_LOG", "-")
+
+# Workers share metrics through files here so /metrics reports the sum over all of them.
+# Set before the app is imported; a fresh directory per master so old runs do not count.
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), f"finance-metrics-{os.getpid()}"))
+# gunicorn is the production server: /metrics needs METRICS_TOKEN unless it is bound privately
+os.environ.setdefault("METRICS_PUBLIC", "0")
+# Every worker starts its own password hashing pool; share the CPUs out instead of giving
+# each worker min(4, CPUs) processes (scrypt needs about 32 MiB per running hash)
+os.environ.setdefault("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 1) // workers)))
+
+def on_starting(server):
+    shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+
+def on_exit(server):
+    shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
+
+def when_ready(server):
+    # The preloaded app is shared by every worker; keep the collector from touching
+    # (and so copying) its pages after the fork
+    if server.cfg.preload_app:
+        gc.freeze()
+
+def post_worker_init(worker):
+    import wsgi
+    wsgi.warm_up()
+
+def worker_exit(server, worker):
+    import wsgi
+    wsgi.drain(graceful_timeout)
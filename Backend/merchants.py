@@ -0,0 +1,66 @@
+# Merchant name normalization. Free-text merchants ("CHIPOTLE 1234", "Sq *Blue Bottle",
+# "chipotle mexican grill") are reduced to a normalized key; app.py maps keys to canonical
+# merchant ids through the merchant_aliases table. Alias rows never change once written,
+# so the alias -> id cache below needs no invalidation and is shared by all users; app.py
+# only adds committed aliases to it.
+
+import re, threading
+from collections import OrderedDict
+from typing import List, Optional
+
+ALIAS_CACHE_SIZE = 50000
+MIN_PREFIX_CHARS = 4  # shortest word prefix that may stand for a longer merchant name
+MIN_PREFIX_WORDS = 2  # and its fewest words: "home" must not swallow "home depot"
+
+# Card processor and POS prefixes that precede the real merchant name
+PROCESSOR_PREFIXES = re.compile(
+    r"^(?:(?:sq|tst|sp|pp|paypal|pos|dd|py|in)\s*\*\s*|(?:pos|debit card|card)\s+(?:purchase|payment)\s+|pos\s+)")
+
+# Words that never distinguish one merchant from another
+NOISE_WORDS = {"inc", "llc", "ltd", "co", "corp", "the", "store", "stores", "purchase", "payment", "www", "com"}
+
+_cache = OrderedDict()
+_stats = {"hits": 0, "misses": 0}
+_cache_lock = threading.Lock()
+
+def _words(name: Optional[str]) -> List[str]:
+    text = PROCESSOR_PREFIXES.sub("", (name or "").lower().strip())
+    return [w for w in re.findall(r"[a-z]+(?:'[a-z]+)?", text) if w not in NOISE_WORDS]
+
+def normalize(name: Optional[str]) -> str:
+    """Lowercase, processor-prefix-free, digit-free key: "SQ *BLUE BOTTLE #12" -> "blue bottle" """
+    return " ".join(w.replace("'", "") for w in _words(name))
+
+def display_name(name: str) -> str:
+    """Canonical display spelling for a new merchant: "TST* JOE'S PIZZA 44" -> "Joe's Pizza" """
+    return " ".join(w.capitalize() for w in _words(name))
+
+def may_prefix(key: str) -> bool:
+    """Whether key is specific enough to stand for a longer merchant name that starts with it"""
+    return len(key) >= MIN_PREFIX_CHARS and len(key.split()) >= MIN_PREFIX_WORDS
+
+def prefixes(key: str) -> List[str]:
+    """Shorter word prefixes of a key, longest first, that may name the same merchant"""
+    words = key.split()
+    return [p for p in (" ".join(words[:n]) for n in range(len(words) - 1, 0, -1)) if may_prefix(p)]
+
+def cached(key: str) -> Optional[int]:
+    with _cache_lock:
+        merchant_id = _cache.get(key)
+        if merchant_id is not None:
+            _stats["hits"] += 1
+            _cache.move_to_end(key)
+        else:
+            _stats["misses"] += 1
+        return merchant_id
+
+def remember(key: str, merchant_id: int) -> None:
+    with _cache_lock:
+        _cache[key] = merchant_id
+        _cache.move_to_end(key)
+        while len(_cache) > ALIAS_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def cache_stats() -> dict:
+    with _cache_lock:
+        return {"entries": len(_cache), **_stats}
@@ -0,0 +1,235 @@
+# In-process metrics rendered in the Prometheus text exposition format (GET /metrics).
+# Recording is one dict update under a per-metric lock, so instrumenting a hot path costs
+# about a microsecond. Under gunicorn every worker records its own values; with METRICS_DIR
+# set, each worker also writes them to METRICS_DIR/<pid>.json every FLUSH_SECONDS and
+# render() sums every worker's file, keeping the counters of workers that have exited but
+# dropping their gauges.
+
+import bisect, json, math, os, threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+METRICS_DIR = os.getenv("METRICS_DIR")
+FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+
+_registry: List["Metric"] = []
+_collectors: List[Callable[[], None]] = []
+_flusher = [None]
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def labels(self, **labels) -> "Bound":
+        """This metric with its labels resolved once, for hot paths"""
+        return Bound(self, self._key(labels))
+
+    def samples(self) -> Dict[tuple, object]:
+        with self._lock:
+            return {k: (list(v) if isinstance(v, list) else v) for k, v in self._values.items()}
+
+class Bound:
+    __slots__ = ("metric", "key")
+
+    def __init__(self, metric: Metric, key: tuple):
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.metric._add(self.key, amount)
+
+    def observe(self, value: float) -> None:
+        self.metric._observe(self.key, value)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _add(self, key: tuple, amount: float) -> None:
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        self._add(self._key(labels), amount)
+
+    def set(self, value: float, **labels) -> None:
+        """Mirror a monotonic count that is kept elsewhere (e.g. a module's cache hits)"""
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _add(self, key: tuple, amount: float) -> None:
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        self._add(self._key(labels), amount)
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        self._observe(self._key(labels), value)
+
+    def _observe(self, key: tuple, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                # Per-bucket (not cumulative) counts, one overflow bucket, then the sum
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+def reset() -> None:
+    """Drop recorded values, e.g. those a worker inherited from the preloading master"""
+    for m in _registry:
+        with m._lock:
+            m._values.clear()
+
+def collector(fn: Callable[[], None]) -> Callable[[], None]:
+    """Register fn() to update gauges/counters from elsewhere right before each render or flush"""
+    _collectors.append(fn)
+    return fn
+
+def _collect() -> None:
+    for fn in _collectors:
+        fn()
+
+def snapshot(include_gauges: bool = True) -> dict:
+    _collect()
+    return {m.name: {"kind": m.kind, "help": m.help, "labelnames": list(m.labelnames),
+                     "buckets": list(getattr(m, "buckets", ())),
+                     "values": [[list(k), v] for k, v in m.samples().items()]}
+            for m in _registry if include_gauges or m.kind != "gauge"}
+
+def _merge(into: dict, snap: dict) -> None:
+    for name, family in snap.items():
+        target = into.setdefault(name, {**family, "values": {}})
+        for labels, value in family["values"]:
+            key = tuple(labels)
+            current = target["values"].get(key)
+            if current is None:
+                target["values"][key] = value
+            elif isinstance(value, list):
+                target["values"][key] = [a + b for a, b in zip(current, value)]
+            else:
+                target["values"][key] = current + value
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if not math.isfinite(value):
+        return "NaN" if math.isnan(value) else ("+Inf" if value > 0 else "-Inf")
+    return str(int(value)) if value == int(value) else repr(float(value))
+
+def render() -> str:
+    """All metrics (summed over workers when METRICS_DIR is set) in text exposition format"""
+    families: dict = {}
+    _merge(families, snapshot())
+    if METRICS_DIR and os.path.isdir(METRICS_DIR):
+        for filename in os.listdir(METRICS_DIR):
+            pid = int(filename.split(".")[0]) if filename.split(".")[0].isdigit() else None
+            if pid is None or pid == os.getpid() or not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, filename)) as f:
+                    snap = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not _pid_alive(pid):
+                snap = {n: fam for n, fam in snap.items() if fam["kind"] != "gauge"}
+            _merge(families, snap)
+
+    lines = []
+    for name, family in families.items():
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['kind']}")
+        names = family["labelnames"]
+        for key, value in sorted(family["values"].items()):
+            if family["kind"] != "histogram":
+                lines.append(f"{name}{_labels(names, key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(family["buckets"], value):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(names, key, ('le', _number(bound)))} {cumulative}")
+            cumulative += value[len(family["buckets"])]
+            lines.append(f"{name}_bucket{_labels(names, key, ('le', '+Inf'))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(names, key)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(names, key)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+def flush(include_gauges: bool = True) -> None:
+    """Write this process's values to METRICS_DIR/<pid>.json (atomically)"""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot(include_gauges), f)
+    os.replace(path + ".tmp", path)
+
+def _flush_loop(stop: threading.Event) -> None:
+    while not stop.wait(FLUSH_SECONDS):
+        try:
+            flush()
+        except OSError:
+            pass
+
+def start_flusher() -> None:
+    """Flush every FLUSH_SECONDS from a daemon thread; call once per worker, after the fork"""
+    if METRICS_DIR and _flusher[0] is None:
+        stop = threading.Event()
+        threading.Thread(target=_flush_loop, args=(stop,), name="metrics-flush", daemon=True).start()
+        _flusher[0] = stop
+
+def stop_flusher() -> None:
+    """Final flush for an exiting worker: its counters live on, its gauges do not"""
+    if _flusher[0] is not None:
+        _flusher[0].set()
+        _flusher[0] = None
+    if METRICS_DIR:
+        flush(include_gauges=False)
@@ -0,0 +1,83 @@
+# Password hashing off the request threads. Werkzeug's KDFs are deliberately CPU-heavy; scrypt
+# releases the GIL, but a burst of logins still queues unbounded CPU work in the worker.
+# Hashes run in a small process pool instead, which spreads them over the machine's cores,
+# and at most QUEUE_DEPTH may be pending per server process: anything beyond that is refused
+# with HashingBusy rather than queued.
+# The KDF and its cost come from PASSWORD_HASH_METHOD (any Werkzeug method string); stored
+# hashes made with another method are upgraded on the next successful login.
+
+import multiprocessing, os, threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from typing import Optional
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))  # 0 hashes inline
+QUEUE_DEPTH = int(os.getenv("PASSWORD_HASH_QUEUE_DEPTH", "32"))
+TIMEOUT_SECONDS = float(os.getenv("PASSWORD_HASH_TIMEOUT_SECONDS", "10"))
+
+class HashingBusy(Exception):
+    """Too many hashes are already pending in this process"""
+
+_pool = [None]
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(QUEUE_DEPTH)
+_method_prefix = [None]
+
+def _executor() -> Optional[ProcessPoolExecutor]:
+    if WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool[0] is None:
+            # forkserver: workers never inherit the request or scheduler threads of this process
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            _pool[0] = ProcessPoolExecutor(WORKERS, mp_context=context)
+        return _pool[0]
+
+def _run(fn, *args):
+    pool = _executor()
+    if pool is None:
+        return fn(*args)
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        future = pool.submit(fn, *args)
+    except Exception:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=TIMEOUT_SECONDS)
+    except TimeoutError:
+        future.cancel()
+        raise HashingBusy()
+
+def _hash(password: str, method: str) -> str:
+    return generate_password_hash(password, method)
+
+def hash_password(password: str) -> str:
+    return _run(_hash, password, HASH_METHOD)
+
+def verify_password(pwhash: str, password: str) -> bool:
+    return bool(pwhash) and _run(check_password_hash, pwhash, password)
+
+def needs_rehash(pwhash: str) -> bool:
+    """True if the stored hash was made with a method or cost other than HASH_METHOD"""
+    if _method_prefix[0] is None:
+        # "scrypt" and "scrypt:32768:8:1" store the same prefix; let Werkzeug expand it once
+        _method_prefix[0] = _run(_hash, "", HASH_METHOD).split("$", 1)[0]
+    return pwhash.split("$", 1)[0] != _method_prefix[0]
+
+def warm_up() -> None:
+    """Start the pool's first worker now instead of on the first login"""
+    pool = _executor()
+    if pool is not None:
+        pool.submit(os.getpid).result(timeout=TIMEOUT_SECONDS)
+
+def shutdown() -> None:
+    with _pool_lock:
+        if _pool[0] is not None:
+            _pool[0].shutdown(wait=False, cancel_futures=True)
+            _pool[0] = None
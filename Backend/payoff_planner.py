@@ -0,0 +1,147 @@
+# Debt payoff planning: simulates avalanche, snowball and priority-weighted (hybrid)
+# strategies month by month across all active liabilities.
+#
+# All strategies and debts are simulated at once as (strategy, debt) NumPy arrays, so
+# the only Python loop is over months and it stops as soon as every debt is paid off.
+
+import datetime
+from typing import List, Optional
+
+import numpy as np
+
+STRATEGIES = ("avalanche", "snowball", "hybrid")
+MAX_HORIZON_MONTHS = 360
+
+# How many installments of each frequency fall in an average month
+INSTALLMENTS_PER_MONTH = {
+    "weekly": 52 / 12,
+    "biweekly": 26 / 12,
+    "monthly": 1.0,
+    "quarterly": 1 / 3,
+    "yearly": 1 / 12,
+    "annually": 1 / 12,
+}
+
+def monthly_minimum_cents(installment_cents: int, frequency: Optional[str], remaining_cents: int) -> float:
+    """Installment normalized to a monthly amount; one-time bills are due in full"""
+    freq = (frequency or "monthly").lower()
+    if freq == "one-time":
+        return float(remaining_cents)
+    return installment_cents * INSTALLMENTS_PER_MONTH.get(freq, 1.0)
+
+def strategy_orders(balances: np.ndarray, rates: np.ndarray, priorities: np.ndarray) -> np.ndarray:
+    """Payment order (debt indices, first paid first) for each strategy, shape (S, D)"""
+    idx = np.arange(len(balances))
+    avalanche = np.lexsort((balances, -rates))          # highest APR first, smaller balance breaks ties
+    snowball = np.lexsort((-rates, balances))           # smallest balance first
+    max_rate = rates.max() if rates.max() > 0 else 1.0
+    hybrid_score = 0.5 * priorities / 100.0 + 0.5 * rates / max_rate
+    hybrid = np.lexsort((idx, -hybrid_score))           # user priority blended with APR
+    return np.vstack([avalanche, snowball, hybrid])
+
+def allocate_in_order(amounts: np.ndarray, budget: np.ndarray, orders: np.ndarray) -> np.ndarray:
+    """Greedily spend budget (S,) over amounts (S, D) following orders (S, D)"""
+    ordered = np.take_along_axis(amounts, orders, axis=1)
+    spent_before = np.cumsum(ordered, axis=1) - ordered
+    paid_ordered = np.clip(budget[:, None] - spent_before, 0, ordered)
+    paid = np.empty_like(paid_ordered)
+    np.put_along_axis(paid, orders, paid_ordered, axis=1)
+    return paid
+
+def add_months(start: datetime.date, months: int) -> str:
+    month_index = start.month - 1 + months
+    return f"{start.year + month_index // 12:04d}-{month_index % 12 + 1:02d}"
+
+def plan_payoff(liabilities: List[dict], monthly_budget_cents: float,
+                start: Optional[datetime.date] = None, horizon_months: int = MAX_HORIZON_MONTHS) -> dict:
+    """
+    Simulate every strategy and pick the one with the least total interest.
+    liabilities: dicts with id, liability_type, remaining_amount_cents, installment_amount_cents,
+                 frequency, interest_rate (annual %), priority_score
+    monthly_budget_cents: total amount available for debt payments each month
+    """
+    start = start or datetime.date.today()
+    if not liabilities:
+        return {"strategies": {}, "recommended_strategy": None, "monthly_budget": monthly_budget_cents / 100,
+                "minimum_payments": 0.0, "budget_shortfall": 0.0}
+
+    ids = [l["id"] for l in liabilities]
+    balances0 = np.array([l["remaining_amount_cents"] for l in liabilities], dtype=float)
+    rates = np.array([float(l.get("interest_rate") or 0.0) for l in liabilities]) / 100.0 / 12.0
+    priorities = np.array([float(l.get("priority_score") or 50) for l in liabilities])
+    minimums = np.array([monthly_minimum_cents(l["installment_amount_cents"], l.get("frequency"),
+                                               l["remaining_amount_cents"]) for l in liabilities])
+
+    orders = strategy_orders(balances0, rates, priorities)
+    n_strategies, n_debts = orders.shape
+    balances = np.tile(balances0, (n_strategies, 1))
+    budget = np.full(n_strategies, float(monthly_budget_cents))
+
+    interest_per_debt = np.zeros((n_strategies, n_debts))
+    paid_per_debt = np.zeros((n_strategies, n_debts))
+    payoff_month = np.full((n_strategies, n_debts), -1, dtype=int)
+    payoff_month[:, balances0 <= 0] = 0
+    first_month_payment = None
+
+    for month in range(horizon_months):
+        active = balances > 0.5
+        if not active.any():
+            break
+
+        interest = balances * rates
+        balances += interest
+        interest_per_debt += interest
+
+        # Minimums first (in strategy order if the budget cannot cover them), then extra
+        required = np.minimum(minimums, balances) * active
+        pay = allocate_in_order(required, budget, orders)
+        extra = budget - pay.sum(axis=1)
+        pay += allocate_in_order(balances - pay, extra, orders)
+
+        balances -= pay
+        paid_per_debt += pay
+        if first_month_payment is None:
+            first_month_payment = pay.copy()
+
+        newly_paid = active & (balances <= 0.5)
+        payoff_month[newly_paid] = month + 1
+        balances[balances <= 0.5] = 0.0
+
+    total_minimums = float(minimums[balances0 > 0].sum())
+    strategies = {}
+    for s, name in enumerate(STRATEGIES):
+        debt_free = bool((payoff_month[s] >= 0).all())
+        months_to_free = int(payoff_month[s].max()) if debt_free else None
+        strategies[name] = {
+            "total_interest": round(float(interest_per_debt[s].sum()) / 100, 2),
+            "total_paid": round(float(paid_per_debt[s].sum()) / 100, 2),
+            "months_to_debt_free": months_to_free,
+            "debt_free_date": add_months(start, months_to_free) if debt_free else None,
+            "payment_order": [ids[i] for i in orders[s].tolist()],
+            "debts": [{
+                "liability_id": ids[i],
+                "liability_type": liabilities[i].get("liability_type"),
+                "payoff_date": add_months(start, int(payoff_month[s, i])) if payoff_month[s, i] >= 0 else None,
+                "months_to_payoff": int(payoff_month[s, i]) if payoff_month[s, i] >= 0 else None,
+                "total_interest": round(float(interest_per_debt[s, i]) / 100, 2),
+            } for i in range(n_debts)],
+            "current_month_allocation": [{
+                "liability_id": ids[i],
+                "liability_type": liabilities[i].get("liability_type"),
+                "amount": round(float(first_month_payment[s, i]) / 100, 2) if first_month_payment is not None else 0.0,
+            } for i in orders[s].tolist()],
+        }
+
+    # Least interest wins; debts that never finish within the horizon rank last
+    def rank(name):
+        plan = strategies[name]
+        return (plan["months_to_debt_free"] is None, plan["total_interest"], plan["months_to_debt_free"] or 0)
+    recommended = min(STRATEGIES, key=rank)
+
+    return {
+        "strategies": strategies,
+        "recommended_strategy": recommended,
+        "monthly_budget": round(monthly_budget_cents / 100, 2),
+        "minimum_payments": round(total_minimums / 100, 2),
+        "budget_shortfall": round(max(0.0, total_minimums - monthly_budget_cents) / 100, 2),
+    }
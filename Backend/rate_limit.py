@@ -0,0 +1,45 @@
+# Token-bucket rate limits for the auth endpoints. Each key ("ip:1.2.3.4", "email:a@b.c")
+# gets a bucket of `burst` tokens refilled at `per_minute`; a request takes one token or
+# is told how long to wait. Buckets live in memory per server process, least recently used
+# buckets are dropped past MAX_KEYS (a dropped bucket simply starts full again).
+
+import os, threading, time
+from collections import OrderedDict
+from typing import Optional
+
+MAX_KEYS = 100000
+
+class RateLimiter:
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60.0
+        self.burst = float(burst)
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, now: Optional[float] = None) -> float:
+        """Take one token; returns 0 if allowed, else the seconds until a token is available"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > MAX_KEYS:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+def from_env(name: str, per_minute: float, burst: int) -> RateLimiter:
+    """RateLimiter configured by {name}_PER_MINUTE / {name}_BURST; a rate of 0 disables it"""
+    return RateLimiter(float(os.getenv(f"{name}_PER_MINUTE", str(per_minute))),
+                       int(os.getenv(f"{name}_BURST", str(burst))))
@@ -0,0 +1,110 @@
+# In-process background job scheduler backed by the scheduled_jobs table.
+# Each job is claimed with a conditional UPDATE before it runs, so several worker
+# processes can share one database without running the same job twice, and a
+# restart picks up the persisted next_run_at instead of firing everything at once.
+
+import threading, time, traceback
+from typing import Callable, Dict
+
+TICK_SECONDS = 15
+LEASE_SECONDS = 300  # a claimed job is considered abandoned after this long
+
+_jobs: Dict[str, dict] = {}
+_started = [False]
+_start_lock = threading.Lock()
+_stop = threading.Event()
+_thread = [None]
+
+def register(name: str, interval_seconds: int, fn: Callable) -> None:
+    """Register fn(cursor) to run every interval_seconds; a non-positive interval disables it"""
+    _jobs[name] = {"interval": int(interval_seconds), "fn": fn}
+
+def registered_jobs() -> Dict[str, dict]:
+    return dict(_jobs)
+
+def ensure_jobs(cursor) -> None:
+    """Create rows for newly registered jobs and keep intervals in sync with the code"""
+    now = int(time.time())
+    for name, job in _jobs.items():
+        cursor.execute("""
+            INSERT INTO scheduled_jobs (name, interval_seconds, next_run_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET interval_seconds = excluded.interval_seconds
+        """, (name, job["interval"], now))
+
+def claim(cursor, name: str, now: int) -> bool:
+    cursor.execute("""
+        UPDATE scheduled_jobs SET locked_until = ?
+        WHERE name = ? AND interval_seconds > 0 AND next_run_at <= ?
+          AND (locked_until IS NULL OR locked_until < ?)
+    """, (now + LEASE_SECONDS, name, now, now))
+    return cursor.rowcount == 1
+
+def run_job(conn, name: str) -> dict:
+    """Run one job in its own transaction and record the outcome; returns the job's result"""
+    job = _jobs[name]
+    cur = conn.cursor()
+    started = time.time()
+    try:
+        result = job["fn"](cur) or {}
+        status, error = "ok", None
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        result, status, error = {}, "failed", f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    finished = int(time.time())
+    cur.execute("""
+        UPDATE scheduled_jobs
+        SET next_run_at = ?, locked_until = NULL, last_run_at = ?, last_status = ?,
+            last_error = ?, last_duration_ms = ?
+        WHERE name = ?
+    """, (finished + max(job["interval"], 1), finished, status, error, int((time.time() - started) * 1000), name))
+    conn.commit()
+    return result
+
+def run_due_jobs(connect: Callable) -> list:
+    """Run every job whose next_run_at has passed; returns the names that ran"""
+    ran = []
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        ensure_jobs(cur)
+        conn.commit()
+        now = int(time.time())
+        for name in _jobs:
+            if _stop.is_set():
+                break
+            claimed = claim(cur, name, now)
+            conn.commit()
+            if claimed:
+                run_job(conn, name)
+                ran.append(name)
+    finally:
+        conn.close()
+    return ran
+
+def _loop(connect: Callable) -> None:
+    while not _stop.is_set():
+        try:
+            run_due_jobs(connect)
+        except Exception:
+            traceback.print_exc()
+        _stop.wait(TICK_SECONDS)
+
+def start(connect: Callable) -> bool:
+    """Start the scheduler thread once per process; returns False if it was already running"""
+    with _start_lock:
+        if _started[0]:
+            return False
+        _started[0] = True
+        _stop.clear()
+    _thread[0] = threading.Thread(target=_loop, args=(connect,), name="scheduler", daemon=True)
+    _thread[0].start()
+    return True
+
+def stop(timeout: float = 0) -> None:
+    """Stop after the running job, if any; waits up to timeout seconds for it to finish"""
+    _stop.set()
+    if timeout and _thread[0] is not None:
+        _thread[0].join(timeout)
@@ -0,0 +1,191 @@
+# Streaming parsers for bank statement uploads (CSV and OFX/QFX).
+# Rows are yielded one at a time so large statements never have to be held
+# in memory; app.py batches them into executemany transactions.
+
+import csv, datetime, hashlib, re
+from typing import Optional, Iterator, Dict
+
+# Header aliases used when the client does not send an explicit column mapping
+COLUMN_ALIASES = {
+    "date": ["date", "posting date", "posted date", "transaction date", "trans date", "booking date", "value date"],
+    "amount": ["amount", "transaction amount", "amt", "value"],
+    "debit": ["debit", "withdrawal", "withdrawals", "money out", "paid out"],
+    "credit": ["credit", "deposit", "deposits", "money in", "paid in"],
+    "description": ["description", "merchant", "payee", "name", "details", "narrative", "memo"],
+    "category": ["category"],
+    "balance": ["balance", "running balance", "available balance"],
+    "reference": ["reference", "ref", "transaction id", "id", "fitid"],
+}
+
+DATE_FORMATS = ["%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y", "%d/%m/%Y", "%d.%m.%Y", "%Y/%m/%d", "%d-%b-%Y", "%b %d, %Y"]
+
+def resolve_columns(headers, mapping: Optional[dict] = None) -> Dict[str, str]:
+    """Map logical fields (date, amount, ...) to the CSV header names"""
+    mapping = dict(mapping or {})
+    normalized = {h.strip().lower(): h for h in headers if h}
+    resolved = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        if mapping.get(field):
+            if mapping[field] not in headers:
+                raise ValueError(f"Mapped column '{mapping[field]}' for {field} not found in file")
+            resolved[field] = mapping[field]
+            continue
+        for alias in aliases:
+            if alias in normalized:
+                resolved[field] = normalized[alias]
+                break
+    if "date" not in resolved:
+        raise ValueError("Could not find a date column. Send a column mapping, e.g. {\"date\": \"Posting Date\"}")
+    if "amount" not in resolved and not ("debit" in resolved or "credit" in resolved):
+        raise ValueError("Could not find an amount (or debit/credit) column. Send a column mapping.")
+    return resolved
+
+def parse_amount_cents(raw) -> Optional[int]:
+    """Parse '$1,234.50', '(12.00)', '-12', '12.00 CR' into signed cents"""
+    if raw is None:
+        return None
+    text = str(raw).strip()
+    if not text:
+        return None
+    negative = False
+    if text.startswith("(") and text.endswith(")"):
+        negative, text = True, text[1:-1]
+    upper = text.upper()
+    if upper.endswith(" DR") or upper.endswith(" CR"):
+        negative = negative or upper.endswith(" DR")
+        text = text[:-3]
+    text = re.sub(r"[^\d.\-]", "", text)
+    if text.startswith("-"):
+        negative, text = not negative, text[1:]
+    if not text or text == ".":
+        return None
+    cents = int(round(float(text) * 100))
+    return -cents if negative else cents
+
+def parse_date(raw, date_format: Optional[str] = None) -> Optional[str]:
+    """Parse a statement date into YYYY-MM-DD"""
+    if not raw:
+        return None
+    text = str(raw).strip()
+    if date_format:
+        return datetime.datetime.strptime(text, date_format).date().isoformat()
+    # OFX style: YYYYMMDD[HHMMSS[.XXX][TZ]]
+    if re.match(r"^\d{8}", text):
+        return datetime.datetime.strptime(text[:8], "%Y%m%d").date().isoformat()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+def normalize_description(text: Optional[str]) -> str:
+    """Collapse whitespace and case so the same merchant hashes identically"""
+    return " ".join((text or "").lower().split())
+
+def content_hash(user_id: str, occurred_at: str, amount_cents: int, description: str, discriminator: str) -> str:
+    """Stable hash of a statement row; discriminator is the bank's id or the row's occurrence index"""
+    key = f"{user_id}|{occurred_at}|{amount_cents}|{normalize_description(description)}|{discriminator}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def iter_csv_rows(text_stream, mapping: Optional[dict] = None, date_format: Optional[str] = None,
+                  negative_is_expense: bool = True) -> Iterator[dict]:
+    """Yield normalized transactions from a CSV text stream"""
+    reader = csv.DictReader(text_stream)
+    if not reader.fieldnames:
+        raise ValueError("CSV file has no header row")
+    columns = resolve_columns(reader.fieldnames, mapping)
+
+    for line_no, row in enumerate(reader, start=2):
+        try:
+            occurred_at = parse_date(row.get(columns["date"]), date_format)
+            if "amount" in columns:
+                amount_cents = parse_amount_cents(row.get(columns["amount"]))
+                if amount_cents is not None and not negative_is_expense:
+                    amount_cents = -amount_cents
+            else:
+                debit = parse_amount_cents(row.get(columns.get("debit"))) or 0
+                credit = parse_amount_cents(row.get(columns.get("credit"))) or 0
+                amount_cents = abs(credit) - abs(debit) if (debit or credit) else None
+        except ValueError as e:
+            yield {"error": f"line {line_no}: {e}"}
+            continue
+
+        if not occurred_at or amount_cents is None:
+            yield {"error": f"line {line_no}: unreadable date or amount"}
+            continue
+        if amount_cents == 0:
+            yield {"error": f"line {line_no}: zero amount"}
+            continue
+
+        balance = row.get(columns["balance"]) if "balance" in columns else None
+        yield {
+            "occurred_at": occurred_at,
+            "amount_cents": amount_cents,
+            "description": (row.get(columns["description"]) or "").strip() if "description" in columns else "",
+            "category": (row.get(columns["category"]) or "").strip() or None if "category" in columns else None,
+            "reference": (row.get(columns["reference"]) or "").strip() or None if "reference" in columns else None,
+            "balance_cents": parse_amount_cents(balance) if balance else None,
+            "source_text": ",".join(str(v) for v in row.values() if v is not None),
+        }
+
+def _iter_ofx_tokens(text_stream, chunk_size: int = 65536) -> Iterator[tuple]:
+    """Tokenize SGML or XML OFX into (TAG, value) pairs without loading the whole file"""
+    buffer = ""
+    while True:
+        chunk = text_stream.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        parts = buffer.split("<")
+        buffer = parts.pop()  # last piece may be incomplete
+        for part in parts:
+            if ">" in part:
+                tag, _, value = part.partition(">")
+                yield tag.strip().upper(), value.strip()
+    if ">" in buffer:
+        tag, _, value = buffer.partition(">")
+        yield tag.strip().upper(), value.strip()
+
+def iter_ofx_rows(text_stream, negative_is_expense: bool = True) -> Iterator[dict]:
+    """Yield normalized transactions from an OFX/QFX stream; the ledger balance is yielded last"""
+    txn = None
+    in_ledger = False
+    ledger = {}
+    for tag, value in _iter_ofx_tokens(text_stream):
+        if tag == "STMTTRN":
+            txn = {}
+        elif tag == "/STMTTRN" and txn is not None:
+            occurred_at = parse_date(txn.get("DTPOSTED"))
+            amount_cents = parse_amount_cents(txn.get("TRNAMT"))
+            if not occurred_at or amount_cents is None:
+                yield {"error": f"transaction {txn.get('FITID') or '?'}: unreadable date or amount"}
+            elif amount_cents == 0:
+                yield {"error": f"transaction {txn.get('FITID') or '?'}: zero amount"}
+            else:
+                if not negative_is_expense:
+                    amount_cents = -amount_cents
+                description = txn.get("NAME") or txn.get("PAYEE") or txn.get("MEMO") or ""
+                yield {
+                    "occurred_at": occurred_at,
+                    "amount_cents": amount_cents,
+                    "description": description,
+                    "category": None,
+                    "reference": txn.get("FITID"),
+                    "balance_cents": None,
+                    "note": txn.get("MEMO") if txn.get("MEMO") != description else None,
+                    "source_text": " ".join(f"{k}={v}" for k, v in txn.items()),
+                }
+            txn = None
+        elif tag == "LEDGERBAL":
+            in_ledger = True
+        elif tag == "/LEDGERBAL":
+            in_ledger = False
+        elif txn is not None and value:
+            txn[tag] = value
+        elif in_ledger and value:
+            ledger[tag] = value
+
+    if ledger.get("BALAMT"):
+        yield {"ledger_balance_cents": parse_amount_cents(ledger["BALAMT"]),
+               "ledger_balance_date": parse_date(ledger.get("DTASOF"))}
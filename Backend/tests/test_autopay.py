@@ -0,0 +1,59 @@
+import datetime, os, sys, tempfile, unittest
+
+_fd, DB_PATH = tempfile.mkstemp(suffix=".db")
+os.close(_fd)
+os.remove(DB_PATH)
+os.environ["DB_PATH"] = DB_PATH
+os.environ.setdefault("SCHEDULER_ENABLED", "0")
+os.environ.setdefault("PASSWORD_HASH_WORKERS", "0")
+os.environ.setdefault("AUTH_RATE_LIMIT_IP_PER_MINUTE", "0")
+os.environ.setdefault("AUTH_RATE_LIMIT_ACCOUNT_PER_MINUTE", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as backend
+
+class FixedAutopayTest(unittest.TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(DB_PATH):
+            os.remove(DB_PATH)
+
+    def setUp(self):
+        self.client = backend.app.test_client()
+        email = f"autopay-{self.id()}@example.com"
+        r = self.client.post("/api/auth/register", json={"name": "Autopay", "email": email, "password": "secret1"})
+        self.headers = {"Authorization": "Bearer " + r.get_json()["access_token"]}
+
+    def test_fixed_amount_below_installment_keeps_paying_each_period(self):
+        """A fixed amount smaller than the installment must still move the due date on"""
+        due = datetime.date.today().isoformat()
+        asset = self.client.post("/api/assets", json={"asset_type": "Checking", "asset_value": 1000,
+                                                      "account": "Checking"}, headers=self.headers).get_json()
+        liability = self.client.post("/api/liabilities", json={
+            "liability_type": "Car Loan", "liability_amount": 1000, "installments_total": 10,
+            "due_date": due, "frequency": "monthly"}, headers=self.headers).get_json()
+        liability_id = liability["liability_id"]
+        r = self.client.put(f"/api/liabilities/{liability_id}/autopay", json={
+            "asset_id": asset["asset_id"], "amount_policy": "fixed", "fixed_amount": 40}, headers=self.headers)
+        self.assertEqual(r.status_code, 200)
+
+        conn = backend.get_conn()
+        try:
+            for _ in range(2):
+                cur = conn.cursor()
+                cur.execute("SELECT next_due_date FROM liabilities WHERE id = ?", (liability_id,))
+                next_due = cur.fetchone()["next_due_date"]
+                summary = backend.run_autopay(conn, today=next_due)
+                self.assertEqual(summary["paid"], 1)
+                cur.execute("SELECT next_due_date FROM liabilities WHERE id = ?", (liability_id,))
+                self.assertGreater(cur.fetchone()["next_due_date"], next_due)
+
+            cur.execute("SELECT remaining_amount_cents, installments_paid FROM liabilities WHERE id = ?", (liability_id,))
+            row = cur.fetchone()
+            self.assertEqual(row["remaining_amount_cents"], 92000)
+            self.assertEqual(row["installments_paid"], 2)
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    unittest.main()
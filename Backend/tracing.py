@@ -0,0 +1,282 @@
+# Request tracing: nested, timed spans with attributes, exported off the request thread.
+# Every request gets a root span and a request ID (the X-Request-ID header when the caller
+# sends a usable one, otherwise the trace ID) that is echoed back on the response; a W3C
+# `traceparent` header joins the caller's trace instead of starting a new one. Spans are
+# always recorded (a few objects per request) and the keep-or-drop decision is made when the
+# root span ends: a trace is exported if its trace ID falls under TRACE_SAMPLE_RATE, the
+# caller's traceparent asked for it, it took at least TRACE_SLOW_MS, or it ended in an error.
+# Kept traces go through a bounded queue to one exporter thread per process:
+#   log   one line per span on the "tracing" logger (stderr unless configured otherwise)
+#   file  one JSON object per trace appended to TRACE_FILE
+#   otlp  OTLP/HTTP JSON batches POSTed to TRACE_OTLP_ENDPOINT (an OpenTelemetry collector,
+#         Jaeger, Tempo, ...), best effort
+#   none  record request IDs only; nothing is exported
+# A full queue drops the trace rather than slowing the request down.
+
+import contextvars, json, logging, os, queue, random, re, threading, time, urllib.request
+from typing import List, Optional
+
+EXPORTER = os.getenv("TRACE_EXPORTER", "log").lower()
+SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "2000"))  # 0 keeps no trace for being slow
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "finance-backend")
+QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "1000"))
+BATCH_SIZE = 64
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+logger = logging.getLogger("tracing")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s trace %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_current = contextvars.ContextVar("trace_span", default=None)
+_queue = queue.Queue(QUEUE_SIZE)
+_exporter = {"pid": None, "thread": None}
+_exporter_lock = threading.Lock()
+_stats = {"exported": 0, "dropped": 0, "failed": 0}
+_stats_lock = threading.Lock()
+
+class Trace:
+    __slots__ = ("trace_id", "request_id", "sampled", "spans")
+
+    def __init__(self, trace_id: str, request_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.request_id = request_id
+        self.sampled = sampled
+        self.spans: List["Span"] = []
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent", "remote_parent_id", "attrs",
+                 "start_time", "started", "duration", "error")
+
+    def __init__(self, trace: Trace, name: str, parent: Optional["Span"], attrs: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = random.getrandbits(64).to_bytes(8, "big").hex()
+        self.parent = parent
+        self.remote_parent_id = None
+        self.attrs = attrs
+        self.start_time = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.error = None
+        trace.spans.append(self)
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        finish_span(self, exc)
+
+    @property
+    def parent_id(self) -> Optional[str]:
+        return self.parent.span_id if self.parent else self.remote_parent_id
+
+    def to_dict(self) -> dict:
+        return {"span_id": self.span_id, "parent_id": self.parent_id, "name": self.name,
+                "start": self.start_time, "duration_ms": round((self.duration or 0.0) * 1000, 3),
+                "error": self.error, "attrs": self.attrs}
+
+class _NoopSpan:
+    """Stands in for a span outside any trace (scripts, CLI commands, scheduler jobs)"""
+    trace = None
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+NOOP = _NoopSpan()
+
+def request_id(header_value: Optional[str], trace_id: str) -> str:
+    """The caller's request ID if it is safe to log and echo, else the trace ID"""
+    if header_value and _REQUEST_ID.match(header_value):
+        return header_value
+    return trace_id
+
+def _sampled(trace_id: str) -> bool:
+    # Decided by the trace ID, so every service sharing a trace makes the same choice
+    return int(trace_id[:16], 16) < SAMPLE_RATE * 2 ** 64
+
+def begin(name: str, request_id_header: Optional[str] = None, traceparent: Optional[str] = None, **attrs) -> Span:
+    """Start a trace and its root span for the work on this thread, e.g. one request"""
+    match = _TRACEPARENT.match(traceparent or "")
+    if match and int(match.group(1), 16):
+        trace_id, parent_id, forced = match.group(1), match.group(2), int(match.group(3), 16) & 1
+    else:
+        trace_id, parent_id, forced = random.getrandbits(128).to_bytes(16, "big").hex(), None, 0
+    trace = Trace(trace_id, request_id(request_id_header, trace_id), bool(forced) or _sampled(trace_id))
+    root = Span(trace, name, None, attrs)
+    root.remote_parent_id = parent_id
+    _current.set(root)
+    return root
+
+def end(root: Span, error: Optional[BaseException] = None, **attrs) -> None:
+    """Finish the root span and queue the trace for export if it is kept"""
+    _current.set(None)
+    root.set(**attrs)
+    if error is not None and root.error is None:
+        root.error = type(error).__name__
+    root.duration = time.perf_counter() - root.started
+    trace = root.trace
+    keep = (trace.sampled or root.error is not None
+            or (SLOW_MS > 0 and root.duration * 1000 >= SLOW_MS))
+    if keep and EXPORTER != "none":
+        _submit(trace)
+
+def current() -> "Span | _NoopSpan":
+    return _current.get() or NOOP
+
+def start_span(name: str, **attrs) -> "Span | _NoopSpan":
+    """Open a child of the current span and make it current; close it with finish_span()"""
+    parent = _current.get()
+    if parent is None:
+        return NOOP
+    child = Span(parent.trace, name, parent, attrs)
+    _current.set(child)
+    return child
+
+def finish_span(span: "Span | _NoopSpan", error: Optional[BaseException] = None, **attrs) -> None:
+    if span is NOOP:
+        return
+    span.set(**attrs)
+    if error is not None:
+        span.error = type(error).__name__
+    span.duration = time.perf_counter() - span.started
+    if _current.get() is span:
+        _current.set(span.parent)
+
+def span(name: str, **attrs) -> "Span | _NoopSpan":
+    """`with span("stage", key=value) as s:` times the block as a child of the current span"""
+    return start_span(name, **attrs)
+
+def stats() -> dict:
+    with _stats_lock:
+        return dict(_stats, queued=_queue.qsize())
+
+def _count(key: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[key] += n
+
+# ------------------- Exporters -------------------
+def _export_log(traces: List[Trace]) -> None:
+    for trace in traces:
+        for s in trace.spans:
+            attrs = " ".join(f"{k}={json.dumps(v, default=str)}" for k, v in s.attrs.items())
+            logger.info("trace_id=%s request_id=%s span_id=%s parent_id=%s name=%s duration_ms=%.3f%s%s",
+                        trace.trace_id, trace.request_id, s.span_id, s.parent_id or "-", s.name,
+                        (s.duration or 0.0) * 1000, f" error={s.error}" if s.error else "",
+                        f" {attrs}" if attrs else "")
+
+def _export_file(traces: List[Trace]) -> None:
+    lines = "".join(json.dumps({"trace_id": t.trace_id, "request_id": t.request_id,
+                                "spans": [s.to_dict() for s in t.spans]}, default=str) + "\n"
+                    for t in traces)
+    # One append per batch keeps lines from different workers from interleaving
+    with open(TRACE_FILE, "a") as f:
+        f.write(lines)
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _otlp_span(trace: Trace, s: Span) -> dict:
+    attrs = dict(s.attrs, **{"request.id": trace.request_id})
+    if s.error:
+        attrs["error.type"] = s.error
+    start_ns = int(s.start_time * 1e9)
+    return {
+        "traceId": trace.trace_id,
+        "spanId": s.span_id,
+        "parentSpanId": s.parent_id or "",
+        "name": s.name,
+        "kind": 2 if s.parent is None else 1,  # SERVER for the root, INTERNAL below it
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(start_ns + int((s.duration or 0.0) * 1e9)),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in attrs.items()],
+        "status": {"code": 2} if s.error else {},
+    }
+
+def _export_otlp(traces: List[Trace]) -> None:
+    body = {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "tracing"},
+                        "spans": [_otlp_span(t, s) for t in traces for s in t.spans]}],
+    }]}
+    req = urllib.request.Request(OTLP_ENDPOINT, data=json.dumps(body, default=str).encode(),
+                                 headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(req, timeout=5) as resp:
+        resp.read()
+
+EXPORTERS = {"log": _export_log, "file": _export_file, "otlp": _export_otlp}
+
+def _export_loop(export) -> None:
+    while True:
+        batch = [_queue.get()]
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = None in batch
+        traces = [t for t in batch if t is not None]
+        if traces:
+            try:
+                export(traces)
+                _count("exported", len(traces))
+            except Exception:
+                _count("failed", len(traces))
+        if stop:
+            return
+
+def _ensure_exporter() -> None:
+    # Started lazily and per pid: a thread started in a preloading master does not survive the fork
+    if _exporter["pid"] == os.getpid():
+        return
+    with _exporter_lock:
+        if _exporter["pid"] != os.getpid():
+            thread = threading.Thread(target=_export_loop, args=(EXPORTERS[EXPORTER],),
+                                      name="trace-export", daemon=True)
+            thread.start()
+            _exporter.update(pid=os.getpid(), thread=thread)
+
+def _submit(trace: Trace) -> None:
+    if EXPORTER not in EXPORTERS:
+        return
+    _ensure_exporter()
+    try:
+        _queue.put_nowait(trace)
+    except queue.Full:
+        _count("dropped")
+
+def shutdown(timeout: float = 5.0) -> None:
+    """Export what is queued, waiting up to timeout seconds, and stop the exporter thread"""
+    with _exporter_lock:
+        thread = _exporter["thread"] if _exporter["pid"] == os.getpid() else None
+        _exporter.update(pid=None, thread=None)
+    if thread is not None:
+        try:
+            _queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
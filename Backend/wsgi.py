@@ -0,0 +1,41 @@
+# Production entry point: `gunicorn -c gunicorn.conf.py wsgi:app` (settings in gunicorn.conf.py).
+# Importing this module builds the app and loads what every worker reads but rarely changes,
+# so with preload_app that work happens once in the master and is shared copy-on-write.
+# warm_up() runs in each worker after the fork to start the per-process pools and threads
+# before the first request; drain() runs as the worker exits.
+
+import auth_cache
+import metrics
+import passwords
+import scheduler
+import tracing
+
+import app as backend
+
+app = application = backend.create_app()
+
+def preload() -> None:
+    conn = backend.get_conn()
+    try:
+        backend.global_category_model(conn.cursor())
+    finally:
+        conn.close()
+
+def warm_up() -> None:
+    """Per-worker start: metrics, password hashing pool, revocation mirror and scheduler thread"""
+    metrics.reset()  # counts from the master's preload belong to no worker
+    metrics.start_flusher()
+    passwords.warm_up()
+    passwords.needs_rehash("")  # resolves the configured KDF's hash prefix once
+    auth_cache.sync(backend.fetch_token_revocations)
+    if backend.SCHEDULER_ENABLED:
+        scheduler.start(backend.get_conn)
+
+def drain(timeout: float) -> None:
+    """Per-worker stop: let a running scheduled job finish, stop the hashing pool, export queued traces, keep the counters"""
+    scheduler.stop(timeout)
+    passwords.shutdown()
+    tracing.shutdown(min(timeout, 5))
+    metrics.stop_flusher()
+
+preload()
@@ -2,7 +2,7 @@ import React, { useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { clearAuth } from '../utils/auth';
 import { clearStoredChatSession } from './Chatbot';
-import { getSecretKey } from '../services/api';
+import { getSecretKey, logout } from '../services/api';
 
 const ProfileMenu = ({ user, onProfileUpdate }) => {
   const [isExpanded, setIsExpanded] = useState(false);
@@ -17,7 +17,12 @@ const ProfileMenu = ({ user, onProfileUpdate }) => {
   });
   const navigate = useNavigate();
 
-  const handleLogout = () => {
+  const handleLogout = async () => {
+    try {
+      await logout(); // Revoke the tokens server-side before forgetting them
+    } catch (error) {
+      console.error('Failed to revoke session:', error);
+    }
     clearAuth(); // Clear all authentication data
     clearStoredChatSession(); // Clear chat session data
     navigate('/login');
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
-import { login } from '../services/api';
+import { login, storeTokens } from '../services/api';
 import { isAuthenticated } from '../utils/auth';
 
 const Login = () => {
@@ -33,7 +33,7 @@ const Login = () => {
 
     try {
       const response = await login(formData);
-      localStorage.setItem('access_token', response.access_token);
+      storeTokens(response);
       navigate('/');
     } catch (err) {
       setError(err.response?.data?.error || 'Login failed. Please check your credentials.');
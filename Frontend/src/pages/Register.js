@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
-import { register } from '../services/api';
+import { register, storeTokens } from '../services/api';
 import { isAuthenticated } from '../utils/auth';
 
 const Register = () => {
@@ -83,8 +83,8 @@ const Register = () => {
       setSecretKey(response.secret_key);
       setShowSecretKey(true);
       
-      // Store access token
-      localStorage.setItem('access_token', response.access_token);
+      // Store access and refresh tokens
+      storeTokens(response);
     } catch (err) {
       setError(err.response?.data?.error || 'Registration failed');
     } finally {
@@ -20,12 +20,58 @@ api.interceptors.request.use((config) => {
   return config;
 });
 
+// Access tokens are short-lived: on a 401, exchange the refresh token for a new pair once
+// and retry. Concurrent 401s share one refresh, since a refresh token only works once.
+let refreshing = null;
+
+export const storeTokens = (data) => {
+  localStorage.setItem('access_token', data.access_token);
+  if (data.refresh_token) {
+    localStorage.setItem('refresh_token', data.refresh_token);
+  }
+};
+
+const refreshTokens = () => {
+  if (!refreshing) {
+    const refreshToken = localStorage.getItem('refresh_token');
+    refreshing = (refreshToken
+      ? axios.post(`${API_BASE_URL}/api/auth/refresh`, { refresh_token: refreshToken })
+      : Promise.reject(new Error('No refresh token'))
+    )
+      .then((response) => {
+        storeTokens(response.data);
+        return response.data.access_token;
+      })
+      .finally(() => {
+        refreshing = null;
+      });
+  }
+  return refreshing;
+};
+
+// Calls that authenticate with credentials rather than the access token: a 401 from
+// them is the answer, not an expired session
+const AUTH_CREDENTIAL_CALLS = ['/api/auth/login', '/api/auth/register', '/api/auth/refresh', '/api/auth/reset-password'];
+
 // Handle auth errors
 api.interceptors.response.use(
   (response) => response,
-  (error) => {
-    if (error.response?.status === 401) {
+  async (error) => {
+    const original = error.config;
+    const isAuthCall = AUTH_CREDENTIAL_CALLS.includes(original?.url);
+    if (error.response?.status === 401 && original && !original._retried && !isAuthCall) {
+      original._retried = true;
+      try {
+        const token = await refreshTokens();
+        original.headers.Authorization = `Bearer ${token}`;
+        return api(original);
+      } catch (refreshError) {
+        // Fall through to the login redirect
+      }
+    }
+    if (error.response?.status === 401 && !isAuthCall) {
       localStorage.removeItem('access_token');
+      localStorage.removeItem('refresh_token');
       window.location.href = '/login';
     }
     return Promise.reject(error);
@@ -71,6 +117,12 @@ export const getSecretKey = async (passwordData) => {
   return response.data;
 };
 
+// Revokes the access token and this session's refresh token on the server
+export const logout = async () => {
+  const response = await api.post('/api/auth/logout', { refresh_token: localStorage.getItem('refresh_token') });
+  return response.data;
+};
+
 // Dashboard API calls
 export const getDashboard = 
   async () => {
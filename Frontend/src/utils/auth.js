@@ -41,9 +41,9 @@ export const isAuthenticated = () => {
     return false;
   }
   
-  // Check if token is expired
+  // Check if token is expired; an expired access token is renewed with the refresh token
   const currentTime = Date.now() / 1000;
-  if (decoded.exp <= currentTime) {
+  if (decoded.exp <= currentTime && !localStorage.getItem('refresh_token')) {
     // Token is expired, remove it
     localStorage.removeItem('access_token');
     return false;
@@ -70,5 +70,6 @@ export const getCurrentUser = () => {
 // Clear authentication data
 export const clearAuth = () => {
   localStorage.removeItem('access_token');
+  localStorage.removeItem('refresh_token');
   localStorage.removeItem('chatSessionId');
 };
\ No newline at end of file